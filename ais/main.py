@@ -3,13 +3,19 @@ AI 查询插件 - 向AI模型提问并返回回复
 """
 
 import asyncio
+import contextlib
+import copy
 import json
+import os
+import time
+from collections import deque
 from pathlib import Path
-from typing import Optional
+from typing import Deque, Dict, List, Optional, Tuple
 
 import aiohttp
 
 from pagermaid.listener import listener
+from pagermaid.hook import Hook
 from pagermaid.enums import Message
 from pagermaid.utils import logs
 
@@ -18,9 +24,87 @@ DATA_DIR = Path("ai_query")
 DATA_FILE = DATA_DIR / "config.json"
 PENDING_SELECTION = {}  # 待选择的模型列表消息
 
+# 密钥池：用量统计的滑动窗口 / 429 未给出 Retry-After 时的冷却时间 / 冷却时间上限（秒）
+KEY_USAGE_WINDOW = 60.0
+KEY_COOLDOWN_DEFAULT = 20.0
+KEY_COOLDOWN_MAX = 300.0
+
+
+def write_json_atomic(path: Path, data, indent: int = 4) -> None:
+    """原子写入 JSON：先写入临时文件再替换原文件，写入中断不会损坏原文件"""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp_path.unlink()
+        raise
+
+
+class JSONFileSaver:
+    """
+    JSON 文件异步保存器
+    在事件循环中保存时，先对数据做快照，再交给线程池原子写入；
+    同一文件的写入串行执行，写入期间的多次保存只写入最新一次
+    """
+
+    def __init__(self, path: Path, indent: int = 4):
+        self.path = path
+        self.indent = indent
+        self._pending = None  # 等待写入的最新数据快照
+        self._task: Optional[asyncio.Task] = None  # 后台写入任务
+
+    def save(self, data) -> None:
+        """提交保存（不在事件循环中时同步写入）"""
+        self._pending = copy.deepcopy(data)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            data, self._pending = self._pending, None
+            write_json_atomic(self.path, data, self.indent)
+            return
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        """依次写入等待中的数据"""
+        loop = asyncio.get_running_loop()
+        while self._pending is not None:
+            data, self._pending = self._pending, None
+            try:
+                await loop.run_in_executor(
+                    None, write_json_atomic, self.path, data, self.indent
+                )
+            except Exception as e:
+                logs.error(f"[AIS] 保存 {self.path.name} 失败: {e}")
+
+    async def flush(self) -> None:
+        """等待尚未完成的写入"""
+        if self._task and not self._task.done():
+            await self._task
+
+
+# 配置保存器（同一文件的保存串行执行）及最近一次保存的配置
+config_saver = JSONFileSaver(DATA_FILE, indent=2)
+_saved_config: Optional[dict] = None
+
+
+@Hook.on_shutdown()
+async def ais_shutdown():
+    """插件关闭时等待配置写入完成"""
+    await config_saver.flush()
+
 
 def load_config() -> dict:
     """加载AI配置"""
+    # 优先使用最近一次保存的配置，避免后台写入完成前读到旧文件
+    if _saved_config is not None:
+        return copy.deepcopy(_saved_config)
     if DATA_FILE.exists():
         try:
             data = json.loads(DATA_FILE.read_text(encoding="utf-8"))
@@ -33,17 +117,105 @@ def load_config() -> dict:
 
 def save_config(config: dict) -> bool:
     """保存AI配置"""
+    global _saved_config
     try:
         DATA_DIR.mkdir(exist_ok=True, parents=True)
-        DATA_FILE.write_text(
-            json.dumps(config, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
+        config_saver.save(config)
+        _saved_config = copy.deepcopy(config)
         return True
     except Exception as e:
         logs.error(f"保存配置失败: {e}")
         return False
 
 
+def parse_api_keys(value: str) -> List[str]:
+    """解析以逗号分隔的多个密钥（去除空白与重复）"""
+    return list(dict.fromkeys(key.strip() for key in value.split(",") if key.strip()))
+
+
+class APIKeyPool:
+    """
+    多个 API 密钥轮换使用
+    每个密钥统计滑动窗口内的请求数与 token 用量，每次选择未在冷却中、负载最低的密钥；
+    收到 429 的密钥按 Retry-After（默认 KEY_COOLDOWN_DEFAULT 秒）冷却，全部冷却中时选择最早恢复的
+    """
+
+    def __init__(self, keys: List[str], window: float = KEY_USAGE_WINDOW):
+        self.keys = keys
+        self.window = window
+        self._requests: Dict[str, Deque[float]] = {key: deque() for key in keys}
+        self._tokens: Dict[str, Deque[Tuple[float, int]]] = {
+            key: deque() for key in keys
+        }
+        self._inflight: Dict[str, int] = dict.fromkeys(keys, 0)
+        self._cooldown_until: Dict[str, float] = dict.fromkeys(keys, 0.0)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _load(self, key: str, now: float) -> Tuple[int, int]:
+        """(窗口内请求数 + 进行中请求数, 窗口内 token 数)"""
+        requests = self._requests[key]
+        tokens = self._tokens[key]
+        while requests and requests[0] <= now - self.window:
+            requests.popleft()
+        while tokens and tokens[0][0] <= now - self.window:
+            tokens.popleft()
+        return len(requests) + self._inflight[key], sum(count for _, count in tokens)
+
+    def acquire(self) -> str:
+        """选择负载最低的可用密钥并计入一次请求，请求结束后需调用 release"""
+        now = time.monotonic()
+        ready = [key for key in self.keys if self._cooldown_until[key] <= now]
+        if ready:
+            key = min(ready, key=lambda k: self._load(k, now))
+        else:
+            key = min(self.keys, key=self._cooldown_until.__getitem__)
+        self._requests[key].append(now)
+        self._inflight[key] += 1
+        return key
+
+    def release(self, key: str, tokens: int = 0) -> None:
+        """请求结束，记录其 token 用量"""
+        self._inflight[key] -= 1
+        if tokens:
+            self._tokens[key].append((time.monotonic(), tokens))
+
+    def cooldown(self, key: str, seconds: Optional[float] = None) -> None:
+        """密钥被限流，在冷却结束前不再优先选择"""
+        seconds = min(
+            KEY_COOLDOWN_DEFAULT if seconds is None else seconds, KEY_COOLDOWN_MAX
+        )
+        self._cooldown_until[key] = time.monotonic() + seconds
+        if len(self.keys) > 1:
+            logs.warning(f"[AIS] 密钥 {key[:8]}... 被限流，冷却 {seconds:.0f} 秒")
+
+    def available(self) -> bool:
+        """是否有未在冷却中的密钥"""
+        now = time.monotonic()
+        return any(until <= now for until in self._cooldown_until.values())
+
+
+# 配置的密钥字符串 -> 密钥池（用量统计跨请求保留）
+_key_pools: Dict[str, APIKeyPool] = {}
+
+
+def get_key_pool(api_key: str) -> APIKeyPool:
+    """获取密钥对应的密钥池"""
+    pool = _key_pools.get(api_key)
+    if pool is None:
+        pool = _key_pools[api_key] = APIKeyPool(parse_api_keys(api_key) or [api_key])
+    return pool
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（只支持秒数）"""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
 def get_current_model(config: dict) -> str:
     """获取当前使用的模型"""
     return config.get("current_model", "") or config.get("model", "")
@@ -52,13 +224,9 @@ def get_current_model(config: dict) -> str:
 async def call_ai_api(
     api_url: str, api_key: str, model: str, prompt: str
 ) -> Optional[str]:
-    """调用AI API获取回复"""
+    """调用AI API获取回复（配置多个密钥时选择负载最低的密钥，被限流时换用其他密钥）"""
+    key_pool = get_key_pool(api_key)
     try:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-
         # 支持OpenAI格式的API
         # 添加system message以禁用thinking过程，只输出最终答案
         data = {
@@ -73,24 +241,47 @@ async def call_ai_api(
         }
 
         async with aiohttp.ClientSession() as session:
-            async with session.post(
-                api_url, headers=headers, json=data, timeout=60
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    # 尝试从不同格式中提取回复
-                    if "choices" in result and len(result["choices"]) > 0:
-                        return result["choices"][0]["message"]["content"]
-                    elif "message" in result:
-                        return result["message"]["content"]
-                    elif "content" in result:
-                        return result["content"]
-                    else:
-                        return str(result)
-                else:
-                    error_text = await response.text()
-                    logs.error(f"API调用失败: {response.status} - {error_text}")
-                    return f"API调用失败: {response.status}"
+            # 每个密钥最多尝试一次
+            for _ in range(len(key_pool)):
+                key = key_pool.acquire()
+                headers = {
+                    "Authorization": f"Bearer {key}",
+                    "Content-Type": "application/json",
+                }
+                tokens = 0
+                try:
+                    async with session.post(
+                        api_url, headers=headers, json=data, timeout=60
+                    ) as response:
+                        if response.status == 200:
+                            result = await response.json()
+                            if isinstance(result, dict):
+                                tokens = (result.get("usage") or {}).get(
+                                    "total_tokens"
+                                ) or 0
+                            # 尝试从不同格式中提取回复
+                            if "choices" in result and len(result["choices"]) > 0:
+                                return result["choices"][0]["message"]["content"]
+                            elif "message" in result:
+                                return result["message"]["content"]
+                            elif "content" in result:
+                                return result["content"]
+                            else:
+                                return str(result)
+                        error_text = await response.text()
+                        logs.error(f"API调用失败: {response.status} - {error_text}")
+                        if response.status == 429:
+                            key_pool.cooldown(
+                                key,
+                                parse_retry_after(response.headers.get("Retry-After")),
+                            )
+                            # 还有未被限流的密钥时换用
+                            if key_pool.available():
+                                continue
+                        return f"API调用失败: {response.status}"
+                finally:
+                    key_pool.release(key, tokens)
+            return "API调用失败: 429"
     except asyncio.TimeoutError:
         return "请求超时"
     except Exception as e:
@@ -118,7 +309,7 @@ async def ais_query(message: Message):
 📝 命令格式：
   ,ais <文本>              - 向AI提问
   ,ais help                - 显示此帮助
-  ,ais set <api_url> <api_key>  - 设置API基础配置
+  ,ais set <api_url> <api_key>  - 设置API基础配置（多个密钥以逗号分隔）
   ,ais models              - 查看/切换模型
   ,ais model add <model_name>   - 添加新模型
   ,ais model del <model_name>   - 删除模型
@@ -126,7 +317,7 @@ async def ais_query(message: Message):
 ⚙️ 配置说明：
   使用 ,ais set 命令配置API基础信息：
   • api_url: AI服务的API地址
-  • api_key: API访问密钥
+  • api_key: API访问密钥，多个密钥以逗号分隔时自动选择负载最低的密钥，被限流时换用其他密钥
 
 💡 使用示例：
   ,ais 今天天气怎么样
@@ -345,7 +536,7 @@ async def ais_query(message: Message):
             await message.edit(
                 f"✅ API配置保存成功！\n\n"
                 f"🔗 API URL: {api_url}\n"
-                f"🔑 API Key: {api_key[:8]}...\n"
+                f"🔑 API Key: {api_key[:8]}...（共 {len(parse_api_keys(api_key))} 个）\n"
                 f"🤖 当前模型: {current_model}\n\n"
                 f"💡 使用 ,ais model add <模型名> 添加更多模型"
             )
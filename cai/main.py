@@ -5,7 +5,9 @@
 """
 
 import asyncio
+import copy
 import json
+import os
 import time
 from pathlib import Path
 from typing import List, Dict, Optional, Union
@@ -31,6 +33,65 @@ plugin_dir = Path(__file__).parent
 config_file = plugin_dir / "cai_config.json"
 
 
+def write_json_atomic(path: Path, data, indent: int = 4) -> None:
+    """原子写入 JSON：先写入临时文件再替换原文件，写入中断不会损坏原文件"""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(OSError):
+            tmp_path.unlink()
+        raise
+
+
+class JSONFileSaver:
+    """
+    JSON 文件异步保存器
+    在事件循环中保存时，先对数据做快照，再交给线程池原子写入；
+    同一文件的写入串行执行，写入期间的多次保存只写入最新一次
+    """
+
+    def __init__(self, path: Path, indent: int = 4):
+        self.path = path
+        self.indent = indent
+        self._pending = None  # 等待写入的最新数据快照
+        self._task: Optional[asyncio.Task] = None  # 后台写入任务
+
+    def save(self, data) -> None:
+        """提交保存（不在事件循环中时同步写入）"""
+        self._pending = copy.deepcopy(data)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            data, self._pending = self._pending, None
+            write_json_atomic(self.path, data, self.indent)
+            return
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        """依次写入等待中的数据"""
+        loop = asyncio.get_running_loop()
+        while self._pending is not None:
+            data, self._pending = self._pending, None
+            try:
+                await loop.run_in_executor(
+                    None, write_json_atomic, self.path, data, self.indent
+                )
+            except Exception as e:
+                logs.error(f"[CAI] 保存 {self.path.name} 失败: {e}")
+
+    async def flush(self) -> None:
+        """等待尚未完成的写入"""
+        if self._task and not self._task.done():
+            await self._task
+
+
 class CAIConfig:
     """自动点踩配置管理类"""
 
@@ -40,6 +101,7 @@ class CAIConfig:
         self.is_premium: bool = False  # 是否为 Telegram Premium 会员
         self.targets: List[Dict] = []  # 目标列表
         self.stats: Dict = {"total_reacts": 0}  # 统计信息
+        self.saver = JSONFileSaver(config_file)
         self.load()
 
     def load(self) -> None:
@@ -76,19 +138,15 @@ class CAIConfig:
     def save(self) -> bool:
         """保存配置到文件"""
         try:
-            with open(config_file, "w", encoding="utf-8") as f:
-                json.dump(
-                    {
-                        "enabled": self.enabled,
-                        "is_premium": self.is_premium,
-                        "emojis": self.emojis,
-                        "targets": self.targets,
-                        "stats": self.stats,
-                    },
-                    f,
-                    indent=4,
-                    ensure_ascii=False,
-                )
+            self.saver.save(
+                {
+                    "enabled": self.enabled,
+                    "is_premium": self.is_premium,
+                    "emojis": self.emojis,
+                    "targets": self.targets,
+                    "stats": self.stats,
+                }
+            )
             return True
         except Exception as e:
             logs.error(f"[CAI] 保存配置失败: {e}")
@@ -309,6 +367,8 @@ async def cai_startup():
 @Hook.on_shutdown()
 async def cai_shutdown():
     """插件关闭时执行"""
+    # 等待配置写入完成
+    await config.saver.flush()
     logs.info("[CAI] 自动点踩插件已卸载")
 
 
@@ -5,11 +5,17 @@ JPM 插件 - 关键词触发回复
 
 import asyncio
 import contextlib
+import copy
 import json
+import os
 import random
+import re
+import struct
 import time
+from array import array
+from collections import OrderedDict, deque
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple, Deque, Iterator, BinaryIO, Union
 
 from pagermaid.listener import listener
 from pagermaid.hook import Hook
@@ -21,24 +27,65 @@ from pagermaid.utils import logs
 plugin_dir = Path(__file__).parent
 config_file = plugin_dir / "jpm_config.json"
 trigger_log_file = plugin_dir / "jpm_trigger_log.json"
+trigger_journal_file = plugin_dir / "jpm_trigger_journal.jsonl"
+# 外部模板语料库（JSONL，每行一个 {"id", "mode", "content"}）及其偏移索引
+template_corpus_file = plugin_dir / "jpm_templates.jsonl"
+template_index_file = plugin_dir / "jpm_templates.idx"
 
 # 默认频率限制（秒）
 DEFAULT_RATE_LIMIT = 3600
 
+# 同一群组内模板不重复的最小间隔（次数），超过模板总数一半时按一半计算
+TEMPLATE_NO_REPEAT_WINDOW = 10
+
+# 已解码并预编译的模板缓存数量
+TEMPLATE_CACHE_SIZE = 256
+
+# 触发时检查模板语料库是否变化的最小间隔（秒），检查与重建索引在线程池中进行
+TEMPLATE_CHECK_INTERVAL = 60
+
+# 单人模板占位符（{target_user} 同样替换为 name）
+SINGLE_PLACEHOLDER = re.compile(r"\{(?:name|target_user)\}")
+
+# 触发日志压缩：快照后追加达到该条数时立即压缩，否则首次追加后等待该秒数压缩
+TRIGGER_COMPACT_THRESHOLD = 200
+TRIGGER_COMPACT_INTERVAL = 600
+# 状态中统计最近触发次数的时间窗口（秒）
+TRIGGER_RECENT_WINDOW = 86400
+
+# 每个 (群组, 用户) 缓存的最近消息ID数量
+RECENT_MESSAGE_BUFFER_SIZE = 20
+
+# 已解析消息对象缓存：最大条数 / 有效期（秒）
+MESSAGE_CACHE_SIZE = 128
+MESSAGE_CACHE_TTL = 1800
+
+# 锚点延迟写回：首次更新后最多等待的秒数 / 累计更新达到该次数时立即写回
+ANCHOR_FLUSH_INTERVAL = 60
+ANCHOR_FLUSH_MAX_DIRTY = 20
+
 
 @Hook.on_startup()
 async def plugin_startup():
     """插件初始化"""
+    await template_generator.load_templates()
     logs.info("JPM 插件已加载")
 
 
 @Hook.on_shutdown()
 async def plugin_shutdown():
     """插件关闭"""
+    # 写回尚未落盘的锚点更新，并将触发日志压缩为快照
+    config_manager.flush()
+    trigger_log.compact()
+    await config_manager.saver.flush()
+    await trigger_log.saver.flush()
+    template_generator.corpus.close()
     logs.info("JPM 插件已卸载")
 
 
-# 模板数据（来自 sao_nkr 发癫文案）
+# 内置模板数据（来自 sao_nkr 发癫文案）
+# 仅在外部语料库不存在时写入 jpm_templates.jsonl，运行时从语料库按需读取
 TEMPLATES_DATA = {
     "templates": [
         # 单人模板（21条）
@@ -252,38 +299,390 @@ TEMPLATES_DATA = {
 }
 
 
+def write_json_atomic(path: Path, data, indent: int = 4) -> None:
+    """原子写入 JSON：先写入临时文件再替换原文件，写入中断不会损坏原文件"""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp_path.unlink()
+        raise
+
+
+class JSONFileSaver:
+    """
+    JSON 文件异步保存器
+    在事件循环中保存时，先对数据做快照，再交给线程池原子写入；
+    同一文件的写入串行执行，写入期间的多次保存只写入最新一次
+    """
+
+    def __init__(self, path: Path, indent: int = 4):
+        self.path = path
+        self.indent = indent
+        self._pending = None  # 等待写入的最新数据快照
+        self._task: Optional[asyncio.Task] = None  # 后台写入任务
+
+    def save(self, data) -> None:
+        """提交保存（不在事件循环中时同步写入）"""
+        self._pending = copy.deepcopy(data)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            data, self._pending = self._pending, None
+            write_json_atomic(self.path, data, self.indent)
+            return
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        """依次写入等待中的数据"""
+        loop = asyncio.get_running_loop()
+        while self._pending is not None:
+            data, self._pending = self._pending, None
+            try:
+                await loop.run_in_executor(
+                    None, write_json_atomic, self.path, data, self.indent
+                )
+            except Exception as e:
+                logs.error(f"[JPM] 保存 {self.path.name} 失败: {e}")
+
+    async def flush(self) -> None:
+        """等待尚未完成的写入"""
+        if self._task and not self._task.done():
+            await self._task
+
+
+class MessageCache:
+    """已解析消息对象的 LRU 缓存（带有效期），避免触发时重复拉取锚点消息"""
+
+    def __init__(
+        self, maxsize: int = MESSAGE_CACHE_SIZE, ttl: float = MESSAGE_CACHE_TTL
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[Tuple[int, int], Tuple[float, Message]]" = (
+            OrderedDict()
+        )  # (chat_id, message_id) -> (过期时间, 消息)
+
+    def put(self, message: Message) -> None:
+        """缓存一条消息"""
+        key = (message.chat.id, message.id)
+        self._items[key] = (time.monotonic() + self.ttl, message)
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, chat_id: int, message_id: int) -> Optional[Message]:
+        """获取缓存的消息，不存在或已过期时返回 None"""
+        item = self._items.get((chat_id, message_id))
+        if item is None:
+            return None
+        expires_at, message = item
+        if expires_at < time.monotonic():
+            del self._items[(chat_id, message_id)]
+            return None
+        self._items.move_to_end((chat_id, message_id))
+        return message
+
+    def discard(self, chat_id: int, message_id: int) -> None:
+        """移除缓存的消息"""
+        self._items.pop((chat_id, message_id), None)
+
+
+class RecentMessageBuffer:
+    """目标用户最近消息ID的环形缓冲区（仅记录被关键词监听的用户）"""
+
+    def __init__(self, maxlen: int = RECENT_MESSAGE_BUFFER_SIZE):
+        self.maxlen = maxlen
+        self._buffers: Dict[
+            Tuple[int, int], Deque[int]
+        ] = {}  # (chat_id, user_id) -> 最近消息ID（旧 -> 新）
+
+    def push(self, chat_id: int, user_id: int, message_id: int) -> None:
+        """记录一条新消息"""
+        buffer = self._buffers.get((chat_id, user_id))
+        if buffer is None:
+            buffer = self._buffers[(chat_id, user_id)] = deque(maxlen=self.maxlen)
+        if not buffer or buffer[-1] != message_id:
+            buffer.append(message_id)
+
+    def recent(self, chat_id: int, user_id: int) -> List[int]:
+        """获取缓存的消息ID（新 -> 旧）"""
+        buffer = self._buffers.get((chat_id, user_id))
+        return list(reversed(buffer)) if buffer else []
+
+    def discard(self, chat_id: int, user_id: int, message_id: int) -> None:
+        """移除已失效（被删除或无法获取）的消息ID"""
+        buffer = self._buffers.get((chat_id, user_id))
+        if buffer and message_id in buffer:
+            buffer.remove(message_id)
+
+
+class TemplateCorpus:
+    """
+    外部模板语料库：按模式维护行偏移索引，按需读取并解码单条模板
+    scan() 读取文件，应在线程池中调用；apply() 在事件循环中切换到新的索引
+    """
+
+    # 索引文件头：魔数, 语料库大小, 语料库修改时间(ns), 单人模板数, 双人模板数
+    INDEX_HEADER = struct.Struct("<4sQqII")
+    INDEX_MAGIC = b"JPM1"
+
+    def __init__(self, corpus_path: Path, index_path: Path):
+        self.corpus_path = corpus_path
+        self.index_path = index_path
+        self.offsets: Dict[str, array] = {"single": array("Q"), "dual": array("Q")}
+        self._signature: Optional[Tuple[int, int]] = None
+        self._file: Optional[BinaryIO] = None  # 语料库文件句柄，随索引一起切换
+
+    @property
+    def loaded(self) -> bool:
+        """是否已加载过索引"""
+        return self._signature is not None
+
+    def count(self, mode: str) -> int:
+        """获取指定模式的模板数量"""
+        return len(self.offsets[mode])
+
+    def scan(self) -> Optional[Tuple[Tuple[int, int], Dict[str, array], BinaryIO]]:
+        """
+        检查语料库文件，变化时加载或重建索引并打开新的文件句柄
+        返回: (文件签名, 偏移索引, 文件句柄)，未变化或读取失败时返回 None
+        """
+        try:
+            if not self.corpus_path.exists():
+                self._seed()
+            stat = self.corpus_path.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature == self._signature:
+                return None
+            offsets = self._load_index(signature)
+            if offsets is None:
+                offsets = self._build_index(signature)
+            return signature, offsets, open(self.corpus_path, "rb")
+        except Exception as e:
+            logs.error(f"[JPM] 读取模板语料库失败: {e}")
+            return None
+
+    def apply(
+        self,
+        signature: Tuple[int, int],
+        offsets: Dict[str, array],
+        file: BinaryIO,
+    ) -> None:
+        """切换到 scan() 得到的索引与文件句柄"""
+        old_file, self._file = self._file, file
+        self.offsets = offsets
+        self._signature = signature
+        if old_file is not None:
+            old_file.close()
+
+    def close(self) -> None:
+        """关闭语料库文件句柄"""
+        if self._file is not None:
+            file, self._file = self._file, None
+            file.close()
+
+    def get(self, mode: str, index: int) -> Optional[str]:
+        """读取并解码指定模板"""
+        try:
+            self._file.seek(self.offsets[mode][index])
+            return json.loads(self._file.readline())["content"]
+        except Exception as e:
+            logs.error(f"[JPM] 读取模板失败: {e}")
+            return None
+
+    def _seed(self) -> None:
+        """语料库不存在时写入内置模板"""
+        with open(self.corpus_path, "w", encoding="utf-8") as f:
+            for template in TEMPLATES_DATA["templates"]:
+                f.write(json.dumps(template, ensure_ascii=False) + "\n")
+        logs.info(f"[JPM] 已生成模板语料库: {self.corpus_path.name}")
+
+    def _load_index(self, signature: Tuple[int, int]) -> Optional[Dict[str, array]]:
+        """从索引文件加载偏移，索引与语料库不一致时返回 None"""
+        try:
+            with open(self.index_path, "rb") as f:
+                header = f.read(self.INDEX_HEADER.size)
+                magic, size, mtime_ns, single_count, dual_count = (
+                    self.INDEX_HEADER.unpack(header)
+                )
+                if magic != self.INDEX_MAGIC or (size, mtime_ns) != signature:
+                    return None
+                single, dual = array("Q"), array("Q")
+                single.fromfile(f, single_count)
+                dual.fromfile(f, dual_count)
+        except Exception:
+            return None
+        return {"single": single, "dual": dual}
+
+    def _build_index(self, signature: Tuple[int, int]) -> Dict[str, array]:
+        """扫描语料库生成偏移索引并写入索引文件"""
+        offsets = {"single": array("Q"), "dual": array("Q")}
+        offset = 0
+        with open(self.corpus_path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        mode = json.loads(line).get("mode")
+                    except ValueError:
+                        mode = None
+                    if mode in offsets:
+                        offsets[mode].append(offset)
+                    else:
+                        logs.warning(f"[JPM] 跳过无效模板行，偏移: {offset}")
+                offset += len(line)
+
+        try:
+            with open(self.index_path, "wb") as f:
+                f.write(
+                    self.INDEX_HEADER.pack(
+                        self.INDEX_MAGIC,
+                        *signature,
+                        len(offsets["single"]),
+                        len(offsets["dual"]),
+                    )
+                )
+                offsets["single"].tofile(f)
+                offsets["dual"].tofile(f)
+        except Exception as e:
+            logs.error(f"[JPM] 保存模板索引失败: {e}")
+        return offsets
+
+
 class TemplateGenerator:
     """模板生成器"""
 
     def __init__(self):
-        self.single_templates: List[str] = []
-        self.dual_templates: List[str] = []
-        self.load_templates()
-
-    def load_templates(self):
-        """加载模板"""
-        for template in TEMPLATES_DATA["templates"]:
-            if template["mode"] == "single":
-                self.single_templates.append(template["content"])
-            else:
-                self.dual_templates.append(template["content"])
+        self.corpus = TemplateCorpus(template_corpus_file, template_index_file)
+        # (模式, 模板序号) -> 预编译模板（LRU）
+        # 单人模板按占位符切分为文本片段，渲染时 name.join(片段)
+        # 双人模板有两种占位符，切分后拼接反而慢于两次 str.replace，只缓存解码后的内容
+        self._compiled: "OrderedDict[Tuple[str, int], Union[tuple, str]]" = (
+            OrderedDict()
+        )
+        # (模式, 群组ID) -> 待抽取的模板序号牌堆 / 最近抽取过的模板序号
+        self._decks: Dict[Tuple[str, Optional[int]], List[int]] = {}
+        self._recent: Dict[Tuple[str, Optional[int]], Deque[int]] = {}
+        self._checked_at: float = 0.0  # 上次检查语料库的时间（monotonic）
+        self._load_task: Optional[asyncio.Task] = None  # 后台检查任务
+
+    async def load_templates(self) -> None:
+        """在线程池中检查语料库，变化时（含首次加载）切换到新的索引"""
+        self._checked_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, self.corpus.scan)
+        if state is None:
+            return
+        self.corpus.apply(*state)
+        self._compiled.clear()
+        self._decks.clear()
+        self._recent.clear()
         logs.info(
-            f"已加载 {len(self.single_templates)} 个单人模板和 {len(self.dual_templates)} 个双人模板"
+            f"已加载 {self.corpus.count('single')} 个单人模板和 {self.corpus.count('dual')} 个双人模板"
         )
 
-    def generate_single(self, name: str) -> str:
+    async def ensure_loaded(self) -> None:
+        """首次使用前等待语料库加载完成，之后只在后台检查变化"""
+        if self.corpus.loaded:
+            return
+        if self._load_task is None or self._load_task.done():
+            self._load_task = asyncio.get_running_loop().create_task(
+                self.load_templates()
+            )
+        await asyncio.shield(self._load_task)
+
+    def schedule_check(self) -> None:
+        """距上次检查超过 TEMPLATE_CHECK_INTERVAL 时在后台检查语料库，本次仍使用当前索引"""
+        if time.monotonic() - self._checked_at < TEMPLATE_CHECK_INTERVAL:
+            return
+        if self._load_task is not None and not self._load_task.done():
+            return
+        try:
+            self._load_task = asyncio.get_running_loop().create_task(
+                self.load_templates()
+            )
+        except RuntimeError:
+            pass
+
+    def _compile(self, mode: str, index: int) -> Optional[Union[tuple, str]]:
+        """读取并预编译模板（双人模板只解码），结果放入 LRU 缓存"""
+        key = (mode, index)
+        parts = self._compiled.get(key)
+        if parts is not None:
+            self._compiled.move_to_end(key)
+            return parts
+
+        content = self.corpus.get(mode, index)
+        if content is None:
+            return None
+        parts = tuple(SINGLE_PLACEHOLDER.split(content)) if mode == "single" else content
+        self._compiled[key] = parts
+        if len(self._compiled) > TEMPLATE_CACHE_SIZE:
+            self._compiled.popitem(last=False)
+        return parts
+
+    def _draw(self, mode: str, count: int, chat_id: Optional[int]) -> int:
+        """洗牌抽样：每个群组每种模式独立维护一副牌，抽完后重新洗牌"""
+        key = (mode, chat_id)
+        deck = self._decks.get(key)
+        if not deck:
+            deck = self._decks[key] = self._shuffle(key, count)
+
+        index = deck.pop()
+        self._recent[key].append(index)
+        return index
+
+    def _shuffle(self, key: Tuple[str, Optional[int]], count: int) -> List[int]:
+        """
+        生成新牌堆（从末尾抽取）
+        最近抽过的模板只插入到满足间隔的位置，
+        保证同一模板在不重复窗口内不会再次出现
+        """
+        recent = self._recent.get(key)
+        if recent is None:
+            recent = self._recent[key] = deque(maxlen=TEMPLATE_NO_REPEAT_WINDOW)
+
+        window = min(TEMPLATE_NO_REPEAT_WINDOW, count // 2)
+        blocked = list(recent)[-window:] if window else []
+        blocked_set = set(blocked)
+        order = [i for i in range(count) if i not in blocked_set]
+        random.shuffle(order)
+        # age 为该模板被抽取后又抽过的次数，新位置需不小于 window - age
+        for age, index in enumerate(reversed(blocked)):
+            order.insert(random.randint(window - age, len(order)), index)
+        order.reverse()
+        return order
+
+    def generate_single(self, name: str, chat_id: Optional[int] = None) -> str:
         """生成单人回复"""
-        if not self.single_templates:
+        self.schedule_check()
+        count = self.corpus.count("single")
+        parts = None
+        if count:
+            parts = self._compile("single", self._draw("single", count, chat_id))
+        if not parts:
             return f"{name} 收到了消息"
-        template = random.choice(self.single_templates)
-        return template.replace("{name}", name).replace("{target_user}", name)
+        return name.join(parts)
 
-    def generate_dual(self, keyword: str, target_user: str) -> str:
+    def generate_dual(
+        self, keyword: str, target_user: str, chat_id: Optional[int] = None
+    ) -> str:
         """生成双人回复（{name} 是关键词，{target} 是目标用户）"""
-        if not self.dual_templates:
+        self.schedule_check()
+        count = self.corpus.count("dual")
+        parts = None
+        if count:
+            parts = self._compile("dual", self._draw("dual", count, chat_id))
+        if not parts:
             return f"{keyword} 和 {target_user} 的故事"
-        template = random.choice(self.dual_templates)
-        return template.replace("{name}", keyword).replace("{target}", target_user)
+        return parts.replace("{name}", keyword).replace("{target}", target_user)
 
 
 class JPMConfigManager:
@@ -295,6 +694,12 @@ class JPMConfigManager:
         self.keywords: Dict[
             str, Dict
         ] = {}  # keyword -> {target_user_id, target_chat_id, rate_limit_seconds, anchor_message_id}
+        self.saver = JSONFileSaver(config_file)
+        self._target_index: Dict[
+            Tuple[int, int], List[str]
+        ] = {}  # (target_user_id, target_chat_id) -> [keyword, ...]
+        self._dirty_count: int = 0  # 尚未写回文件的锚点更新次数
+        self._flush_task: Optional[asyncio.Task] = None  # 延迟写回任务
         self.load()
 
     def load(self) -> None:
@@ -315,27 +720,71 @@ class JPMConfigManager:
                 self.keywords = {}
         else:
             self.keywords = {}
+        self._rebuild_index()
+
+    def _rebuild_index(self) -> None:
+        """重建 (目标用户ID, 目标群组ID) -> 关键词列表 的索引"""
+        index: Dict[Tuple[int, int], List[str]] = {}
+        for keyword, config in self.keywords.items():
+            key = (config["target_user_id"], config["target_chat_id"])
+            index.setdefault(key, []).append(keyword)
+        self._target_index = index
+
+    def get_keywords_for_target(self, user_id: int, chat_id: int) -> List[str]:
+        """获取以指定用户和群组为目标的所有关键词"""
+        return self._target_index.get((user_id, chat_id), [])
 
     def save(self) -> bool:
         """保存配置到文件"""
         try:
-            with open(config_file, "w", encoding="utf-8") as f:
-                json.dump(
-                    {
-                        "enabled": self.enabled,
-                        "owner_id": self.owner_id,
-                        "keywords": self.keywords,
-                    },
-                    f,
-                    indent=4,
-                    ensure_ascii=False,
-                )
+            self.saver.save(
+                {
+                    "enabled": self.enabled,
+                    "owner_id": self.owner_id,
+                    "keywords": self.keywords,
+                }
+            )
+            self._dirty_count = 0
             logs.info("JPM 配置已保存")
             return True
         except Exception as e:
             logs.error(f"保存 JPM 配置失败: {e}")
             return False
 
+    def mark_anchor_dirty(self) -> None:
+        """
+        标记锚点已在内存中更新，延迟写回文件
+        累计更新达到 ANCHOR_FLUSH_MAX_DIRTY 次时立即写回，
+        否则在 ANCHOR_FLUSH_INTERVAL 秒后统一写回
+        """
+        self._dirty_count += 1
+        if self._dirty_count >= ANCHOR_FLUSH_MAX_DIRTY:
+            self.save()
+            return
+
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(
+                    self._delayed_flush()
+                )
+            except RuntimeError:
+                # 不在事件循环中，直接写回
+                self.save()
+
+    async def _delayed_flush(self) -> None:
+        """等待写回间隔后写回锚点更新"""
+        await asyncio.sleep(ANCHOR_FLUSH_INTERVAL)
+        self.flush()
+
+    def flush(self) -> None:
+        """立即写回尚未落盘的锚点更新"""
+        if self._flush_task and not self._flush_task.done():
+            if self._flush_task is not asyncio.current_task():
+                self._flush_task.cancel()
+        self._flush_task = None
+        if self._dirty_count:
+            self.save()
+
     def add_keyword(
         self,
         keyword: str,
@@ -361,6 +810,7 @@ class JPMConfigManager:
             "rate_limit_seconds": rate_limit,
             "anchor_message_id": existing_anchor,
         }
+        self._rebuild_index()
         self.save()
         return f"关键词 `{keyword}` 配置已更新"
 
@@ -393,6 +843,7 @@ class JPMConfigManager:
         """删除关键词配置"""
         if keyword in self.keywords:
             del self.keywords[keyword]
+            self._rebuild_index()
             self.save()
             return True, f"关键词 `{keyword}` 已删除"
         return False, f"关键词 `{keyword}` 不存在"
@@ -414,33 +865,169 @@ class JPMConfigManager:
 
 
 class TriggerLogManager:
-    """触发记录管理类"""
+    """
+    触发记录管理类
+    每次触发向日志文件追加一行，启动时从快照加载并重放快照之后的日志，
+    后台定期将状态压缩为快照；日志本身保留完整的触发历史，
+    最近触发次数由内存中的时间窗口统计（随快照保存），不读取日志
+    """
 
     def __init__(self):
         self.logs: Dict[str, float] = {}  # keyword -> last_trigger_time
+        self._journal_offset: int = 0  # 日志文件中已记录的字节数
+        self._recent: Deque[float] = deque()  # 时间窗口内的触发时间（升序）
+        self._pending: int = 0  # 快照之后追加的记录数
+        self._compact_task: Optional[asyncio.Task] = None  # 延迟压缩任务
+        self._reserved: Dict[str, float] = {}  # keyword -> 非主人预约的触发时间
+        self._inflight: Dict[str, int] = {}  # keyword -> 进行中的触发数
+        self.saver = JSONFileSaver(trigger_log_file)
         self.load()
 
     def load(self) -> None:
-        """从文件加载触发记录"""
+        """从快照加载触发记录，并重放快照之后追加的日志"""
+        self.logs = {}
+        self._recent = deque()
+        offset = 0
         if trigger_log_file.exists():
             try:
                 with open(trigger_log_file, "r", encoding="utf-8") as f:
-                    self.logs = json.load(f)
-                logs.info(f"触发记录已加载，共 {len(self.logs)} 条")
+                    data = json.load(f)
+                if isinstance(data.get("logs"), dict):
+                    self.logs = data["logs"]
+                    offset = data.get("journal_offset", 0)
+                    self._recent.extend(data.get("recent", []))
+                else:
+                    # 兼容旧格式：keyword -> last_trigger_time
+                    self.logs = data
             except Exception as e:
                 logs.error(f"加载触发记录失败: {e}")
                 self.logs = {}
+
+        replayed = self._replay(offset)
+        self._prune_recent()
+        logs.info(f"触发记录已加载，共 {len(self.logs)} 条，重放日志 {replayed} 条")
+
+    def _replay(self, offset: int) -> int:
+        """从指定偏移重放日志，返回重放的记录数"""
+        self._journal_offset = 0
+        self._pending = 0
+        if not trigger_journal_file.exists():
+            return 0
+
+        try:
+            size = trigger_journal_file.stat().st_size
+            if offset > size:
+                # 日志被替换或截断，从头重放
+                offset = 0
+            with open(trigger_journal_file, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # 写入中断留下的不完整行
+                    offset += len(line)
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    self._pending += 1
+            if offset < size:
+                with open(trigger_journal_file, "r+b") as f:
+                    f.truncate(offset)
+        except Exception as e:
+            logs.error(f"重放触发日志失败: {e}")
+
+        self._journal_offset = offset
+        return self._pending
+
+    def _apply(self, entry: Dict) -> None:
+        """将一条日志应用到内存状态"""
+        if entry.get("cleared"):
+            self.logs.pop(entry["keyword"], None)
         else:
-            self.logs = {}
+            self.logs[entry["keyword"]] = entry["time"]
+            self._recent.append(entry["time"])
+
+    def _prune_recent(self) -> None:
+        """移出时间窗口之外的触发时间"""
+        cutoff = time.time() - TRIGGER_RECENT_WINDOW
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+
+    def recent_count(self) -> int:
+        """最近 TRIGGER_RECENT_WINDOW 秒内的触发次数"""
+        self._prune_recent()
+        return len(self._recent)
+
+    def _append(self, entry: Dict) -> None:
+        """追加一条日志并更新内存状态"""
+        self._apply(entry)
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            with open(trigger_journal_file, "ab") as f:
+                f.write(line)
+            self._journal_offset += len(line)
+            self._pending += 1
+        except Exception as e:
+            logs.error(f"写入触发日志失败: {e}")
+            return
+        self._schedule_compaction()
+
+    def _schedule_compaction(self) -> None:
+        """追加达到阈值时立即压缩，否则延迟压缩"""
+        if self._pending >= TRIGGER_COMPACT_THRESHOLD:
+            self.compact()
+            return
+
+        if self._compact_task is None or self._compact_task.done():
+            try:
+                self._compact_task = asyncio.get_running_loop().create_task(
+                    self._delayed_compact()
+                )
+            except RuntimeError:
+                self.compact()
+
+    async def _delayed_compact(self) -> None:
+        """等待压缩间隔后压缩"""
+        await asyncio.sleep(TRIGGER_COMPACT_INTERVAL)
+        self.compact()
+
+    def compact(self) -> None:
+        """将当前状态写入快照，之后启动只需重放新追加的日志"""
+        if self._compact_task and not self._compact_task.done():
+            if self._compact_task is not asyncio.current_task():
+                self._compact_task.cancel()
+        self._compact_task = None
+        if self._pending:
+            self.save()
 
     def save(self) -> None:
-        """保存触发记录到文件"""
+        """保存触发记录快照到文件"""
+        self._prune_recent()
         try:
-            with open(trigger_log_file, "w", encoding="utf-8") as f:
-                json.dump(self.logs, f, indent=4)
+            self.saver.save(
+                {
+                    "logs": self.logs,
+                    "journal_offset": self._journal_offset,
+                    "recent": list(self._recent),
+                }
+            )
+            self._pending = 0
         except Exception as e:
             logs.error(f"保存触发记录失败: {e}")
 
+    def iter_history(self, since: float = 0) -> Iterator[Dict]:
+        """按时间顺序遍历触发历史（不含清除记录）"""
+        if not trigger_journal_file.exists():
+            return
+        with open(trigger_journal_file, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if not entry.get("cleared") and entry.get("time", 0) >= since:
+                    yield entry
+
     def can_trigger(self, keyword: str, is_owner: bool) -> tuple[bool, Optional[int]]:
         """
         检查关键词是否可以触发
@@ -451,8 +1038,10 @@ class TriggerLogManager:
             return True, None
 
         # 检查频率限制
-        if keyword in self.logs:
-            last_time = self.logs[keyword]
+        last_time = max(
+            self.logs.get(keyword, 0), self._reserved.get(keyword, 0)
+        )
+        if last_time:
             elapsed = time.time() - last_time
             keyword_config = config_manager.get_keyword_config(keyword)
             if keyword_config:
@@ -465,21 +1054,84 @@ class TriggerLogManager:
 
         return True, None
 
-    def record_trigger(self, keyword: str) -> None:
-        """记录关键词触发时间"""
-        self.logs[keyword] = time.time()
-        self.save()
+    def reserve(
+        self, keyword: str, is_owner: bool
+    ) -> tuple[Optional[Dict], Optional[int]]:
+        """
+        检查频率限制并同步占用触发名额，须在任何 await 之前调用
+        返回: (预约记录, 需要等待的秒数)，无法触发时预约记录为 None
+        """
+        can_trigger, wait_time = self.can_trigger(keyword, is_owner)
+        if not can_trigger:
+            return None, wait_time
+
+        reservation = {"keyword": keyword, "time": time.time(), "owner": is_owner}
+        if not is_owner:
+            # 占用频率限制，并发的非主人触发会被 can_trigger 拦截
+            self._reserved[keyword] = reservation["time"]
+        self._inflight[keyword] = self._inflight.get(keyword, 0) + 1
+        return reservation, None
+
+    def commit(
+        self,
+        reservation: Dict,
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+    ) -> None:
+        """触发成功：记录触发并释放预约"""
+        self.record_trigger(reservation["keyword"], user_id, chat_id)
+        self._release(reservation)
+
+    def rollback(self, reservation: Dict) -> None:
+        """触发失败：释放预约，不记录触发"""
+        self._release(reservation)
+
+    def _release(self, reservation: Dict) -> None:
+        """释放预约占用的名额"""
+        keyword = reservation["keyword"]
+        if self._reserved.get(keyword) == reservation["time"]:
+            del self._reserved[keyword]
+        count = self._inflight.get(keyword, 0) - 1
+        if count > 0:
+            self._inflight[keyword] = count
+        else:
+            self._inflight.pop(keyword, None)
+
+    def inflight(self, keyword: str) -> int:
+        """获取关键词进行中的触发数"""
+        return self._inflight.get(keyword, 0)
+
+    def inflight_counts(self) -> Dict[str, int]:
+        """获取所有关键词进行中的触发数"""
+        return dict(self._inflight)
+
+    def record_trigger(
+        self,
+        keyword: str,
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+    ) -> None:
+        """记录关键词触发"""
+        self._append(
+            {
+                "time": time.time(),
+                "keyword": keyword,
+                "user_id": user_id,
+                "chat_id": chat_id,
+            }
+        )
 
     def clear_keyword(self, keyword: str) -> None:
         """清除关键词的触发记录"""
         if keyword in self.logs:
-            del self.logs[keyword]
-            self.save()
+            self._append({"time": time.time(), "keyword": keyword, "cleared": True})
 
 
 # 全局实例
 config_manager = JPMConfigManager()
 trigger_log = TriggerLogManager()
+recent_messages = RecentMessageBuffer()
+message_cache = MessageCache()
 template_generator = TemplateGenerator()
 
 
@@ -565,7 +1217,11 @@ async def show_help(message: Message):
 
 **频率限制:**
 - 主人触发：无限制
-- 其他人触发：每个关键词独立计算频率限制"""
+- 其他人触发：每个关键词独立计算频率限制
+
+**模板语料库:**
+- 模板保存在插件目录的 `jpm_templates.jsonl`，每行一个 `{"id", "mode", "content"}`
+- `mode` 为 `single` 或 `dual`，修改文件后一分钟内的下次触发时在后台重新建立索引"""
     await message.edit(help_text)
 
 
@@ -676,11 +1332,21 @@ async def show_status(message: Message):
     status = "✅ 已开启" if config_manager.enabled else "❌ 已关闭"
     owner_info = f"`{config_manager.owner_id}`" if config_manager.owner_id else "未设置"
     keywords_list = config_manager.list_keywords()
+    recent_triggers = trigger_log.recent_count()
+    inflight_info = (
+        "、".join(
+            f"`{keyword}` × {count}"
+            for keyword, count in trigger_log.inflight_counts().items()
+        )
+        or "无"
+    )
 
     status_text = f"""**JPM 插件状态:**
 
 功能状态: {status}
 主人ID: {owner_info}
+最近24小时触发: {recent_triggers} 次
+进行中触发: {inflight_info}
 
 {keywords_list}
 
@@ -755,6 +1421,72 @@ async def get_target_user_last_message(
         return None
 
 
+async def get_cached_message(client: Client, chat_id: int, message_id: int):
+    """获取消息，优先使用消息缓存，拉取成功后放入缓存"""
+    msg = message_cache.get(chat_id, message_id)
+    if msg:
+        return msg
+    msg = await client.get_messages(chat_id, message_id)
+    if msg and not getattr(msg, "empty", False) and msg.from_user:
+        message_cache.put(msg)
+    return msg
+
+
+async def get_recent_target_message(client: Client, chat_id: int, user_id: int):
+    """
+    获取目标用户的最近一条消息
+    优先使用最近消息缓冲区，缓冲区为空（冷启动）时才扫描聊天历史
+    """
+    for message_id in recent_messages.recent(chat_id, user_id):
+        try:
+            msg = await get_cached_message(client, chat_id, message_id)
+        except Exception as e:
+            logs.warning(f"[JPM] 获取缓存消息 {message_id} 失败: {e}")
+            msg = None
+        if msg and not getattr(msg, "empty", False) and msg.from_user:
+            return msg
+        recent_messages.discard(chat_id, user_id, message_id)
+
+    msg = await get_target_user_last_message(client, chat_id, user_id)
+    if msg:
+        recent_messages.push(chat_id, user_id, msg.id)
+        message_cache.put(msg)
+    return msg
+
+
+async def refresh_reply_target(
+    client: Client, target_message: Message, user_id: int
+) -> Optional[Message]:
+    """丢弃回复失败的目标消息的缓存，重新获取目标用户的最近发言，找不到其他消息时返回 None"""
+    chat_id = target_message.chat.id
+    message_cache.discard(chat_id, target_message.id)
+    recent_messages.discard(chat_id, user_id, target_message.id)
+    msg = await get_recent_target_message(client, chat_id, user_id)
+    if not msg or msg.id == target_message.id:
+        return None
+    return msg
+
+
+async def reply_to_target(
+    client: Client, target_message: Message, user_id: int, text: str
+) -> None:
+    """
+    回复目标消息
+    回复失败（如目标消息已被删除）时丢弃其缓存，对重新获取的最近发言重试一次
+    """
+    try:
+        await target_message.reply(text)
+        return
+    except Exception as e:
+        retry_target = await refresh_reply_target(client, target_message, user_id)
+        if not retry_target:
+            raise
+        logs.warning(
+            f"[JPM] 回复消息 {target_message.id} 失败: {e}，改为回复最近发言 {retry_target.id}"
+        )
+    await retry_target.reply(text)
+
+
 @listener(is_plugin=True, incoming=True, outgoing=False, ignore_edited=True)
 async def track_anchor_messages(message: Message, bot: Client):
     """自动记录目标用户的发言作为锚点消息"""
@@ -770,17 +1502,25 @@ async def track_anchor_messages(message: Message, bot: Client):
     chat_id = message.chat.id
     message_id = message.id
 
-    # 检查是否有任何关键词配置了这个用户作为目标
-    for keyword, config in config_manager.keywords.items():
-        if (
-            config["target_user_id"] == sender_id
-            and config["target_chat_id"] == chat_id
-        ):
-            # 更新锚点消息ID
+    # 通过索引查找以该用户为目标的关键词，非目标消息只需一次字典查询
+    keywords = config_manager.get_keywords_for_target(sender_id, chat_id)
+    if not keywords:
+        return
+
+    # 记录到最近消息缓冲区，并缓存消息对象供触发时直接回复
+    recent_messages.push(chat_id, sender_id, message_id)
+    message_cache.put(message)
+
+    # 更新所有监听该用户的关键词的锚点消息ID（仅更新内存，合并为一次延迟写回）
+    updated = False
+    for keyword in keywords:
+        config = config_manager.keywords[keyword]
+        if config.get("anchor_message_id") != message_id:
             config["anchor_message_id"] = message_id
-            config_manager.save()
-            logs.debug(f"[JPM] 更新关键词 `{keyword}` 的锚点消息: {message_id}")
-            break  # 一个用户只处理一次
+            updated = True
+        logs.debug(f"[JPM] 更新关键词 `{keyword}` 的锚点消息: {message_id}")
+    if updated:
+        config_manager.mark_anchor_dirty()
 
 
 @listener(is_plugin=True, incoming=True, outgoing=True, ignore_edited=True)
@@ -826,9 +1566,9 @@ async def trigger_jpm(message: Message, bot: Client):
         else False
     )
 
-    # 检查频率限制
-    can_trigger, wait_time = trigger_log.can_trigger(keyword, is_owner)
-    if not can_trigger:
+    # 检查频率限制并同步占用名额，避免并发触发在等待期间同时通过检查
+    reservation, wait_time = trigger_log.reserve(keyword, is_owner)
+    if not reservation:
         logs.info(
             f"[JPM] 用户 {trigger_user_id} 触发 `/{keyword}` 过于频繁，需等待 {wait_time} 秒"
         )
@@ -842,78 +1582,104 @@ async def trigger_jpm(message: Message, bot: Client):
 
     use_dual = is_reply_to_someone or has_param
 
-    # 生成回复内容
-    with contextlib.suppress(Exception):
-        target_message = None
-        anchor_message_id = keyword_config.get("anchor_message_id")
+    # 生成回复内容（未成功回复时释放预约）
+    try:
+        with contextlib.suppress(Exception):
+            target_message = None
+            anchor_message_id = keyword_config.get("anchor_message_id")
+
+            # 优先使用锚点消息
+            if anchor_message_id:
+                try:
+                    target_message = await get_cached_message(
+                        bot, message.chat.id, anchor_message_id
+                    )
+                    logs.debug(f"[JPM] 使用锚点消息: {anchor_message_id}")
+                except Exception as e:
+                    logs.warning(
+                        f"[JPM] 获取锚点消息 {anchor_message_id} 失败: {e}，尝试查找最近发言"
+                    )
+                if not target_message or getattr(target_message, "empty", False):
+                    # 锚点消息已失效，避免再次从缓存或缓冲区获取
+                    target_message = None
+                    message_cache.discard(message.chat.id, anchor_message_id)
+                    recent_messages.discard(
+                        message.chat.id,
+                        keyword_config["target_user_id"],
+                        anchor_message_id,
+                    )
 
-        # 优先使用锚点消息
-        if anchor_message_id:
-            try:
-                target_message = await bot.get_messages(
-                    message.chat.id, anchor_message_id
-                )
-                logs.debug(f"[JPM] 使用锚点消息: {anchor_message_id}")
-            except Exception as e:
-                logs.warning(
-                    f"[JPM] 获取锚点消息 {anchor_message_id} 失败: {e}，尝试查找最近发言"
+            # 如果没有锚点消息，则查找最近发言
+            if not target_message:
+                target_message = await get_recent_target_message(
+                    bot, message.chat.id, keyword_config["target_user_id"]
                 )
 
-        # 如果没有锚点消息，则查找最近发言
-        if not target_message:
-            target_message = await get_target_user_last_message(
-                bot, message.chat.id, keyword_config["target_user_id"]
-            )
-
-        if target_message and target_message.from_user:
-            target_name = (
-                target_message.from_user.username
-                or target_message.from_user.first_name
-                or str(target_message.from_user.id)
-            )
+            if target_message and target_message.from_user:
+                target_name = (
+                    target_message.from_user.username
+                    or target_message.from_user.first_name
+                    or str(target_message.from_user.id)
+                )
 
-            if use_dual:
-                # 双人模式：确定第二个名字
-                if has_param:
-                    # 优先使用参数
-                    second_name = param
-                    mode_desc = f"双人(关键词+参数:{param})"
-                elif is_reply_to_someone and message.reply_to_message.from_user:
-                    # 使用被回复者的名字
-                    replied_user = message.reply_to_message.from_user
-                    second_name = (
-                        replied_user.username
-                        or replied_user.first_name
-                        or str(replied_user.id)
-                    )
-                    mode_desc = f"双人(关键词+回复:{second_name})"
+                # 插件重载后首次触发时等待模板索引在后台加载完成
+                await template_generator.ensure_loaded()
+
+                if use_dual:
+                    # 双人模式：确定第二个名字
+                    if has_param:
+                        # 优先使用参数
+                        second_name = param
+                        mode_desc = f"双人(关键词+参数:{param})"
+                    elif is_reply_to_someone and message.reply_to_message.from_user:
+                        # 使用被回复者的名字
+                        replied_user = message.reply_to_message.from_user
+                        second_name = (
+                            replied_user.username
+                            or replied_user.first_name
+                            or str(replied_user.id)
+                        )
+                        mode_desc = f"双人(关键词+回复:{second_name})"
+                    else:
+                        # 降级到单人
+                        second_name = None
+                        mode_desc = "单人"
+
+                    if second_name:
+                        reply_text = template_generator.generate_dual(
+                            keyword, second_name, message.chat.id
+                        )
+                        logs.info(
+                            f"[JPM] `/{keyword}` 触发双人模式: {keyword} + {second_name}"
+                        )
+                    else:
+                        reply_text = template_generator.generate_single(
+                            keyword, message.chat.id
+                        )
+                        logs.info(f"[JPM] `/{keyword}` 触发单人模式: {keyword}")
                 else:
-                    # 降级到单人
-                    second_name = None
-                    mode_desc = "单人"
-
-                if second_name:
-                    reply_text = template_generator.generate_dual(keyword, second_name)
-                    logs.info(
-                        f"[JPM] `/{keyword}` 触发双人模式: {keyword} + {second_name}"
+                    # 单人模式
+                    reply_text = template_generator.generate_single(
+                        keyword, message.chat.id
                     )
-                else:
-                    reply_text = template_generator.generate_single(keyword)
                     logs.info(f"[JPM] `/{keyword}` 触发单人模式: {keyword}")
-            else:
-                # 单人模式
-                reply_text = template_generator.generate_single(keyword)
-                logs.info(f"[JPM] `/{keyword}` 触发单人模式: {keyword}")
 
-            await target_message.reply(reply_text)
+                await reply_to_target(
+                    bot, target_message, keyword_config["target_user_id"], reply_text
+                )
 
-            # 记录触发时间
-            trigger_log.record_trigger(keyword)
+                # 记录触发时间
+                trigger_log.commit(reservation, trigger_user_id, message.chat.id)
+                reservation = None
+
+                # 删除触发的命令消息
+                with contextlib.suppress(Exception):
+                    await message.delete()
+            else:
+                logs.warning(
+                    f"[JPM] 未找到目标用户 {keyword_config['target_user_id']} 的回复目标"
+                )
+    finally:
+        if reservation:
+            trigger_log.rollback(reservation)
 
-            # 删除触发的命令消息
-            with contextlib.suppress(Exception):
-                await message.delete()
-        else:
-            logs.warning(
-                f"[JPM] 未找到目标用户 {keyword_config['target_user_id']} 的回复目标"
-            )
@@ -6,10 +6,18 @@ JPMAI 插件 - AI 生成艳情文案回复
 
 import asyncio
 import contextlib
+import copy
+import heapq
 import json
+import os
+import random
+import re
 import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple, Deque, Iterator, Callable, Awaitable
 
 import httpx
 
@@ -18,18 +26,171 @@ from pagermaid.hook import Hook
 from pagermaid.enums import Message, Client
 from pagermaid.utils import logs
 
+# HTTP/2 需要安装 h2（pip install httpx[http2]），未安装时使用 HTTP/1.1
+try:
+    import h2  # noqa: F401
+
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
 
 # 配置文件路径
 plugin_dir = Path(__file__).parent
 config_file = plugin_dir / "jpmai_config.json"
 trigger_log_file = plugin_dir / "jpmai_trigger_log.json"
+trigger_journal_file = plugin_dir / "jpmai_trigger_journal.jsonl"
+telemetry_file = plugin_dir / "jpmai_telemetry.json"
 
 # 默认频率限制（秒）
 DEFAULT_RATE_LIMIT = 3600
 
+# 触发日志压缩：快照后追加达到该条数时立即压缩，否则首次追加后等待该秒数压缩
+TRIGGER_COMPACT_THRESHOLD = 200
+TRIGGER_COMPACT_INTERVAL = 600
+# 状态中统计最近触发次数的时间窗口（秒）
+TRIGGER_RECENT_WINDOW = 86400
+
+# 每个 (群组, 用户) 缓存的最近消息ID数量
+RECENT_MESSAGE_BUFFER_SIZE = 20
+
+# 已解析消息对象缓存：最大条数 / 有效期（秒）
+MESSAGE_CACHE_SIZE = 128
+MESSAGE_CACHE_TTL = 1800
+
 # 默认模型
 DEFAULT_MODEL = "glm-4.6"
 
+# API 连接池：请求超时（秒）/ 最大连接数 / 空闲连接保持时间（秒）/ 是否启用 HTTP/2
+API_TIMEOUT = 60.0
+API_MAX_CONNECTIONS = 10
+API_KEEPALIVE_EXPIRY = 120.0
+API_ENABLE_HTTP2 = True
+
+# API 重试：最多重试次数 / 退避基础间隔与上限（秒）/ 接受的最长 Retry-After（秒）
+API_MAX_RETRIES = 2
+API_RETRY_BASE_DELAY = 1.0
+API_RETRY_MAX_DELAY = 20.0
+API_RETRY_AFTER_MAX = 60.0
+
+# 单次生成（含重试与截断后的重新请求）的总时限（秒），剩余时间不足一次请求超时时不再重试
+API_CALL_DEADLINE = 150.0
+
+# API 配置变化后，旧生成器等待进行中的调用结束时的检查间隔（秒）
+GENERATOR_IDLE_POLL = 1.0
+
+# 可重试的 HTTP 状态码，其余 4xx（如密钥错误）重试无意义
+API_RETRY_STATUSES = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+# 熔断器：连续失败多少次后熔断 / 熔断多少秒后放行一次试探请求
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 60.0
+
+# 密钥池：用量统计的滑动窗口 / 429 未给出 Retry-After 时的冷却时间 / 冷却时间上限（秒）
+KEY_USAGE_WINDOW = 60.0
+KEY_COOLDOWN_DEFAULT = 20.0
+KEY_COOLDOWN_MAX = 300.0
+
+# 多端点路由：延迟/错误率 EWMA 平滑系数 / 健康度下限（保证恢复中的端点仍有少量流量）
+ENDPOINT_EWMA_ALPHA = 0.3
+ENDPOINT_MIN_SCORE = 0.02
+
+# 文案目标长度（字）：提取结果不足下限视为不完整，超过上限截断到截断长度
+CONTENT_MIN_CHARS = 280
+CONTENT_MAX_CHARS = 400
+CONTENT_TRUNCATE_CHARS = 350
+
+# token 预算：每字约需 token 数 / 预算余量倍数 / 预算上限（即原固定值）/ 参考的最近用量样本数
+TOKENS_PER_CHAR = 1.5
+TOKEN_BUDGET_HEADROOM = 2.0
+TOKEN_BUDGET_MAX = 25600
+TOKEN_BUDGET_WINDOW = 50
+
+# 对冲请求：计算对冲阈值所需的最少样本数 / 保留的最近耗时样本数
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+
+# 生成调度：同时进行的生成请求上限 / 排队超时（秒）/ 保留的最近排队耗时样本数
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_QUEUE_TIMEOUT = 60
+SCHEDULER_WAIT_WINDOW = 200
+
+# 调用统计：耗时直方图桶上界（秒，0.05 到约 290 秒按 1.3 倍递增）/ 写入文件的间隔（秒）
+TELEMETRY_BUCKETS = [round(0.05 * 1.3**i, 3) for i in range(34)]
+TELEMETRY_FLUSH_INTERVAL = 300
+
+# 压测：最多请求数 / 最大并发数 / 进度刷新间隔（秒）
+BENCH_MAX_REQUESTS = 500
+BENCH_MAX_CONCURRENCY = 50
+BENCH_PROGRESS_INTERVAL = 3.0
+
+# 预生成池：每个关键词每种模式缓存的文案数（0 为关闭）/ 后台补充并发数 / 文案有效期（秒）
+DEFAULT_POOL_DEPTH = 0
+DEFAULT_POOL_CONCURRENCY = 1
+DEFAULT_POOL_TTL = 3600
+
+# 批量生成：每次非流式请求的候选数（n，1 为关闭）/ 上限，多出的候选放入预生成池
+DEFAULT_POOL_BATCH = 1
+POOL_BATCH_MAX = 8
+
+# 预生成双人文案时使用的占位目标名，发送时替换为实际目标
+POOL_TARGET_PLACEHOLDER = "沈琅嬛"
+# 实时双人生成的多余候选中，目标名不短于该长度时才替换为占位名放入池中
+POOL_TARGET_MIN_LENGTH = 2
+
+# 预生成池：有实时触发进行中时的等待间隔 / 生成失败后的暂停时间（秒，连续失败时指数增长）
+POOL_IDLE_POLL = 1.0
+POOL_RETRY_DELAY = 30.0
+POOL_RETRY_MAX_DELAY = 600.0
+# 预生成池连续失败该轮数后停止补充，直到下次触发或配置变更重新启动
+POOL_MAX_FAILURES = 5
+
+# 生成失败时 AIGenerator 返回的提示文字前缀
+GENERATION_ERROR_PREFIXES = ("生成失败", "生成超时")
+
+# 流式输出：两次编辑之间的最小间隔（秒），避免触发 Telegram 编辑频率限制
+STREAM_EDIT_INTERVAL = 2.0
+
+# 流式预览只显示到最后一个完整句子为止
+SENTENCE_ENDINGS = "。！？!?…」』”"
+
+# 文案过滤关键词：包含这些词的段落通常是思考过程
+CONTENT_FILTER_KEYWORDS = [
+    "拆解",
+    "构思",
+    "初稿",
+    "步骤",
+    "内心活动",
+    "场景构建",
+    "起草",
+    "润色",
+    "构思",
+    "最终",
+    "修改",
+    "提炼",
+    "首先",
+    "其次",
+    "然后",
+    "最后",
+    "总之",
+    "第一",
+    "第二",
+    "第三",
+    "段落",
+    "标题",
+]
+
+# 一次匹配全部过滤关键词（去重，较长的词优先）
+CONTENT_FILTER_PATTERN = re.compile(
+    "|".join(
+        map(re.escape, sorted(set(CONTENT_FILTER_KEYWORDS), key=len, reverse=True))
+    )
+)
+
+# 推理模型输出的思考过程标签
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
 # 系统提示词 - 仿明清艳情小说风格
 SYSTEM_PROMPT = """你是一位精通明清艳情小说的文学大师，擅长模仿《肉蒲团》《灯草和尚》《金云翘传》《品花鉴宝》《欢喜缘》等经典作品的文风。
 
@@ -57,51 +218,457 @@ SYSTEM_PROMPT = """你是一位精通明清艳情小说的文学大师，擅长
 @Hook.on_startup()
 async def plugin_startup():
     """插件初始化"""
+    generation_pool.schedule()
     logs.info("JPMAI 插件已加载")
 
 
 @Hook.on_shutdown()
 async def plugin_shutdown():
     """插件关闭"""
+    # 将触发日志压缩为快照，关闭 API 连接池，并等待配置写入完成
+    trigger_log.compact()
+    await generation_pool.stop()
+    await config_manager.close_generator()
+    telemetry.flush()
+    await config_manager.saver.flush()
+    await trigger_log.saver.flush()
+    await telemetry.saver.flush()
     logs.info("JPMAI 插件已卸载")
 
 
+class RetryPolicy:
+    """API 重试策略：按状态码决定是否重试，带随机抖动的指数退避，支持 Retry-After"""
+
+    def __init__(
+        self,
+        max_retries: int = API_MAX_RETRIES,
+        base_delay: float = API_RETRY_BASE_DELAY,
+        max_delay: float = API_RETRY_MAX_DELAY,
+        retry_after_max: float = API_RETRY_AFTER_MAX,
+        retry_statuses: frozenset = API_RETRY_STATUSES,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_after_max = retry_after_max
+        self.retry_statuses = retry_statuses
+
+    def is_retryable(self, error: Exception) -> bool:
+        """判断该错误是否值得重试"""
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in self.retry_statuses
+        # 超时、连接失败、响应中断等
+        return isinstance(error, (httpx.TransportError, ValueError))
+
+    @staticmethod
+    def is_upstream_failure(error: Exception) -> bool:
+        """
+        判断该错误是否说明上游不健康（计入熔断器）
+        4xx 配置错误不计入，只有请求失败与无效响应计入
+        """
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return status == 429 or status >= 500
+        return isinstance(error, (httpx.HTTPError, ValueError, KeyError, TypeError))
+
+    def backoff(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        第 attempt 次（从0开始）失败后的等待秒数
+        服务端要求等待的时间超过 retry_after_max 时返回 None，表示放弃重试
+        """
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.retry_after_max else None
+        # 全抖动：在 [0, min(上限, 基础间隔 * 2^attempt)] 中随机取值，避免重试集中
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """解析 Retry-After 响应头（秒数或 HTTP 日期）"""
+        if not isinstance(error, httpx.HTTPStatusError):
+            return None
+        value = error.response.headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后熔断，熔断期间直接失败；
+    超过恢复时间后半开，只放行一次试探请求，成功则恢复，失败则继续熔断
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0  # 连续失败次数
+        self.opened_at = 0.0
+        self._probing = False  # 半开状态下是否已有试探请求
+
+    def allow(self) -> bool:
+        """是否允许发起请求"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        """请求成功"""
+        if self.state != self.CLOSED:
+            logs.info("[JPMAI] API 试探请求成功，熔断器恢复")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        """请求失败"""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logs.warning(
+                    f"[JPMAI] API 连续失败 {self.failures} 次，熔断 {self.reset_timeout:g} 秒"
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """试探请求未得出结论（如配置错误）时释放试探名额"""
+        self._probing = False
+
+    def remaining(self) -> float:
+        """熔断剩余秒数"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def describe(self) -> str:
+        """状态描述"""
+        if self.state == self.OPEN:
+            return f"🔴 熔断中（{self.remaining():.0f} 秒后试探，连续失败 {self.failures} 次）"
+        if self.state == self.HALF_OPEN:
+            return "🟡 半开（等待试探请求结果）"
+        if self.failures:
+            return f"🟢 正常（连续失败 {self.failures} 次）"
+        return "🟢 正常"
+
+
+def parse_api_keys(value: str) -> List[str]:
+    """解析以逗号分隔的多个密钥（去除空白与重复）"""
+    return list(dict.fromkeys(key.strip() for key in value.split(",") if key.strip()))
+
+
+def mask_api_key(key: str) -> str:
+    """密钥脱敏显示"""
+    return f"{key[:6]}...{key[-4:]}" if len(key) > 12 else f"{key[:3]}..."
+
+
+class APIKeyPool:
+    """
+    同一端点的多个 API 密钥
+    每个密钥统计滑动窗口内的请求数与 token 用量，每次选择未在冷却中、负载最低的密钥；
+    收到 429 的密钥按 Retry-After（默认 KEY_COOLDOWN_DEFAULT 秒）冷却，全部冷却中时选择最早恢复的
+    """
+
+    def __init__(self, keys: List[str], window: float = KEY_USAGE_WINDOW):
+        self.keys = keys
+        self.window = window
+        self._requests: Dict[str, Deque[float]] = {key: deque() for key in keys}
+        self._tokens: Dict[str, Deque[Tuple[float, int]]] = {
+            key: deque() for key in keys
+        }
+        self._inflight: Dict[str, int] = dict.fromkeys(keys, 0)
+        self._cooldown_until: Dict[str, float] = dict.fromkeys(keys, 0.0)
+        self.rate_limited: Dict[str, int] = dict.fromkeys(keys, 0)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _load(self, key: str, now: float) -> Tuple[int, int]:
+        """(窗口内请求数, 窗口内 token 数)，同时清理窗口外的记录"""
+        requests = self._requests[key]
+        tokens = self._tokens[key]
+        while requests and requests[0] <= now - self.window:
+            requests.popleft()
+        while tokens and tokens[0][0] <= now - self.window:
+            tokens.popleft()
+        return len(requests), sum(count for _, count in tokens)
+
+    def select(self) -> str:
+        """选择负载最低的可用密钥（不计入用量）"""
+        if len(self.keys) == 1:
+            return self.keys[0]
+        now = time.monotonic()
+        ready = [key for key in self.keys if self._cooldown_until[key] <= now]
+        if not ready:
+            return min(self.keys, key=self._cooldown_until.__getitem__)
+
+        def load(key: str) -> Tuple[int, int]:
+            requests, tokens = self._load(key, now)
+            return requests + self._inflight[key], tokens
+
+        return min(ready, key=load)
+
+    def acquire(self) -> str:
+        """选择密钥并计入一次请求，请求结束后需调用 release"""
+        key = self.select()
+        self._requests[key].append(time.monotonic())
+        self._inflight[key] += 1
+        return key
+
+    def release(self, key: str, tokens: int = 0) -> None:
+        """请求结束，记录其 token 用量"""
+        self._inflight[key] -= 1
+        if tokens:
+            self._tokens[key].append((time.monotonic(), tokens))
+
+    def cooldown(self, key: str, seconds: Optional[float] = None) -> None:
+        """密钥被限流，在冷却结束前不再优先选择"""
+        seconds = min(
+            KEY_COOLDOWN_DEFAULT if seconds is None else seconds, KEY_COOLDOWN_MAX
+        )
+        self.rate_limited[key] += 1
+        self._cooldown_until[key] = time.monotonic() + seconds
+        if len(self.keys) > 1:
+            logs.warning(f"[JPMAI] 密钥 {mask_api_key(key)} 被限流，冷却 {seconds:.0f} 秒")
+
+    def available(self) -> bool:
+        """是否有未在冷却中的密钥"""
+        now = time.monotonic()
+        return any(until <= now for until in self._cooldown_until.values())
+
+    def describe(self) -> List[str]:
+        """每个密钥的状态描述"""
+        now = time.monotonic()
+        lines = []
+        for key in self.keys:
+            requests, tokens = self._load(key, now)
+            remaining = self._cooldown_until[key] - now
+            state = f"冷却中（{remaining:.0f} 秒）" if remaining > 0 else "可用"
+            lines.append(
+                f"`{mask_api_key(key)}` {state}，最近 {self.window:.0f} 秒 "
+                f"请求 {requests} 次 / {tokens} tokens，被限流 {self.rate_limited[key]} 次"
+            )
+        return lines
+
+
+class TokenBudget:
+    """
+    max_tokens 预算控制
+    初始预算由目标字数推算；之后参考最近正常结束的实际用量（含推理模型的思考过程）自适应，
+    输出被截断且没有可用正文时以 TOKEN_BUDGET_MAX 重新请求一次（不改变之后的预算）
+    关闭时固定使用 TOKEN_BUDGET_MAX（即原先的行为），便于对比用量
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.base = int(CONTENT_TRUNCATE_CHARS * TOKENS_PER_CHAR * TOKEN_BUDGET_HEADROOM)
+        self._budget = self.base
+        self._usage: Deque[int] = deque(maxlen=TOKEN_BUDGET_WINDOW)
+        self.stats = {
+            "generations": 0,
+            "completion_tokens": 0,
+            "requested_tokens": 0,
+            "early_stops": 0,
+            "truncations": 0,
+        }
+
+    @property
+    def max_tokens(self) -> int:
+        return self._budget if self.enabled else TOKEN_BUDGET_MAX
+
+    def record(self, requested: int, tokens: int, finish: str, usable: bool) -> bool:
+        """
+        记录一次生成的用量，finish 为 stop / length / early（流式提前结束）
+        返回 True 表示输出被截断且没有可用正文，应以 TOKEN_BUDGET_MAX 重新请求
+        """
+        stats = self.stats
+        stats["generations"] += 1
+        stats["completion_tokens"] += tokens
+        stats["requested_tokens"] += requested
+        if finish == "early":
+            stats["early_stops"] += 1
+        if finish == "length":
+            stats["truncations"] += 1
+            return not usable and self.enabled and requested < TOKEN_BUDGET_MAX
+        if finish == "stop":
+            self._usage.append(tokens)
+            usage = sorted(self._usage)
+            p90 = usage[min(len(usage) - 1, int(0.9 * len(usage)))]
+            self._budget = min(
+                TOKEN_BUDGET_MAX, max(self.base, int(p90 * 1.25))
+            )
+        return False
+
+    def describe(self) -> str:
+        """用量描述"""
+        stats = self.stats
+        count = stats["generations"]
+        if not count:
+            return f"max_tokens {self.max_tokens}，暂无生成记录"
+        return (
+            f"max_tokens {self.max_tokens}，平均每次生成 {stats['completion_tokens'] / count:.0f} tokens"
+            f"（平均请求上限 {stats['requested_tokens'] / count:.0f}），"
+            f"提前结束 {stats['early_stops']} 次，截断 {stats['truncations']} 次，共 {count} 次"
+        )
+
+
+# 设置后，当前上下文（含其中创建的任务）的每次 API 调用指标都会追加到该列表而不计入调用统计，用于压测
+call_collector: ContextVar[Optional[List[Dict]]] = ContextVar(
+    "jpmai_call_collector", default=None
+)
+
+# 流式输出回调：接收当前可展示的文案
+StreamCallback = Callable[[str], Awaitable[None]]
+
+
 class AIGenerator:
     """AI 文案生成器"""
 
     def __init__(self, api_url: str, api_key: str, model: str = DEFAULT_MODEL):
         self.api_url = api_url.rstrip("/")
         self.api_key = api_key
+        self.keys = APIKeyPool(parse_api_keys(api_key))  # 多个密钥以逗号分隔
         self.model = model
+        self._client: Optional[httpx.AsyncClient] = None  # 长连接池，首次请求时创建
+        self.retry_policy = RetryPolicy()
+        self.breaker = CircuitBreaker()
+        self.health = EndpointHealth()
+        self.token_budget = TokenBudget()
+        self.batch_size = 1  # 批量生成时每次请求的候选数
+        self.active = 0  # 进行中的调用数
+        self.closed = False  # 关闭后不再创建连接池
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """获取长连接池，多次生成和重试复用已建立的 TCP/TLS 连接"""
+        if self.closed:
+            raise RuntimeError("生成器已关闭")
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=API_TIMEOUT,
+                http2=API_ENABLE_HTTP2 and HAS_HTTP2,
+                limits=httpx.Limits(
+                    max_connections=API_MAX_CONNECTIONS,
+                    max_keepalive_connections=API_MAX_CONNECTIONS,
+                    keepalive_expiry=API_KEEPALIVE_EXPIRY,
+                ),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """关闭连接池，之后不能再发起请求"""
+        self.closed = True
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    async def ping(self) -> float:
+        """
+        请求 /v1/models 测量连接耗时（秒）
+        只关心连接是否可用，不检查响应状态
+        """
+        start = time.perf_counter()
+        await self._get_client().get(
+            f"{self.api_url}/v1/models",
+            headers={"Authorization": f"Bearer {self.keys.select()}"},
+        )
+        return time.perf_counter() - start
 
-    async def generate_single(self, name: str) -> str:
-        """生成单人文案"""
+    async def generate_single(
+        self,
+        name: str,
+        on_update: Optional[StreamCallback] = None,
+        extras: Optional[List[str]] = None,
+    ) -> str:
+        """
+        生成单人文案（传入 on_update 时使用流式输出）
+        传入 extras 且非流式时一次请求 batch_size 个候选，其余可用候选追加到 extras
+        """
         user_prompt = f"""【单人场景】请为"{name}"创作一段艳情文案。
 
 {name}独处闺房/书房，夜深人静，春心萌动，情欲难耐。描写{name}身体的燥热与渴望、辗转难眠的春思、手指不自觉地游走、肌肤的敏感与颤栗、呼吸的急促与轻吟。
 
 注意：只生成一段文案，约300字。"""
 
-        return await self._call_api(user_prompt)
+        return await self._call_api(user_prompt, on_update, extras)
 
-    async def generate_dual(self, name: str, target: str) -> str:
-        """生成双人文案"""
+    async def generate_dual(
+        self,
+        name: str,
+        target: str,
+        on_update: Optional[StreamCallback] = None,
+        extras: Optional[List[str]] = None,
+    ) -> str:
+        """生成双人文案（参数同 generate_single）"""
         user_prompt = f"""【双人场景】请为"{name}"和"{target}"创作一段艳情文案。
 
 {name}与{target}独处，暧昧气氛升温，情欲暗涌。描写两人之间的眉目传情、肌肤触碰时的电流感、呼吸交缠唇齿相接、衣衫渐解春光乍泄、身体纠缠的欢愉。
 
 注意：只生成一段文案，约300字。"""
 
-        return await self._call_api(user_prompt)
-
-    async def _call_api(self, user_prompt: str) -> str:
-        """调用 API 生成文案（带自动重试）"""
-        url = f"{self.api_url}/v1/chat/completions"
+        return await self._call_api(user_prompt, on_update, extras)
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}",
+    async def _call_api(
+        self,
+        user_prompt: str,
+        on_update: Optional[StreamCallback] = None,
+        extras: Optional[List[str]] = None,
+    ) -> str:
+        """调用 API 生成文案，并记录本次调用的耗时、token 用量与结果"""
+        metrics = {
+            "attempts": 0,
+            "ttfb": None,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "errors": {},  # 每次失败尝试的原因 -> 次数（含之后重试成功的）
+            "outcome": "cancelled",
         }
+        start = time.perf_counter()
+        self.active += 1
+        try:
+            return await self._call_with_retry(user_prompt, on_update, metrics, extras)
+        finally:
+            self.active -= 1
+            wall = time.perf_counter() - start
+            collector = call_collector.get()
+            if collector is not None:
+                collector.append({**metrics, "wall": wall, "api_url": self.api_url})
+            else:
+                telemetry.record(self.api_url, self.model, wall, metrics)
+
+    async def _call_with_retry(
+        self,
+        user_prompt: str,
+        on_update: Optional[StreamCallback],
+        metrics: Dict,
+        extras: Optional[List[str]] = None,
+    ) -> str:
+        """调用 API 生成文案（带自动重试），结果分类写入 metrics["outcome"]"""
+        url = f"{self.api_url}/v1/chat/completions"
 
         payload = {
             "model": self.model,
@@ -110,96 +677,347 @@ class AIGenerator:
                 {"role": "user", "content": user_prompt},
             ],
             "temperature": 0.9,
-            "max_tokens": 25600,
         }
+        # 流式输出只接收第一个候选，不批量生成
+        if extras is not None and on_update is None and self.batch_size > 1:
+            payload["n"] = self.batch_size
 
-        # 自动重试机制：最多重试1次
-        max_retries = 1
+        policy = self.retry_policy
         last_error = None
-
-        for attempt in range(max_retries + 1):
+        attempts = 0
+        attempt = 0  # 重试次数（被限流后换用其他密钥不计入）
+        rotations = 0
+        max_tokens = self.token_budget.max_tokens
+        call_start = time.perf_counter()
+
+        def within_deadline(delay: float = 0.0) -> bool:
+            elapsed = time.perf_counter() - call_start
+            return elapsed + delay + API_TIMEOUT <= API_CALL_DEADLINE
+
+        while True:
+            # 熔断期间直接失败，不再请求上游
+            if not self.breaker.allow():
+                logs.warning("[JPMAI] API 熔断中，跳过请求")
+                if last_error is None:
+                    metrics["outcome"] = "breaker_open"
+                    return f"生成失败: API 熔断中，{self.breaker.remaining():.0f} 秒后恢复"
+                break
+
+            attempts += 1
+            metrics["attempts"] = attempts
+            key = self.keys.acquire()
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {key}",
+            }
+            used_tokens = metrics["prompt_tokens"] + metrics["completion_tokens"]
+            start = time.perf_counter()
             try:
-                async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.post(url, json=payload, headers=headers)
-                    response.raise_for_status()
-
-                    data = response.json()
-
-                    if "choices" in data and len(data["choices"]) > 0:
-                        content = data["choices"][0]["message"]["content"]
-
-                        # 提取真正的文案内容（过滤掉思考过程）
-                        extracted_content = self._extract_content(content)
+                content, truncated = await self._complete(
+                    url,
+                    {**payload, "max_tokens": max_tokens},
+                    headers,
+                    on_update,
+                    metrics,
+                    extras,
+                )
+                self.breaker.record_success()
+                self.health.record(time.perf_counter() - start, True)
+                metrics["outcome"] = "ok" if content is not None else "invalid"
 
-                        if extracted_content:
-                            return extracted_content
-                        else:
-                            # 如果提取失败，返回原始内容
-                            logs.warning("[JPMAI] 内容提取失败，返回原始内容")
-                            return content.strip()
-                    else:
-                        logs.error(f"[JPMAI] API 返回无效响应: {data}")
-                        return "生成失败，请稍后再试"
+                # 截断后以最大预算重新请求一次，计入重试次数与总时限
+                if truncated and max_tokens < TOKEN_BUDGET_MAX and within_deadline():
+                    logs.info(
+                        f"[JPMAI] 输出在 {max_tokens} tokens 处被截断且没有正文，"
+                        f"以 {TOKEN_BUDGET_MAX} tokens 重新请求"
+                    )
+                    max_tokens = TOKEN_BUDGET_MAX
+                    attempt += 1
+                    continue
+
+                if content is not None:
+                    # 提取真正的文案内容（过滤掉思考过程）
+                    extracted_content = self._extract_content(content)
+
+                    if extracted_content:
+                        return extracted_content
+                    # 只有思考过程（如未闭合的 <think> 被截断），不能把思考过程发给目标
+                    logs.warning("[JPMAI] 内容提取失败，输出中没有正文")
+                    metrics["outcome"] = "invalid"
+                    return "生成失败: 输出中没有正文"
+                else:
+                    return "生成失败，请稍后再试"
 
             except httpx.TimeoutException as e:
                 last_error = e
                 logs.warning(
-                    f"[JPMAI] API 请求超时 (尝试 {attempt + 1}/{max_retries + 1})"
+                    f"[JPMAI] API 请求超时 (尝试 {attempt + 1}/{policy.max_retries + 1})"
                 )
             except httpx.HTTPStatusError as e:
                 last_error = e
                 logs.warning(
-                    f"[JPMAI] API 请求失败: {e.response.status_code} (尝试 {attempt + 1}/{max_retries + 1})"
+                    f"[JPMAI] API 请求失败: {e.response.status_code} (尝试 {attempt + 1}/{policy.max_retries + 1})"
                 )
-            except Exception as e:
+            except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+                # 连接失败、响应中断或响应格式无效
                 last_error = e
                 logs.warning(
-                    f"[JPMAI] API 调用异常: {e} (尝试 {attempt + 1}/{max_retries + 1})"
+                    f"[JPMAI] API 调用异常: {e} (尝试 {attempt + 1}/{policy.max_retries + 1})"
+                )
+            except BaseException:
+                # 被取消（如对冲请求落败）或流式回调失败（如编辑消息出错）不代表端点健康状况，
+                # 释放可能占用的试探名额后原样抛出
+                self.breaker.release()
+                raise
+            finally:
+                self.keys.release(
+                    key,
+                    metrics["prompt_tokens"] + metrics["completion_tokens"] - used_tokens,
                 )
 
+            reason = self._classify_error(last_error)
+            metrics["errors"][reason] = metrics["errors"].get(reason, 0) + 1
+            if reason == "http_429":
+                self.keys.cooldown(key, policy.retry_after(last_error))
+                # 还有未被限流的密钥时立即换用，不计入熔断与重试次数
+                if rotations < len(self.keys) - 1 and self.keys.available():
+                    rotations += 1
+                    self.breaker.release()
+                    continue
+            if policy.is_upstream_failure(last_error):
+                self.breaker.record_failure()
+                self.health.record(time.perf_counter() - start, False)
+            else:
+                self.breaker.release()
+
+            if attempt >= policy.max_retries or not policy.is_retryable(last_error):
+                break
+            delay = policy.backoff(attempt, last_error)
+            if delay is None:
+                logs.warning("[JPMAI] API 要求的等待时间过长，放弃重试")
+                break
+            if not within_deadline(delay):
+                logs.warning("[JPMAI] 剩余时间不足，放弃重试")
+                break
+            await asyncio.sleep(delay)
+            attempt += 1
+
         # 所有重试都失败后返回错误信息
+        metrics["outcome"] = self._classify_error(last_error)
         if isinstance(last_error, httpx.TimeoutException):
-            logs.error("[JPMAI] API 请求超时，已重试1次均失败")
+            logs.error(f"[JPMAI] API 请求超时，共尝试 {attempts} 次均失败")
             return "生成超时，请稍后再试"
         elif isinstance(last_error, httpx.HTTPStatusError):
             logs.error(
-                f"[JPMAI] API 请求失败，已重试1次均失败: {last_error.response.status_code}"
+                f"[JPMAI] API 请求失败，共尝试 {attempts} 次均失败: {last_error.response.status_code}"
             )
             return f"生成失败: HTTP {last_error.response.status_code}"
         else:
-            logs.error(f"[JPMAI] API 调用异常，已重试1次均失败: {last_error}")
+            logs.error(f"[JPMAI] API 调用异常，共尝试 {attempts} 次均失败: {last_error}")
             return f"生成失败: {last_error}"
 
+    @staticmethod
+    def _classify_error(error: Optional[Exception]) -> str:
+        """将失败原因归类，用于统计"""
+        if isinstance(error, httpx.TimeoutException):
+            return "timeout"
+        if isinstance(error, httpx.HTTPStatusError):
+            return f"http_{error.response.status_code}"
+        if isinstance(error, httpx.TransportError):
+            return "network"
+        return "error"
+
+    async def _complete(
+        self,
+        url: str,
+        payload: Dict,
+        headers: Dict,
+        on_update: Optional[StreamCallback],
+        metrics: Dict,
+        extras: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], bool]:
+        """
+        按 payload 中的 max_tokens 请求一次，返回 (内容, 是否应以最大预算重新请求)
+        token 用量与首字节耗时累计到 metrics，批量生成时其余可用候选提取后追加到 extras
+        """
+        others: List[str] = []
+        if on_update:
+            content, usage, finish = await self._stream_completion(
+                url, payload, headers, on_update
+            )
+        else:
+            content, usage, finish = await self._post_completion(
+                url, payload, headers, others
+            )
+        tokens = usage["completion_tokens"]
+        metrics["prompt_tokens"] += usage["prompt_tokens"]
+        metrics["completion_tokens"] += tokens
+        if metrics["ttfb"] is None:
+            metrics["ttfb"] = usage["ttfb"]
+        if content is None:
+            return None, False
+        if extras is not None:
+            for raw in others:
+                text = self._extract_content(raw)
+                if text and len(text) >= CONTENT_MIN_CHARS:
+                    extras.append(text)
+
+        extracted = self._extract_content(content)
+        usable = bool(extracted) and len(extracted) >= CONTENT_MIN_CHARS
+        # 多个候选的用量合计返回，按单个候选调整预算
+        per_choice = tokens // (len(others) + 1)
+        truncated = self.token_budget.record(
+            payload["max_tokens"], per_choice, finish, usable
+        )
+        return content, truncated
+
+    async def _post_completion(
+        self,
+        url: str,
+        payload: Dict,
+        headers: Dict,
+        others: Optional[List[str]] = None,
+    ) -> Tuple[Optional[str], Dict, str]:
+        """
+        一次性请求完整回复
+        返回 (内容, 用量, 结束原因)，响应无效时内容为 None
+        用量包含 prompt_tokens / completion_tokens / ttfb（非流式为 None）
+        n > 1 时返回第一个候选，其余候选的原始内容追加到 others
+        """
+        response = await self._get_client().post(url, json=payload, headers=headers)
+        response.raise_for_status()
+
+        data = response.json()
+        if "choices" in data and len(data["choices"]) > 0:
+            choice = data["choices"][0]
+            content = choice["message"]["content"] or ""
+            rest = [
+                other["message"].get("content") or ""
+                for other in data["choices"][1:]
+                if other.get("message")
+            ]
+            if others is not None:
+                others.extend(text for text in rest if text)
+            usage = data.get("usage") or {}
+            tokens = usage.get("completion_tokens") or int(
+                (len(content) + sum(map(len, rest))) * TOKENS_PER_CHAR
+            )
+            return (
+                content,
+                {
+                    "prompt_tokens": usage.get("prompt_tokens") or 0,
+                    "completion_tokens": tokens,
+                    "ttfb": None,
+                },
+                choice.get("finish_reason") or "stop",
+            )
+        logs.error(f"[JPMAI] API 返回无效响应: {data}")
+        return None, {"prompt_tokens": 0, "completion_tokens": 0, "ttfb": None}, "stop"
+
+    async def _stream_completion(
+        self, url: str, payload: Dict, headers: Dict, on_update: StreamCallback
+    ) -> Tuple[Optional[str], Dict, str]:
+        """
+        以 SSE 流式请求回复，边接收边增量过滤，预览文案变化时调用 on_update
+        开启 token 预算时，收到一段完整且达到目标字数的正文后立即结束，不再接收后续输出
+        返回 (内容, 用量, 结束原因)，未收到任何内容时内容为 None
+        """
+        extractor = StreamingExtractor()
+        last_preview = None
+        start = time.perf_counter()
+        ttfb = None
+        first_token_at = None
+        chunks = 0  # 未返回 usage 时以增量块数估算 token 数
+        tokens = None
+        prompt_tokens = 0
+        finish = "stop"
+        early_stop = self.token_budget.enabled
+
+        client = self._get_client()
+        async with client.stream(
+            "POST", url, json={**payload, "stream": True}, headers=headers
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                usage = chunk.get("usage")
+                if usage and usage.get("completion_tokens"):
+                    tokens = usage["completion_tokens"]
+                    prompt_tokens = usage.get("prompt_tokens") or 0
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                if choices[0].get("finish_reason"):
+                    finish = choices[0]["finish_reason"]
+                delta = choices[0].get("delta") or {}
+                if delta.get("content") or delta.get("reasoning_content"):
+                    chunks += 1
+                # 推理模型的 reasoning_content 不参与文案
+                content = delta.get("content")
+                if not content:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter() - start
+                    logs.debug(f"[JPMAI] 流式首个内容耗时 {first_token_at:.2f} 秒")
+                extractor.feed(content)
+                preview = extractor.preview()
+                if preview and preview != last_preview:
+                    last_preview = preview
+                    await on_update(preview)
+                if early_stop and len(extractor.best) >= CONTENT_MIN_CHARS:
+                    # 已有完整的正文段落，关闭连接不再生成
+                    finish = "early"
+                    break
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": tokens or chunks,
+            "ttfb": ttfb,
+        }
+        if not extractor.text:
+            logs.error("[JPMAI] API 流式响应中没有内容")
+            return None, usage, finish
+        content = extractor.completed if finish == "early" else extractor.text
+        return content, usage, finish
+
+    @staticmethod
+    def _is_noise_paragraph(para: str) -> bool:
+        """判断段落是否为思考过程或标题"""
+        # 检查是否包含过滤关键词
+        if CONTENT_FILTER_PATTERN.search(para):
+            return True
+
+        # 检查是否是标题（较短且包含冒号）
+        return len(para) < 30 and ("：" in para or ":" in para)
+
+    @staticmethod
+    def _strip_reasoning(raw_content: str) -> str:
+        """
+        去掉推理模型的 <think>...</think> 思考过程
+        只有结束标签时（开始标签在模板中）丢弃其之前的全部内容，未闭合的思考过程丢弃到末尾
+        """
+        if THINK_CLOSE in raw_content:
+            raw_content = raw_content.rpartition(THINK_CLOSE)[2]
+        if THINK_OPEN in raw_content:
+            raw_content = raw_content.partition(THINK_OPEN)[0]
+        return raw_content
+
     def _extract_content(self, raw_content: str) -> Optional[str]:
         """从AI回复中提取真正的文案内容"""
-        # 过滤关键词：思考过程通常会包含这些
-        filter_keywords = [
-            "拆解",
-            "构思",
-            "初稿",
-            "步骤",
-            "内心活动",
-            "场景构建",
-            "起草",
-            "润色",
-            "构思",
-            "最终",
-            "修改",
-            "提炼",
-            "首先",
-            "其次",
-            "然后",
-            "最后",
-            "总之",
-            "第一",
-            "第二",
-            "第三",
-            "段落",
-            "标题",
-        ]
+        text = self._strip_reasoning(raw_content)
 
         # 按段落分割
-        paragraphs = [p.strip() for p in raw_content.split("\n") if p.strip()]
+        paragraphs = [para for para in map(str.strip, text.split("\n")) if para]
 
         if not paragraphs:
             return None
@@ -208,33 +1026,395 @@ class AIGenerator:
         if len(paragraphs) == 1:
             return paragraphs[0]
 
-        # 过滤掉包含思考过程关键词的段落
-        filtered_paragraphs = []
-        for para in paragraphs:
-            # 检查是否包含过滤关键词
-            if any(keyword in para for keyword in filter_keywords):
-                continue
+        # 从长到短检查，第一个不是思考过程的段落即为正文（排序稳定，长度相同时取靠前的），
+        # 通常只需对最长的一两个段落做一次正则匹配
+        longest_para = next(
+            (
+                para
+                for para in sorted(paragraphs, key=len, reverse=True)
+                if not self._is_noise_paragraph(para)
+            ),
+            # 如果全部是思考过程，使用原始段落中最长的
+            None,
+        ) or max(paragraphs, key=len)
+
+        # 限制字数在280-350字之间
+        if len(longest_para) > CONTENT_MAX_CHARS:
+            longest_para = longest_para[:CONTENT_TRUNCATE_CHARS] + "..."
+
+        return longest_para
+
 
-            # 检查是否是标题（较短且包含特殊符号）
-            if len(para) < 30 and (
-                "：" in para or ":" in para or para.endswith("：") or para.endswith(":")
+class StreamingExtractor:
+    """
+    流式内容的增量提取器
+    已完成的段落只判断一次是否为思考过程，预览取当前最长的正文段落（含未完成段落），
+    <think>...</think> 中的内容不参与预览
+    最终结果仍以 AIGenerator._extract_content 处理完整内容为准
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._partial = ""  # 尚未遇到换行的段落
+        self._best = ""  # 已完成段落中最长的正文段落
+        self._in_think = False  # 是否处于 <think> 思考过程中
+
+    @property
+    def text(self) -> str:
+        """目前收到的完整原始内容"""
+        return "".join(self._chunks)
+
+    @property
+    def completed(self) -> str:
+        """目前收到的内容中已完成（以换行结束）的部分"""
+        text = self.text
+        return text[: len(text) - len(self._partial)]
+
+    @property
+    def best(self) -> str:
+        """已完成段落中最长的正文段落"""
+        return self._best
+
+    def feed(self, chunk: str) -> None:
+        """追加一段增量内容"""
+        self._chunks.append(chunk)
+        self._partial += chunk
+        while True:
+            if self._in_think:
+                end = self._partial.find(THINK_CLOSE)
+                if end < 0:
+                    # 只保留可能是被拆开的结束标签的末尾部分
+                    self._partial = self._partial[-(len(THINK_CLOSE) - 1) :]
+                    return
+                self._partial = self._partial[end + len(THINK_CLOSE) :]
+                self._in_think = False
+                continue
+            end = self._partial.find(THINK_CLOSE)
+            if end >= 0:
+                # 只有结束标签：之前的内容都是思考过程
+                self._best = ""
+                self._partial = self._partial[end + len(THINK_CLOSE) :]
+                continue
+            start = self._partial.find(THINK_OPEN)
+            if start < 0:
+                break
+            self._consume(self._partial[:start].split("\n"))
+            self._partial = self._partial[start + len(THINK_OPEN) :]
+            self._in_think = True
+        if "\n" not in self._partial:
+            return
+        *lines, self._partial = self._partial.split("\n")
+        self._consume(lines)
+
+    def _consume(self, lines: List[str]) -> None:
+        """处理已完成的段落"""
+        for line in lines:
+            para = line.strip()
+            if (
+                para
+                and len(para) > len(self._best)
+                and not AIGenerator._is_noise_paragraph(para)
             ):
+                self._best = para
+
+    def preview(self) -> Optional[str]:
+        """当前可展示的文案，截至最后一个完整句子；还没有完整句子时返回 None"""
+        candidate = self._best
+        # 思考过程中未完成的部分不参与预览
+        partial = "" if self._in_think else self._partial.strip()
+        if len(partial) > len(candidate) and not AIGenerator._is_noise_paragraph(
+            partial
+        ):
+            candidate = partial
+        if len(candidate) > CONTENT_MAX_CHARS:
+            return candidate[:CONTENT_TRUNCATE_CHARS] + "..."
+        end = max(candidate.rfind(mark) for mark in SENTENCE_ENDINGS)
+        return candidate[: end + 1] if end >= 0 else None
+
+
+class StreamingReply:
+    """
+    流式回复：第一次有可展示内容时发送回复，之后按最小间隔编辑同一条消息
+    """
+
+    def __init__(
+        self, target_message: Message, interval: float = STREAM_EDIT_INTERVAL
+    ):
+        self.target_message = target_message
+        self.interval = interval
+        self.sent: Optional[Message] = None
+        self.failed = False  # 首次回复失败（如目标已被删除）后不再预览
+        self._text = ""
+        self._last_edit = 0.0
+
+    async def update(self, text: str) -> None:
+        """收到新的预览文案（作为 AIGenerator 的 on_update 回调）"""
+        if self.failed:
+            return
+        if self.sent is None:
+            # 回复失败不中断生成，最终文案由 finish 发送（失败时由调用方换一个目标重试）
+            try:
+                self.sent = await self.target_message.reply(text)
+            except Exception as e:
+                self.failed = True
+                logs.debug(f"[JPMAI] 流式回复失败: {e}")
+                return
+            self._text = text
+            self._last_edit = time.monotonic()
+            return
+        if time.monotonic() - self._last_edit < self.interval:
+            return
+        await self._edit(text)
+
+    async def finish(self, text: str) -> None:
+        """生成结束，发送或编辑为最终文案"""
+        if self.sent is None:
+            self.sent = await self.target_message.reply(text)
+            self._text = text
+        elif text != self._text:
+            await self._edit(text)
+
+    async def _edit(self, text: str) -> None:
+        # 编辑失败（如频率限制）不影响后续生成，最终文案会再次尝试编辑
+        try:
+            await self.sent.edit(text)
+            self._text = text
+        except Exception as e:
+            logs.debug(f"[JPMAI] 流式编辑失败: {e}")
+        self._last_edit = time.monotonic()
+
+
+class EndpointHealth:
+    """端点健康度：请求耗时与错误率的指数加权移动平均"""
+
+    def __init__(self, alpha: float = ENDPOINT_EWMA_ALPHA):
+        self.alpha = alpha
+        self.latency: Optional[float] = None  # 秒，尚无成功请求时为 None
+        self.error_rate = 0.0
+        self.requests = 0
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        """记录一次请求结果（失败请求的耗时不计入延迟）"""
+        self.requests += 1
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok:
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency += self.alpha * (elapsed - self.latency)
+
+    def score(self, weight: float, default_latency: float) -> float:
+        """路由权重：配置权重 / 延迟，再按错误率衰减"""
+        latency = self.latency if self.latency is not None else default_latency
+        score = weight / max(latency, 0.1) * (1.0 - self.error_rate) ** 2
+        return max(score, weight * ENDPOINT_MIN_SCORE)
+
+    def describe(self) -> str:
+        """状态描述"""
+        latency = f"{self.latency:.1f} 秒" if self.latency is not None else "未知"
+        return f"延迟 {latency}，错误率 {self.error_rate:.0%}，请求 {self.requests} 次"
+
+
+class EndpointRouter:
+    """
+    多端点路由：按权重与健康度随机选择端点，生成失败时依次切换到其他端点
+    接口与 AIGenerator 相同，只有一个端点时等同于直接使用该端点
+
+    开启对冲（hedge_percentile > 0）后，非流式请求耗时超过最近耗时的该百分位时，
+    向下一个端点（只有一个端点时为同一端点）再发一次相同请求，先成功者胜出，另一个被取消
+    """
+
+    def __init__(
+        self, endpoints: List[Tuple[AIGenerator, float]], hedge_percentile: int = 0
+    ):
+        self.endpoints = endpoints  # [(生成器, 权重), ...]，第一个为主端点
+        self.hedge_percentile = hedge_percentile
+        self._latencies: Deque[float] = deque(maxlen=HEDGE_WINDOW)  # 成功生成的耗时
+        self.hedge_stats = {"requests": 0, "hedged": 0, "wins": 0}
+        if len(endpoints) > 1:
+            # 多端点时由切换端点代替同一端点内的重试
+            for generator, _ in endpoints:
+                generator.retry_policy.max_retries = 0
+
+    @property
+    def generators(self) -> List[AIGenerator]:
+        return [generator for generator, _ in self.endpoints]
+
+    def _ranked(self) -> List[AIGenerator]:
+        """
+        本次请求的端点尝试顺序：
+        首选端点按健康度加权随机抽取，其余按健康度降序作为备选，熔断中的端点排在最后
+        """
+        known = [g.health.latency for g in self.generators if g.health.latency]
+        default_latency = min(known) if known else 1.0
+        available, broken = [], []
+        for generator, weight in self.endpoints:
+            if weight <= 0:
                 continue
+            entry = (generator.health.score(weight, default_latency), generator)
+            if generator.breaker.remaining() > 0:
+                broken.append(entry)
+            else:
+                available.append(entry)
+        if not available:
+            return [generator for _, generator in broken]
+
+        first = random.choices(
+            range(len(available)), weights=[score for score, _ in available]
+        )[0]
+        _, chosen = available.pop(first)
+        available.sort(key=lambda entry: entry[0], reverse=True)
+        return [chosen] + [generator for _, generator in available + broken]
+
+    def latency_percentile(self, pct: float) -> Optional[float]:
+        """最近成功生成耗时的百分位（秒），样本不足时返回 None"""
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        values = sorted(self._latencies)
+        return values[min(len(values) - 1, int(pct / 100 * len(values)))]
 
-            filtered_paragraphs.append(para)
+    async def _generate(
+        self,
+        method: str,
+        args: Tuple,
+        on_update: Optional[StreamCallback],
+        extras: Optional[List[str]] = None,
+    ) -> str:
+        ranked = self._ranked()
+        start = time.perf_counter()
+        result = ""
+
+        # 流式输出只能有一个请求在编辑消息，不参与对冲
+        hedge_delay = (
+            self.latency_percentile(self.hedge_percentile)
+            if self.hedge_percentile and on_update is None
+            else None
+        )
+        if hedge_delay is not None:
+            self.hedge_stats["requests"] += 1
+            result, used = await self._hedged(
+                method, args, ranked, hedge_delay, extras
+            )
+            if not is_generation_error(result):
+                self._latencies.append(time.perf_counter() - start)
+                return result
+            ranked = ranked[used:]
+
+        for index, generator in enumerate(ranked):
+            if index or hedge_delay is not None:
+                logs.warning(f"[JPMAI] 切换到备用端点 {generator.api_url}")
+            result = await getattr(generator, method)(*args, on_update, extras)
+            if not is_generation_error(result):
+                self._latencies.append(time.perf_counter() - start)
+                return result
+        return result
+
+    async def _hedged(
+        self,
+        method: str,
+        args: Tuple,
+        ranked: List[AIGenerator],
+        delay: float,
+        extras: Optional[List[str]] = None,
+    ) -> Tuple[str, int]:
+        """
+        发起请求，超过 delay 秒未完成时向备选端点发起对冲请求
+        返回 (结果, 已使用的端点数)
+        """
+        backup_generator = ranked[1] if len(ranked) > 1 else ranked[0]
+        used = min(2, len(ranked))
+        primary = asyncio.ensure_future(
+            getattr(ranked[0], method)(*args, None, extras)
+        )
+        tasks = {primary}
+        result = ""
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedge_stats["hedged"] += 1
+                logs.debug(
+                    f"[JPMAI] 请求已超过 {delay:.1f} 秒，向 {backup_generator.api_url} 发起对冲请求"
+                )
+                tasks.add(
+                    asyncio.ensure_future(
+                        getattr(backup_generator, method)(*args, None, extras)
+                    )
+                )
+            else:
+                used = 1
+
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        result = f"生成失败: {e}"
+                    if not is_generation_error(result):
+                        if task is not primary:
+                            self.hedge_stats["wins"] += 1
+                        return result, used
+            return result, used
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def generate_single(
+        self,
+        name: str,
+        on_update: Optional[StreamCallback] = None,
+        extras: Optional[List[str]] = None,
+    ) -> str:
+        """生成单人文案"""
+        return await self._generate("generate_single", (name,), on_update, extras)
+
+    async def generate_dual(
+        self,
+        name: str,
+        target: str,
+        on_update: Optional[StreamCallback] = None,
+        extras: Optional[List[str]] = None,
+    ) -> str:
+        """生成双人文案"""
+        return await self._generate(
+            "generate_dual", (name, target), on_update, extras
+        )
 
-        # 如果过滤后没有段落，使用原始段落中最长的
-        if not filtered_paragraphs:
-            filtered_paragraphs = paragraphs
+    def describe_hedge(self) -> str:
+        """对冲统计描述"""
+        if not self.hedge_percentile:
+            return "❌ 已关闭"
+        stats = self.hedge_stats
+        threshold = self.latency_percentile(self.hedge_percentile)
+        threshold_info = (
+            f"{threshold:.1f} 秒"
+            if threshold is not None
+            else f"样本不足（{len(self._latencies)}/{HEDGE_MIN_SAMPLES}）"
+        )
+        hedge_rate = stats["hedged"] / stats["requests"] if stats["requests"] else 0
+        return (
+            f"p{self.hedge_percentile} 阈值 {threshold_info}，"
+            f"请求 {stats['requests']} 次，对冲 {stats['hedged']} 次（{hedge_rate:.0%}），"
+            f"对冲胜出 {stats['wins']} 次"
+        )
 
-        # 返回最长的段落（通常是正文）
-        longest_para = max(filtered_paragraphs, key=len)
+    async def ping(self) -> float:
+        """测量主端点的连接耗时（秒）"""
+        return await self.generators[0].ping()
 
-        # 限制字数在280-350字之间
-        if len(longest_para) > 400:
-            longest_para = longest_para[:350] + "..."
+    @property
+    def active(self) -> int:
+        """所有端点进行中的调用数"""
+        return sum(generator.active for generator in self.generators)
 
-        return longest_para
+    async def aclose(self) -> None:
+        """关闭所有端点的连接池"""
+        for generator in self.generators:
+            await generator.aclose()
 
 
 class JPMAIConfigManager:
@@ -246,9 +1426,27 @@ class JPMAIConfigManager:
         self.api_url: Optional[str] = None  # API 地址
         self.api_key: Optional[str] = None  # API 密钥
         self.model: str = DEFAULT_MODEL  # 模型名称
+        self.stream: bool = False  # 流式输出开关
+        self.max_concurrency: int = DEFAULT_MAX_CONCURRENCY  # 同时进行的生成请求上限
+        self.queue_timeout: int = DEFAULT_QUEUE_TIMEOUT  # 排队超时（秒）
+        self.pool_depth: int = DEFAULT_POOL_DEPTH  # 预生成池深度
+        self.pool_concurrency: int = DEFAULT_POOL_CONCURRENCY  # 预生成并发数
+        self.pool_ttl: int = DEFAULT_POOL_TTL  # 预生成文案有效期（秒）
+        self.pool_batch: int = DEFAULT_POOL_BATCH  # 批量生成的候选数
         self.keywords: Dict[
             str, Dict
         ] = {}  # keyword -> {target_user_id, target_chat_id, rate_limit_seconds, anchor_message_id}
+        self.saver = JSONFileSaver(config_file)
+        self.hedge_percentile: int = 0  # 对冲请求的耗时百分位（0 为关闭）
+        self.token_budget: bool = True  # 自适应 token 预算开关
+        self.api_weight: float = 1.0  # 主端点权重
+        self.endpoints: List[
+            Dict
+        ] = []  # 备用端点 [{url, key, model, weight}, ...]，model 为空时使用主模型
+        self._generator: Optional[EndpointRouter] = None  # 当前 API 配置对应的生成器
+        self._target_index: Dict[
+            Tuple[int, int], List[str]
+        ] = {}  # (target_user_id, target_chat_id) -> [keyword, ...]
         self.load()
 
     def load(self) -> None:
@@ -262,6 +1460,25 @@ class JPMAIConfigManager:
                     self.api_url = data.get("api_url")
                     self.api_key = data.get("api_key")
                     self.model = data.get("model", DEFAULT_MODEL)
+                    self.stream = data.get("stream", False)
+                    self.api_weight = data.get("api_weight", 1.0)
+                    self.endpoints = data.get("endpoints", [])
+                    self.hedge_percentile = data.get("hedge_percentile", 0)
+                    self.token_budget = data.get("token_budget", True)
+                    scheduler = data.get("scheduler", {})
+                    self.max_concurrency = scheduler.get(
+                        "concurrency", DEFAULT_MAX_CONCURRENCY
+                    )
+                    self.queue_timeout = scheduler.get(
+                        "queue_timeout", DEFAULT_QUEUE_TIMEOUT
+                    )
+                    pool = data.get("pool", {})
+                    self.pool_depth = pool.get("depth", DEFAULT_POOL_DEPTH)
+                    self.pool_concurrency = pool.get(
+                        "concurrency", DEFAULT_POOL_CONCURRENCY
+                    )
+                    self.pool_ttl = pool.get("ttl", DEFAULT_POOL_TTL)
+                    self.pool_batch = pool.get("batch", DEFAULT_POOL_BATCH)
                     self.keywords = data.get("keywords", {})
                 logs.info(f"JPMAI 配置已加载，共 {len(self.keywords)} 个关键词")
             except Exception as e:
@@ -269,6 +1486,7 @@ class JPMAIConfigManager:
                 self._reset()
         else:
             self.keywords = {}
+        self._rebuild_index()
 
     def _reset(self):
         """重置配置"""
@@ -277,25 +1495,59 @@ class JPMAIConfigManager:
         self.api_url = None
         self.api_key = None
         self.model = DEFAULT_MODEL
+        self.stream = False
+        self.api_weight = 1.0
+        self.endpoints = []
+        self.hedge_percentile = 0
+        self.token_budget = True
+        self.max_concurrency = DEFAULT_MAX_CONCURRENCY
+        self.queue_timeout = DEFAULT_QUEUE_TIMEOUT
+        self.pool_depth = DEFAULT_POOL_DEPTH
+        self.pool_concurrency = DEFAULT_POOL_CONCURRENCY
+        self.pool_ttl = DEFAULT_POOL_TTL
+        self.pool_batch = DEFAULT_POOL_BATCH
         self.keywords = {}
 
+    def _rebuild_index(self) -> None:
+        """重建 (目标用户ID, 目标群组ID) -> 关键词列表 的索引"""
+        index: Dict[Tuple[int, int], List[str]] = {}
+        for keyword, config in self.keywords.items():
+            key = (config["target_user_id"], config["target_chat_id"])
+            index.setdefault(key, []).append(keyword)
+        self._target_index = index
+
+    def get_keywords_for_target(self, user_id: int, chat_id: int) -> List[str]:
+        """获取以指定用户和群组为目标的所有关键词"""
+        return self._target_index.get((user_id, chat_id), [])
+
     def save(self) -> bool:
         """保存配置到文件"""
         try:
-            with open(config_file, "w", encoding="utf-8") as f:
-                json.dump(
-                    {
-                        "enabled": self.enabled,
-                        "owner_id": self.owner_id,
-                        "api_url": self.api_url,
-                        "api_key": self.api_key,
-                        "model": self.model,
-                        "keywords": self.keywords,
+            self.saver.save(
+                {
+                    "enabled": self.enabled,
+                    "owner_id": self.owner_id,
+                    "api_url": self.api_url,
+                    "api_key": self.api_key,
+                    "model": self.model,
+                    "stream": self.stream,
+                    "api_weight": self.api_weight,
+                    "endpoints": self.endpoints,
+                    "hedge_percentile": self.hedge_percentile,
+                    "token_budget": self.token_budget,
+                    "scheduler": {
+                        "concurrency": self.max_concurrency,
+                        "queue_timeout": self.queue_timeout,
                     },
-                    f,
-                    indent=4,
-                    ensure_ascii=False,
-                )
+                    "pool": {
+                        "depth": self.pool_depth,
+                        "concurrency": self.pool_concurrency,
+                        "ttl": self.pool_ttl,
+                        "batch": self.pool_batch,
+                    },
+                    "keywords": self.keywords,
+                }
+            )
             logs.info("JPMAI 配置已保存")
             return True
         except Exception as e:
@@ -308,26 +1560,182 @@ class JPMAIConfigManager:
         self.api_key = api_key
         if model:
             self.model = model
+        self._retire_generator()
         self.save()
-        return f"API 配置已更新\nURL: `{self.api_url}`\n模型: `{self.model}`"
+        return (
+            f"API 配置已更新\nURL: `{self.api_url}`\n模型: `{self.model}`\n"
+            f"密钥: {len(parse_api_keys(api_key))} 个"
+        )
 
     def set_model(self, model: str) -> str:
         """单独设置模型"""
         if not model or not model.strip():
             return "模型名不能为空"
         self.model = model.strip()
+        self._retire_generator()
         self.save()
         return f"模型已更新为: `{self.model}`"
 
+    def set_scheduler(self, concurrency: int, queue_timeout: int) -> str:
+        """设置生成并发上限与排队超时"""
+        if concurrency < 1:
+            return "并发上限必须大于等于1"
+        if queue_timeout < 1:
+            return "排队超时必须大于0"
+        self.max_concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.save()
+        return f"生成调度已更新\n并发上限: {concurrency}\n排队超时: {queue_timeout} 秒"
+
+    def set_pool(self, depth: int, concurrency: int, ttl: int) -> str:
+        """设置预生成池参数"""
+        if depth < 0:
+            return "池深度必须大于等于0"
+        if concurrency < 1:
+            return "并发数必须大于等于1"
+        if ttl < 1:
+            return "有效期必须大于0"
+        self.pool_depth = depth
+        self.pool_concurrency = concurrency
+        self.pool_ttl = ttl
+        self.save()
+        return (
+            f"预生成池已更新\n深度: {depth} 条/关键词/模式\n"
+            f"并发: {concurrency}\n有效期: {ttl} 秒"
+        )
+
+    def set_pool_batch(self, batch: int) -> str:
+        """设置批量生成的候选数（1 为关闭）"""
+        if not 1 <= batch <= POOL_BATCH_MAX:
+            return f"候选数必须在 1-{POOL_BATCH_MAX} 之间"
+        self.pool_batch = batch
+        if self._generator is not None:
+            for generator in self._generator.generators:
+                generator.batch_size = batch
+        self.save()
+        if batch == 1:
+            return "批量生成已关闭"
+        return f"批量生成已开启\n每次非流式请求 {batch} 个候选，多出的候选放入预生成池"
+
+    def set_hedge(self, percentile: int) -> str:
+        """设置对冲请求的耗时百分位（0 为关闭）"""
+        if not 0 <= percentile < 100:
+            return "百分位必须在 0-99 之间"
+        self.hedge_percentile = percentile
+        if self._generator is not None:
+            self._generator.hedge_percentile = percentile
+        self.save()
+        if not percentile:
+            return "对冲请求已关闭"
+        return f"对冲请求已开启\n耗时超过最近请求的 p{percentile} 时发起对冲"
+
+    def set_token_budget(self, enabled: bool) -> str:
+        """开启/关闭自适应 token 预算（重新开始统计用量）"""
+        self.token_budget = enabled
+        self._retire_generator()
+        self.save()
+        if enabled:
+            return "自适应 token 预算已开启，用量统计已重置"
+        return f"自适应 token 预算已关闭（固定 max_tokens {TOKEN_BUDGET_MAX}），用量统计已重置"
+
     def is_api_configured(self) -> bool:
         """检查 API 是否已配置"""
-        return bool(self.api_url and self.api_key)
+        return bool(self.api_url and self.api_key and parse_api_keys(self.api_key))
+
+    def add_endpoint(
+        self, api_url: str, api_key: str, model: Optional[str], weight: float
+    ) -> str:
+        """添加备用端点"""
+        if weight <= 0:
+            return "权重必须大于0"
+        if not parse_api_keys(api_key):
+            return "密钥不能为空"
+        self.endpoints.append(
+            {
+                "url": api_url.rstrip("/"),
+                "key": api_key,
+                "model": model,
+                "weight": weight,
+            }
+        )
+        self._retire_generator()
+        self.save()
+        return f"备用端点已添加\nURL: `{api_url.rstrip('/')}`\n模型: `{model or self.model}`\n权重: {weight:g}"
+
+    def delete_endpoint(self, index: int) -> tuple[bool, str]:
+        """删除备用端点（序号从2开始，1为主端点）"""
+        if not 2 <= index <= len(self.endpoints) + 1:
+            return False, f"备用端点序号 {index} 不存在"
+        endpoint = self.endpoints.pop(index - 2)
+        self._retire_generator()
+        self.save()
+        return True, f"备用端点 `{endpoint['url']}` 已删除"
+
+    def set_endpoint_weight(self, index: int, weight: float) -> tuple[bool, str]:
+        """设置端点权重（序号 1 为主端点），直接应用到当前生成器，保留其健康度统计"""
+        if weight <= 0:
+            return False, "权重必须大于0"
+        if not 1 <= index <= len(self.endpoints) + 1:
+            return False, f"端点序号 {index} 不存在"
+        if index == 1:
+            self.api_weight = weight
+        else:
+            self.endpoints[index - 2]["weight"] = weight
+        if self._generator is not None:
+            generator, _ = self._generator.endpoints[index - 1]
+            self._generator.endpoints[index - 1] = (generator, weight)
+        self.save()
+        return True, f"端点 {index} 的权重已设置为 {weight:g}"
 
-    def get_generator(self) -> Optional[AIGenerator]:
-        """获取 AI 生成器实例"""
+    def get_generator(self) -> Optional[EndpointRouter]:
+        """获取 AI 生成器实例（同一 API 配置复用同一个生成器及其连接池）"""
         if not self.is_api_configured():
             return None
-        return AIGenerator(self.api_url, self.api_key, self.model)
+        if self._generator is None:
+            self._generator = self.build_generator()
+        return self._generator
+
+    def build_generator(self) -> EndpointRouter:
+        """按当前 API 配置创建新的生成器（独立的连接池、熔断器、健康度与 token 预算）"""
+        endpoints = [
+            (AIGenerator(self.api_url, self.api_key, self.model), self.api_weight)
+        ]
+        for endpoint in self.endpoints:
+            generator = AIGenerator(
+                endpoint["url"], endpoint["key"], endpoint.get("model") or self.model
+            )
+            endpoints.append((generator, endpoint.get("weight", 1.0)))
+        for generator, _ in endpoints:
+            generator.token_budget.enabled = self.token_budget
+            generator.batch_size = self.pool_batch
+        return EndpointRouter(endpoints, self.hedge_percentile)
+
+    def _retire_generator(self) -> None:
+        """API 配置变化后丢弃旧生成器，等待使用它的请求全部结束后再关闭其连接池"""
+        generator, self._generator = self._generator, None
+        if generator is None:
+            return
+        try:
+            asyncio.get_running_loop().create_task(self._close_later(generator))
+        except RuntimeError:
+            pass
+
+    @staticmethod
+    async def _close_later(generator: EndpointRouter) -> None:
+        """
+        延迟关闭生成器连接池
+        先等待一个排队超时，让已取得旧生成器的排队请求开始调用或放弃，再等待进行中的调用结束
+        """
+        await asyncio.sleep(generation_scheduler.timeout)
+        while generator.active:
+            await asyncio.sleep(GENERATOR_IDLE_POLL)
+        await generator.aclose()
+
+    async def close_generator(self) -> None:
+        """立即关闭当前生成器的连接池"""
+        generator, self._generator = self._generator, None
+        if generator is not None:
+            await generator.aclose()
 
     def add_keyword(
         self,
@@ -356,6 +1764,7 @@ class JPMAIConfigManager:
             "anchor_message_id": existing_anchor,
             "enabled": existing_enabled,
         }
+        self._rebuild_index()
         self.save()
         return f"关键词 `{keyword}` 配置已更新"
 
@@ -388,6 +1797,7 @@ class JPMAIConfigManager:
         """删除关键词配置"""
         if keyword in self.keywords:
             del self.keywords[keyword]
+            self._rebuild_index()
             self.save()
             return True, f"关键词 `{keyword}` 已删除"
         return False, f"关键词 `{keyword}` 不存在"
@@ -420,34 +1830,902 @@ class JPMAIConfigManager:
         return "\n".join(lines)
 
 
+class GenerationScheduler:
+    """
+    生成请求调度器：限制同时进行的生成请求数，超出时按优先级排队
+    主人的触发优先于其他人，预生成池的后台补充优先级最低；排队超过期限的请求放弃
+    """
+
+    PRIORITY_OWNER = 0
+    PRIORITY_USER = 1
+    PRIORITY_BACKGROUND = 2
+    PRIORITY_NAMES = {
+        PRIORITY_OWNER: "主人",
+        PRIORITY_USER: "其他人",
+        PRIORITY_BACKGROUND: "预生成",
+    }
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        timeout: float = DEFAULT_QUEUE_TIMEOUT,
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: List[
+            Tuple[int, int, asyncio.Future]
+        ] = []  # 堆：(优先级, 序号, 等待者)，序号保证同优先级先到先得
+        self._seq = 0
+        self._wait_times: Deque[float] = deque(maxlen=SCHEDULER_WAIT_WINDOW)
+        self.stats = {"granted": 0, "expired": 0}
+
+    def configure(self, concurrency: int, timeout: float) -> None:
+        """调整并发上限与排队超时，上限提高时立即放行排队中的请求"""
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._wake()
+
+    async def acquire(
+        self,
+        priority: int,
+        timeout: Optional[float] = -1,
+        ticket: Optional[Dict] = None,
+    ) -> bool:
+        """
+        获取一个生成名额，timeout 为 -1 时使用默认排队超时，为 None 时不限时
+        传入 ticket 时排队信息记录在其中，之后可通过 promote(ticket, ...) 提高优先级
+        超时返回 False；获取成功后必须调用 release()
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self._granted(0.0)
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, future))
+        if ticket is not None:
+            ticket.update(priority=priority, seq=self._seq, waiter=future)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.stats["expired"] += 1
+            return False
+        except asyncio.CancelledError:
+            # 已被放行但调用方被取消时归还名额
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self._granted(time.monotonic() - start)
+        return True
+
+    def promote(self, ticket: Dict, priority: int) -> None:
+        """
+        提高排队中请求的优先级（如主人的触发合并到其他人发起的请求）
+        以原序号重新入队，旧的堆条目在放行后自动跳过
+        """
+        waiter = ticket.get("waiter")
+        if priority >= ticket.get("priority", priority):
+            return
+        ticket["priority"] = priority
+        if waiter is not None and not waiter.done():
+            heapq.heappush(self._waiters, (priority, ticket["seq"], waiter))
+            self._wake()
+
+    def release(self) -> None:
+        """归还生成名额"""
+        self.active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """按优先级放行排队中的请求（名额直接转交，跳过已超时的等待者）"""
+        while self.active < self.concurrency and self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def _granted(self, wait: float) -> None:
+        self.stats["granted"] += 1
+        self._wait_times.append(wait)
+
+    def queue_depth(self) -> Dict[int, int]:
+        """各优先级排队中的请求数"""
+        # 提高过优先级的请求在堆中有多个条目，按最高优先级计数
+        priorities: Dict[asyncio.Future, int] = {}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                priorities[future] = min(priority, priorities.get(future, priority))
+        depth: Dict[int, int] = {}
+        for priority in priorities.values():
+            depth[priority] = depth.get(priority, 0) + 1
+        return depth
+
+    def wait_percentile(self, pct: float) -> float:
+        """最近排队耗时的百分位（秒）"""
+        if not self._wait_times:
+            return 0.0
+        values = sorted(self._wait_times)
+        return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+    def describe(self) -> str:
+        """状态描述"""
+        depth = self.queue_depth()
+        queued = (
+            "、".join(
+                f"{self.PRIORITY_NAMES[priority]} {count}"
+                for priority, count in sorted(depth.items())
+            )
+            or "0"
+        )
+        return (
+            f"运行 {self.active}/{self.concurrency}，排队 {queued}，"
+            f"排队耗时 p50 {self.wait_percentile(50):.1f} 秒 / p95 {self.wait_percentile(95):.1f} 秒，"
+            f"超时放弃 {self.stats['expired']} 次"
+        )
+
+
+class GenerationPool:
+    """
+    预生成文案池
+    后台任务在没有实时触发时为每个已开启关键词的单人/双人模式补充文案，
+    触发时直接取用，池为空时才实时调用 API
+    双人文案以 POOL_TARGET_PLACEHOLDER 作为目标名生成，发送时替换
+    开启批量生成时，后台补充与实时生成一次请求多个候选，多出的候选放入池中
+    """
+
+    MODES = ("single", "dual")
+
+    def __init__(self, config: JPMAIConfigManager):
+        self.config = config
+        self._texts: Dict[
+            Tuple[str, str], Deque[Tuple[float, str]]
+        ] = {}  # (keyword, mode) -> [(过期时间, 文案), ...]
+        self._task: Optional[asyncio.Task] = None
+        self._epoch = 0  # 清空池时递增，丢弃清空前开始生成的文案
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, keyword: str, mode: str) -> Optional[str]:
+        """取出一条未过期的文案，并在后台补充"""
+        texts = self._texts.get((keyword, mode))
+        now = time.monotonic()
+        text = None
+        while texts:
+            expires_at, candidate = texts.popleft()
+            if expires_at > now:
+                text = candidate
+                break
+        if self.config.pool_depth > 0 or self.config.pool_batch > 1:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.schedule()
+        return text
+
+    def count(self, keyword: str, mode: str) -> int:
+        """未过期的文案数量"""
+        now = time.monotonic()
+        return sum(
+            1
+            for expires_at, _ in self._texts.get((keyword, mode), ())
+            if expires_at > now
+        )
+
+    def clear(self, keyword: Optional[str] = None) -> None:
+        """清空指定关键词（默认全部）的文案，如模型变更后"""
+        if keyword is None:
+            self._texts.clear()
+        else:
+            for mode in self.MODES:
+                self._texts.pop((keyword, mode), None)
+        self._epoch += 1
+        self.schedule()
+
+    def schedule(self) -> None:
+        """后台补充任务未运行时启动"""
+        if self._task is not None or self.config.pool_depth <= 0:
+            return
+        try:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        except RuntimeError:
+            pass
+
+    async def stop(self) -> None:
+        """停止后台补充任务"""
+        task, self._task = self._task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    def _deficits(self) -> List[Tuple[str, str]]:
+        """需要补充的 (关键词, 模式)，每轮每项最多补充一条，保证各关键词轮流补充"""
+        if not self.config.enabled or not self.config.is_api_configured():
+            return []
+        now = time.monotonic()
+        jobs = []
+        for keyword, keyword_config in self.config.keywords.items():
+            if not keyword_config.get("enabled", True):
+                continue
+            for mode in self.MODES:
+                texts = self._texts.get((keyword, mode))
+                if texts is None:
+                    texts = self._texts[(keyword, mode)] = deque()
+                while texts and texts[0][0] <= now:
+                    texts.popleft()
+                if len(texts) < self.config.pool_depth:
+                    jobs.append((keyword, mode))
+        # 移除已删除关键词的文案
+        for key in [key for key in self._texts if key[0] not in self.config.keywords]:
+            del self._texts[key]
+        return jobs
+
+    async def _run(self) -> None:
+        failures = 0  # 连续失败的轮数
+        try:
+            while True:
+                jobs = self._deficits()
+                if not jobs:
+                    return
+                # 有实时触发进行中时让出 API 额度
+                while trigger_log.inflight_counts():
+                    await asyncio.sleep(POOL_IDLE_POLL)
+                if not self.config.is_api_configured():
+                    return
+                batch = jobs[: self.config.pool_concurrency]
+                results = await asyncio.gather(
+                    *(self._fill(keyword, mode) for keyword, mode in batch)
+                )
+                if all(results):
+                    failures = 0
+                    continue
+                failures += 1
+                if failures >= POOL_MAX_FAILURES:
+                    logs.warning(f"[JPMAI] 预生成连续失败 {failures} 轮，暂停补充直到下次触发")
+                    return
+                await asyncio.sleep(
+                    min(POOL_RETRY_DELAY * 2 ** (failures - 1), POOL_RETRY_MAX_DELAY)
+                )
+        except Exception as e:
+            logs.error(f"[JPMAI] 预生成任务异常: {e}")
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    async def generate(
+        self,
+        generator: EndpointRouter,
+        keyword: str,
+        target: Optional[str] = None,
+        on_update: Optional[StreamCallback] = None,
+    ) -> str:
+        """
+        实时生成一条文案（target 为空时为单人模式）
+        开启批量生成且非流式时，其余候选放入池中；双人候选中的目标名替换为占位名，
+        无法安全替换（见 _to_placeholder）的候选不放入池中
+        """
+        mode = "dual" if target else "single"
+        extras = [] if on_update is None and self.config.pool_batch > 1 else None
+        epoch = self._epoch
+        if target:
+            text = await generator.generate_dual(keyword, target, on_update, extras)
+            if extras:
+                extras = [
+                    pooled
+                    for pooled in (
+                        self._to_placeholder(extra, keyword, target) for extra in extras
+                    )
+                    if pooled is not None
+                ]
+        else:
+            text = await generator.generate_single(keyword, on_update, extras)
+        if extras:
+            stored = self._put(keyword, mode, extras, epoch)
+            logs.info(f"[JPMAI] `{keyword}` ({mode}) 批量生成的 {stored} 条候选已放入池中")
+        return text
+
+    @staticmethod
+    def _to_placeholder(text: str, keyword: str, target: str) -> Optional[str]:
+        """
+        将双人候选中的目标名替换为占位名，无法安全替换时返回 None：
+        目标名过短或是关键词的一部分、候选中没有目标名或已含占位名，
+        或目标名出现在其他英文单词/数字内部（替换会改动无关文字）
+        """
+        if len(target) < POOL_TARGET_MIN_LENGTH or target in keyword:
+            return None
+        if POOL_TARGET_PLACEHOLDER in text:
+            return None
+        pattern = re.compile(rf"(?<![A-Za-z0-9_]){re.escape(target)}(?![A-Za-z0-9_])")
+        replaced, count = pattern.subn(POOL_TARGET_PLACEHOLDER, text)
+        if not count or count != text.count(target):
+            return None
+        return replaced
+
+    def _put(self, keyword: str, mode: str, texts: List[str], epoch: int) -> int:
+        """
+        将文案放入池中，返回放入的数量
+        池在生成期间被清空时丢弃；每项最多保留 max(池深度, 批量候选数 - 1) 条
+        """
+        if epoch != self._epoch:
+            return 0
+        limit = max(self.config.pool_depth, self.config.pool_batch - 1)
+        queue = self._texts.setdefault((keyword, mode), deque())
+        expires_at = time.monotonic() + self.config.pool_ttl
+        stored = 0
+        for text in texts:
+            if len(queue) >= limit:
+                break
+            if mode == "dual" and POOL_TARGET_PLACEHOLDER not in text:
+                continue
+            queue.append((expires_at, text))
+            stored += 1
+        return stored
+
+    async def _fill(self, keyword: str, mode: str) -> bool:
+        """生成文案放入池中（批量生成时一次放入多条），失败时返回 False"""
+        epoch = self._epoch
+        extras = [] if self.config.pool_batch > 1 else None
+        # 后台补充以最低优先级排队，不限时；排队期间 API 配置可能变化，取得名额后再获取生成器
+        await generation_scheduler.acquire(GenerationScheduler.PRIORITY_BACKGROUND, None)
+        try:
+            generator = self.config.get_generator()
+            if not generator:
+                return False
+            if mode == "dual":
+                text = await generator.generate_dual(
+                    keyword, POOL_TARGET_PLACEHOLDER, None, extras
+                )
+            else:
+                text = await generator.generate_single(keyword, None, extras)
+        finally:
+            generation_scheduler.release()
+        if is_generation_error(text):
+            logs.warning(f"[JPMAI] 预生成 `{keyword}` ({mode}) 失败: {text}")
+            return False
+        if mode == "dual" and POOL_TARGET_PLACEHOLDER not in text:
+            logs.warning(f"[JPMAI] 预生成 `{keyword}` 双人文案未包含目标名，已丢弃")
+            return False
+        self._put(keyword, mode, [text] + (extras or []), epoch)
+        return True
+
+
+class SingleFlight:
+    """
+    相同请求合并：同一 key 的生成进行中时，后到的请求等待同一结果，不重复请求上游
+    生成在独立任务中进行，发起者被取消不影响其他等待者；
+    后到的请求优先级更高（如主人合并到其他人发起的请求）时，提高排队中请求的优先级
+    """
+
+    def __init__(self, scheduler: GenerationScheduler):
+        self.scheduler = scheduler
+        self._inflight: Dict[
+            Tuple, Tuple[asyncio.Task, Dict]
+        ] = {}  # key -> (进行中的生成任务, 排队信息)
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(
+        self, key: Tuple, priority: int, factory: Callable[[Dict], Awaitable]
+    ):
+        """
+        执行 factory(ticket)，相同 key 正在执行时等待其结果
+        ticket 为排队信息，factory 应以 ticket["priority"] 及 ticket 调用 GenerationScheduler.acquire
+        """
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.started += 1
+            ticket = {"priority": priority}
+            task = asyncio.ensure_future(factory(ticket))
+            self._inflight[key] = (task, ticket)
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            task, ticket = flight
+            self.coalesced += 1
+            self.scheduler.promote(ticket, priority)
+            logs.info(f"[JPMAI] 相同的生成正在进行，合并请求: {key}")
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Tuple, task: asyncio.Task) -> None:
+        flight = self._inflight.get(key)
+        if flight is not None and flight[0] is task:
+            del self._inflight[key]
+
+    def describe(self) -> str:
+        """状态描述"""
+        return (
+            f"进行中 {len(self._inflight)}，已生成 {self.started} 次，"
+            f"合并相同请求 {self.coalesced} 次"
+        )
+
+
+def is_generation_error(text: str) -> bool:
+    """判断生成结果是否为失败提示"""
+    return text.startswith(GENERATION_ERROR_PREFIXES)
+
+
+def write_json_atomic(path: Path, data, indent: int = 4) -> None:
+    """原子写入 JSON：先写入临时文件再替换原文件，写入中断不会损坏原文件"""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp_path.unlink()
+        raise
+
+
+class JSONFileSaver:
+    """
+    JSON 文件异步保存器
+    在事件循环中保存时，先对数据做快照，再交给线程池原子写入；
+    同一文件的写入串行执行，写入期间的多次保存只写入最新一次
+    """
+
+    def __init__(self, path: Path, indent: int = 4):
+        self.path = path
+        self.indent = indent
+        self._pending = None  # 等待写入的最新数据快照
+        self._task: Optional[asyncio.Task] = None  # 后台写入任务
+
+    def save(self, data) -> None:
+        """提交保存（不在事件循环中时同步写入）"""
+        self._pending = copy.deepcopy(data)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            data, self._pending = self._pending, None
+            write_json_atomic(self.path, data, self.indent)
+            return
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        """依次写入等待中的数据"""
+        loop = asyncio.get_running_loop()
+        while self._pending is not None:
+            data, self._pending = self._pending, None
+            try:
+                await loop.run_in_executor(
+                    None, write_json_atomic, self.path, data, self.indent
+                )
+            except Exception as e:
+                logs.error(f"[JPMAI] 保存 {self.path.name} 失败: {e}")
+
+    async def flush(self) -> None:
+        """等待尚未完成的写入"""
+        if self._task and not self._task.done():
+            await self._task
+
+
+class MessageCache:
+    """已解析消息对象的 LRU 缓存（带有效期），避免触发时重复拉取锚点消息"""
+
+    def __init__(
+        self, maxsize: int = MESSAGE_CACHE_SIZE, ttl: float = MESSAGE_CACHE_TTL
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[Tuple[int, int], Tuple[float, Message]]" = (
+            OrderedDict()
+        )  # (chat_id, message_id) -> (过期时间, 消息)
+
+    def put(self, message: Message) -> None:
+        """缓存一条消息"""
+        key = (message.chat.id, message.id)
+        self._items[key] = (time.monotonic() + self.ttl, message)
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, chat_id: int, message_id: int) -> Optional[Message]:
+        """获取缓存的消息，不存在或已过期时返回 None"""
+        item = self._items.get((chat_id, message_id))
+        if item is None:
+            return None
+        expires_at, message = item
+        if expires_at < time.monotonic():
+            del self._items[(chat_id, message_id)]
+            return None
+        self._items.move_to_end((chat_id, message_id))
+        return message
+
+    def discard(self, chat_id: int, message_id: int) -> None:
+        """移除缓存的消息"""
+        self._items.pop((chat_id, message_id), None)
+
+
+class RecentMessageBuffer:
+    """目标用户最近消息ID的环形缓冲区（仅记录被关键词监听的用户）"""
+
+    def __init__(self, maxlen: int = RECENT_MESSAGE_BUFFER_SIZE):
+        self.maxlen = maxlen
+        self._buffers: Dict[
+            Tuple[int, int], Deque[int]
+        ] = {}  # (chat_id, user_id) -> 最近消息ID（旧 -> 新）
+
+    def push(self, chat_id: int, user_id: int, message_id: int) -> None:
+        """记录一条新消息"""
+        buffer = self._buffers.get((chat_id, user_id))
+        if buffer is None:
+            buffer = self._buffers[(chat_id, user_id)] = deque(maxlen=self.maxlen)
+        if not buffer or buffer[-1] != message_id:
+            buffer.append(message_id)
+
+    def recent(self, chat_id: int, user_id: int) -> List[int]:
+        """获取缓存的消息ID（新 -> 旧）"""
+        buffer = self._buffers.get((chat_id, user_id))
+        return list(reversed(buffer)) if buffer else []
+
+    def discard(self, chat_id: int, user_id: int, message_id: int) -> None:
+        """移除已失效（被删除或无法获取）的消息ID"""
+        buffer = self._buffers.get((chat_id, user_id))
+        if buffer and message_id in buffer:
+            buffer.remove(message_id)
+
+
+class LatencyHistogram:
+    """固定对数分桶的耗时直方图，百分位取所在桶的上界"""
+
+    def __init__(self, counts: Optional[List[int]] = None):
+        self.counts = list(counts or [])
+        # 多出的一个桶记录超过最大上界的耗时
+        self.counts += [0] * (len(TELEMETRY_BUCKETS) + 1 - len(self.counts))
+        self.total = sum(self.counts)
+
+    def add(self, seconds: float) -> None:
+        index = 0
+        while index < len(TELEMETRY_BUCKETS) and seconds > TELEMETRY_BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += 1
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """百分位（秒），没有样本时返回 None"""
+        if not self.total:
+            return None
+        rank = pct / 100 * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return (
+                    TELEMETRY_BUCKETS[index]
+                    if index < len(TELEMETRY_BUCKETS)
+                    else float("inf")
+                )
+        return float("inf")
+
+
+class TelemetryStore:
+    """
+    按 (端点, 模型) 统计每次生成调用的耗时、首字节耗时、token 用量、重试次数与结果
+    内存中累计，有新记录后每隔 TELEMETRY_FLUSH_INTERVAL 秒写入文件
+    """
+
+    def __init__(self):
+        self.models: Dict[str, Dict] = {}  # "模型 @ 端点" -> 统计
+        self._flush_task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self.saver = JSONFileSaver(telemetry_file)
+        self.load()
+
+    def load(self) -> None:
+        """从文件加载统计"""
+        self.models = {}
+        if not telemetry_file.exists():
+            return
+        try:
+            with open(telemetry_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key, entry in data.get("models", {}).items():
+                entry["wall"] = LatencyHistogram(entry.get("wall"))
+                entry["ttfb"] = LatencyHistogram(entry.get("ttfb"))
+                self.models[key] = entry
+        except Exception as e:
+            logs.error(f"加载 JPMAI 调用统计失败: {e}")
+            self.models = {}
+
+    @staticmethod
+    def _new_entry() -> Dict:
+        return {
+            "wall": LatencyHistogram(),
+            "ttfb": LatencyHistogram(),
+            "calls": 0,
+            "retries": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "ok_seconds": 0.0,  # 成功调用的总耗时，用于计算 tokens/秒
+            "ok_tokens": 0,
+            "outcomes": {},  # 结果 -> 次数
+        }
+
+    def record(self, api_url: str, model: str, wall: float, metrics: Dict) -> None:
+        """记录一次生成调用"""
+        key = f"{model} @ {api_url}"
+        entry = self.models.get(key)
+        if entry is None:
+            entry = self.models[key] = self._new_entry()
+        outcome = metrics["outcome"]
+        entry["calls"] += 1
+        entry["retries"] += max(0, metrics["attempts"] - 1)
+        entry["prompt_tokens"] += metrics["prompt_tokens"]
+        entry["completion_tokens"] += metrics["completion_tokens"]
+        entry["outcomes"][outcome] = entry["outcomes"].get(outcome, 0) + 1
+        if outcome == "ok":
+            entry["wall"].add(wall)
+            entry["ok_seconds"] += wall
+            entry["ok_tokens"] += metrics["completion_tokens"]
+            if metrics["ttfb"] is not None:
+                entry["ttfb"].add(metrics["ttfb"])
+        self._mark_dirty()
+
+    def _mark_dirty(self) -> None:
+        """标记有未写入的统计，并安排延迟写入"""
+        self._dirty = True
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(
+                    self._delayed_flush()
+                )
+            except RuntimeError:
+                self.flush()
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(TELEMETRY_FLUSH_INTERVAL)
+        self.flush()
+
+    def flush(self) -> None:
+        """立即写入未保存的统计"""
+        if self._flush_task and not self._flush_task.done():
+            if self._flush_task is not asyncio.current_task():
+                self._flush_task.cancel()
+        self._flush_task = None
+        if not self._dirty:
+            return
+        models = {}
+        for key, entry in self.models.items():
+            models[key] = {
+                **entry,
+                "wall": entry["wall"].counts,
+                "ttfb": entry["ttfb"].counts,
+            }
+        try:
+            self.saver.save({"models": models})
+            self._dirty = False
+        except Exception as e:
+            logs.error(f"保存 JPMAI 调用统计失败: {e}")
+
+    def reset(self) -> None:
+        """清空统计"""
+        self.models = {}
+        self._mark_dirty()
+
+    def describe(self) -> str:
+        """各模型的统计描述"""
+        if not self.models:
+            return "暂无调用记录"
+
+        def seconds(value: Optional[float]) -> str:
+            if value is None:
+                return "-"
+            return "超时" if value == float("inf") else f"{value:.1f}s"
+
+        lines = []
+        for key, entry in sorted(self.models.items()):
+            calls = entry["calls"]
+            ok = entry["outcomes"].get("ok", 0)
+            wall = entry["wall"]
+            ttfb = entry["ttfb"]
+            speed = (
+                f"{entry['ok_tokens'] / entry['ok_seconds']:.1f}"
+                if entry["ok_seconds"]
+                else "-"
+            )
+            failures = "、".join(
+                f"{outcome} {count}"
+                for outcome, count in sorted(
+                    entry["outcomes"].items(), key=lambda item: -item[1]
+                )
+                if outcome != "ok"
+            )
+            lines.append(f"**`{key}`**")
+            lines.append(
+                f"  调用 {calls} 次，错误率 {(calls - ok) / calls:.1%}，重试 {entry['retries']} 次"
+            )
+            lines.append(
+                f"  耗时 p50 {seconds(wall.percentile(50))} / p95 {seconds(wall.percentile(95))}"
+                f" / p99 {seconds(wall.percentile(99))}"
+            )
+            if ttfb.total:
+                lines.append(
+                    f"  首字节 p50 {seconds(ttfb.percentile(50))} / p95 {seconds(ttfb.percentile(95))}"
+                )
+            lines.append(
+                f"  {speed} tokens/秒，平均 {entry['prompt_tokens'] / calls:.0f} 输入 + "
+                f"{entry['completion_tokens'] / calls:.0f} 输出 tokens"
+            )
+            if failures:
+                lines.append(f"  失败: {failures}")
+        return "\n".join(lines)
+
+
 class TriggerLogManager:
-    """触发记录管理类"""
+    """
+    触发记录管理类
+    每次触发向日志文件追加一行，启动时从快照加载并重放快照之后的日志，
+    后台定期将状态压缩为快照；日志本身保留完整的触发历史，
+    最近触发次数由内存中的时间窗口统计（随快照保存），不读取日志
+    """
 
     def __init__(self):
         self.logs: Dict[str, float] = {}  # keyword -> last_trigger_time
+        self._journal_offset: int = 0  # 日志文件中已记录的字节数
+        self._recent: Deque[float] = deque()  # 时间窗口内的触发时间（升序）
+        self._pending: int = 0  # 快照之后追加的记录数
+        self._compact_task: Optional[asyncio.Task] = None  # 延迟压缩任务
+        self._reserved: Dict[str, float] = {}  # keyword -> 非主人预约的触发时间
+        self._inflight: Dict[str, int] = {}  # keyword -> 进行中的触发数
+        self.saver = JSONFileSaver(trigger_log_file)
         self.load()
 
     def load(self) -> None:
-        """从文件加载触发记录"""
+        """从快照加载触发记录，并重放快照之后追加的日志"""
+        self.logs = {}
+        self._recent = deque()
+        offset = 0
         if trigger_log_file.exists():
             try:
                 with open(trigger_log_file, "r", encoding="utf-8") as f:
-                    self.logs = json.load(f)
-                logs.info(f"JPMAI 触发记录已加载，共 {len(self.logs)} 条")
+                    data = json.load(f)
+                if isinstance(data.get("logs"), dict):
+                    self.logs = data["logs"]
+                    offset = data.get("journal_offset", 0)
+                    self._recent.extend(data.get("recent", []))
+                else:
+                    # 兼容旧格式：keyword -> last_trigger_time
+                    self.logs = data
             except Exception as e:
                 logs.error(f"加载 JPMAI 触发记录失败: {e}")
                 self.logs = {}
+
+        replayed = self._replay(offset)
+        self._prune_recent()
+        logs.info(f"JPMAI 触发记录已加载，共 {len(self.logs)} 条，重放日志 {replayed} 条")
+
+    def _replay(self, offset: int) -> int:
+        """从指定偏移重放日志，返回重放的记录数"""
+        self._journal_offset = 0
+        self._pending = 0
+        if not trigger_journal_file.exists():
+            return 0
+
+        try:
+            size = trigger_journal_file.stat().st_size
+            if offset > size:
+                # 日志被替换或截断，从头重放
+                offset = 0
+            with open(trigger_journal_file, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # 写入中断留下的不完整行
+                    offset += len(line)
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    self._pending += 1
+            if offset < size:
+                with open(trigger_journal_file, "r+b") as f:
+                    f.truncate(offset)
+        except Exception as e:
+            logs.error(f"重放 JPMAI 触发日志失败: {e}")
+
+        self._journal_offset = offset
+        return self._pending
+
+    def _apply(self, entry: Dict) -> None:
+        """将一条日志应用到内存状态"""
+        if entry.get("cleared"):
+            self.logs.pop(entry["keyword"], None)
         else:
-            self.logs = {}
+            self.logs[entry["keyword"]] = entry["time"]
+            self._recent.append(entry["time"])
+
+    def _prune_recent(self) -> None:
+        """移出时间窗口之外的触发时间"""
+        cutoff = time.time() - TRIGGER_RECENT_WINDOW
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+
+    def recent_count(self) -> int:
+        """最近 TRIGGER_RECENT_WINDOW 秒内的触发次数"""
+        self._prune_recent()
+        return len(self._recent)
+
+    def _append(self, entry: Dict) -> None:
+        """追加一条日志并更新内存状态"""
+        self._apply(entry)
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            with open(trigger_journal_file, "ab") as f:
+                f.write(line)
+            self._journal_offset += len(line)
+            self._pending += 1
+        except Exception as e:
+            logs.error(f"写入 JPMAI 触发日志失败: {e}")
+            return
+        self._schedule_compaction()
+
+    def _schedule_compaction(self) -> None:
+        """追加达到阈值时立即压缩，否则延迟压缩"""
+        if self._pending >= TRIGGER_COMPACT_THRESHOLD:
+            self.compact()
+            return
+
+        if self._compact_task is None or self._compact_task.done():
+            try:
+                self._compact_task = asyncio.get_running_loop().create_task(
+                    self._delayed_compact()
+                )
+            except RuntimeError:
+                self.compact()
+
+    async def _delayed_compact(self) -> None:
+        """等待压缩间隔后压缩"""
+        await asyncio.sleep(TRIGGER_COMPACT_INTERVAL)
+        self.compact()
+
+    def compact(self) -> None:
+        """将当前状态写入快照，之后启动只需重放新追加的日志"""
+        if self._compact_task and not self._compact_task.done():
+            if self._compact_task is not asyncio.current_task():
+                self._compact_task.cancel()
+        self._compact_task = None
+        if self._pending:
+            self.save()
 
     def save(self) -> None:
-        """保存触发记录到文件"""
+        """保存触发记录快照到文件"""
+        self._prune_recent()
         try:
-            with open(trigger_log_file, "w", encoding="utf-8") as f:
-                json.dump(self.logs, f, indent=4)
+            self.saver.save(
+                {
+                    "logs": self.logs,
+                    "journal_offset": self._journal_offset,
+                    "recent": list(self._recent),
+                }
+            )
+            self._pending = 0
         except Exception as e:
             logs.error(f"保存 JPMAI 触发记录失败: {e}")
 
+    def iter_history(self, since: float = 0) -> Iterator[Dict]:
+        """按时间顺序遍历触发历史（不含清除记录）"""
+        if not trigger_journal_file.exists():
+            return
+        with open(trigger_journal_file, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if not entry.get("cleared") and entry.get("time", 0) >= since:
+                    yield entry
+
     def can_trigger(self, keyword: str, is_owner: bool) -> tuple[bool, Optional[int]]:
         """检查关键词是否可以触发"""
         # 主人无限制
@@ -455,8 +2733,10 @@ class TriggerLogManager:
             return True, None
 
         # 检查频率限制
-        if keyword in self.logs:
-            last_time = self.logs[keyword]
+        last_time = max(
+            self.logs.get(keyword, 0), self._reserved.get(keyword, 0)
+        )
+        if last_time:
             elapsed = time.time() - last_time
             keyword_config = config_manager.get_keyword_config(keyword)
             if keyword_config:
@@ -469,27 +2749,96 @@ class TriggerLogManager:
 
         return True, None
 
-    def record_trigger(self, keyword: str) -> None:
-        """记录关键词触发时间"""
-        self.logs[keyword] = time.time()
-        self.save()
+    def reserve(
+        self, keyword: str, is_owner: bool
+    ) -> tuple[Optional[Dict], Optional[int]]:
+        """
+        检查频率限制并同步占用触发名额，须在任何 await 之前调用
+        返回: (预约记录, 需要等待的秒数)，无法触发时预约记录为 None
+        """
+        can_trigger, wait_time = self.can_trigger(keyword, is_owner)
+        if not can_trigger:
+            return None, wait_time
+
+        reservation = {"keyword": keyword, "time": time.time(), "owner": is_owner}
+        if not is_owner:
+            # 占用频率限制，并发的非主人触发会被 can_trigger 拦截
+            self._reserved[keyword] = reservation["time"]
+        self._inflight[keyword] = self._inflight.get(keyword, 0) + 1
+        return reservation, None
+
+    def commit(
+        self,
+        reservation: Dict,
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+    ) -> None:
+        """触发成功：记录触发并释放预约"""
+        self.record_trigger(reservation["keyword"], user_id, chat_id)
+        self._release(reservation)
+
+    def rollback(self, reservation: Dict) -> None:
+        """触发失败：释放预约，不记录触发"""
+        self._release(reservation)
+
+    def _release(self, reservation: Dict) -> None:
+        """释放预约占用的名额"""
+        keyword = reservation["keyword"]
+        if self._reserved.get(keyword) == reservation["time"]:
+            del self._reserved[keyword]
+        count = self._inflight.get(keyword, 0) - 1
+        if count > 0:
+            self._inflight[keyword] = count
+        else:
+            self._inflight.pop(keyword, None)
+
+    def inflight(self, keyword: str) -> int:
+        """获取关键词进行中的触发数"""
+        return self._inflight.get(keyword, 0)
+
+    def inflight_counts(self) -> Dict[str, int]:
+        """获取所有关键词进行中的触发数"""
+        return dict(self._inflight)
+
+    def record_trigger(
+        self,
+        keyword: str,
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+    ) -> None:
+        """记录关键词触发"""
+        self._append(
+            {
+                "time": time.time(),
+                "keyword": keyword,
+                "user_id": user_id,
+                "chat_id": chat_id,
+            }
+        )
 
     def clear_keyword(self, keyword: str) -> None:
         """清除关键词的触发记录"""
         if keyword in self.logs:
-            del self.logs[keyword]
-            self.save()
+            self._append({"time": time.time(), "keyword": keyword, "cleared": True})
 
 
 # 全局实例
 config_manager = JPMAIConfigManager()
 trigger_log = TriggerLogManager()
+telemetry = TelemetryStore()
+recent_messages = RecentMessageBuffer()
+message_cache = MessageCache()
+generation_scheduler = GenerationScheduler(
+    config_manager.max_concurrency, config_manager.queue_timeout
+)
+generation_pool = GenerationPool(config_manager)
+generation_flights = SingleFlight(generation_scheduler)
 
 
 @listener(
     command="jpmai",
     description="JPMAI 插件管理 - AI 生成艳情文案",
-    parameters="<on|off|set|delete|list|owner|status|anchor|api|model|test> 或 <关键词> <on|off>",
+    parameters="<on|off|set|delete|list|owner|status|anchor|api|endpoint|model|stream|budget|hedge|queue|pool|stats|test> 或 <关键词> <on|off>",
     is_plugin=True,
 )
 async def jpmai_command(message: Message):
@@ -536,8 +2885,24 @@ async def jpmai_command(message: Message):
         await manage_anchor(message)
     elif cmd == "api":
         await set_api(message)
+    elif cmd == "endpoint":
+        await manage_endpoints(message)
     elif cmd == "model":
         await set_model(message)
+    elif cmd == "stream":
+        await set_stream(message)
+    elif cmd == "budget":
+        await set_token_budget(message)
+    elif cmd == "hedge":
+        await set_hedge(message)
+    elif cmd == "queue":
+        await manage_queue(message)
+    elif cmd == "pool":
+        await manage_pool(message)
+    elif cmd == "stats":
+        await show_stats(message)
+    elif cmd == "test" and len(params) > 1 and params[1] == "bench":
+        await run_benchmark(message)
     elif cmd == "test":
         await test_connectivity(message)
     else:
@@ -558,6 +2923,7 @@ async def toggle_keyword_status(message: Message, keyword: str, enabled: bool):
         return
 
     success, msg = config_manager.set_keyword_status(keyword, enabled)
+    generation_pool.schedule()
     if success:
         await message.edit(f"✅ {msg}")
     else:
@@ -572,9 +2938,18 @@ async def show_help(message: Message):
 **,jpmai off** - 关闭全局功能
 **,jpmai <关键词> on** - 开启指定关键词
 **,jpmai <关键词> off** - 关闭指定关键词
-**,jpmai api <URL> <密钥> [模型]** - 设置 API 配置
+**,jpmai api <URL> <密钥> [模型]** - 设置 API 配置（多个密钥以逗号分隔，被限流时自动换用）
+**,jpmai endpoint [add <URL> <密钥> [模型] [权重] | delete <序号> | weight <序号> <权重>]** - 查看/管理端点（序号 1 为主端点）
 **,jpmai model <模型名>** - 单独切换模型
+**,jpmai stream <on|off>** - 开启/关闭流式输出
+**,jpmai budget [on|off]** - 查看 token 用量 / 开关自适应 token 预算
+**,jpmai hedge [百分位|off]** - 查看/设置对冲请求（如 `,jpmai hedge 90`）
+**,jpmai queue [并发上限] [排队超时秒]** - 查看/设置生成调度
+**,jpmai pool [深度] [并发] [有效期秒]** - 查看/设置预生成池，`,jpmai pool clear` 清空
+**,jpmai pool batch <候选数>** - 非流式生成时一次请求多个候选（需 API 支持 n 参数），多出的放入预生成池
 **,jpmai test** - 测试 AI 生成的连通性
+**,jpmai test bench <次数> <并发>** - 按指定并发压测 API，报告吞吐量、延迟与错误分布
+**,jpmai stats [reset]** - 查看/清空各模型的耗时与 token 用量统计
 **,jpmai set <关键词> <用户ID> <群组ID> [秒数]** - 添加/更新关键词配置
 **,jpmai delete <关键词>** - 删除关键词配置
 **,jpmai list** - 列出所有关键词配置
@@ -584,6 +2959,7 @@ async def show_help(message: Message):
 
 **API 配置示例:**
 `,jpmai api http://example.com:8317 sk-xxxx glm-4.6`
+`,jpmai api http://example.com:8317 sk-aaaa,sk-bbbb glm-4.6`
 
 **切换模型示例:**
 `,jpmai model glm-4.6`
@@ -596,6 +2972,7 @@ async def show_help(message: Message):
 **测试功能:**
 - 使用 `,jpmai test` 测试单人/双人文案生成的连通性
 - 测试时会自动生成一段单人文案和双人文案，验证 API 是否正常工作
+- 同时显示首次请求与复用连接的延迟，以及每次生成的耗时
 
 **触发方式:**
 - 在群组中发送 `/关键词` 触发 AI 生成单人文案
@@ -603,8 +2980,16 @@ async def show_help(message: Message):
 
 **说明:**
 本插件使用 AI 模型实时生成仿明清艳情小说风格的文案，支持单人和双人场景。
-- 内置自动重试机制：API 超时或失败时自动重试1次
+- 内置自动重试机制：API 超时、限流（429）或服务端错误时按指数退避重试，遵守 Retry-After
+- 多端点：可添加多个兼容 OpenAI 的备用端点，按权重与实时延迟/错误率分流，失败时自动切换
+- token 预算：按目标字数和实际用量自动设置 max_tokens，流式输出收到完整正文后立即结束
+- 对冲请求：非流式生成耗时超过最近请求的指定百分位时，再发一次相同请求，先完成者胜出
+- 熔断保护：API 连续失败后暂停请求，一段时间后试探恢复，状态见 `,jpmai status`
+- 流式输出：开启后生成出第一句话即回复，之后边生成边编辑消息
+- 生成调度：限制同时进行的生成请求数，主人的触发优先，排队超时自动放弃
+- 预生成池：空闲时为每个关键词预先生成文案，触发时直接回复，池空时才实时生成
 - 支持灵活切换模型：可随时更换不同的 AI 模型
+- 连接复用：API 请求共用长连接池（安装 h2 时启用 HTTP/2），减少握手开销
 - 关键词独立开关：每个关键词可单独开启/关闭
 - 测试功能：验证 AI 生成连通性，确保配置正确"""
     await message.edit(help_text)
@@ -621,6 +3006,7 @@ async def enable_feature(message: Message):
         return
 
     config_manager.enabled = True
+    generation_pool.schedule()
     config_manager.save()
 
     if not config_manager.keywords:
@@ -662,9 +3048,78 @@ async def set_api(message: Message):
     model = params[3] if len(params) > 3 else None
 
     msg = config_manager.set_api(api_url, api_key, model)
+    generation_pool.clear()
     await message.edit(f"✅ {msg}")
 
 
+async def manage_endpoints(message: Message):
+    """查看/管理备用端点"""
+    if not check_permission(message):
+        await message.edit("❌ 权限不足！只有主人可以执行此操作")
+        return
+
+    params = message.arguments.split()
+    usage = (
+        "❌ 参数错误！\n使用 `,jpmai endpoint add <URL> <密钥> [模型] [权重]`、"
+        "`,jpmai endpoint delete <序号>` 或 `,jpmai endpoint weight <序号> <权重>`\n\n示例：\n"
+        "`,jpmai endpoint add http://example.com:8317 sk-xxxx glm-4.6 2`\n"
+        "`,jpmai endpoint weight 1 3`"
+    )
+
+    if len(params) == 1:
+        if not config_manager.is_api_configured():
+            await message.edit("❌ 请先配置 API\n使用 `,jpmai api <URL> <密钥> [模型]`")
+            return
+        generator = config_manager.get_generator()
+        lines = ["**API 端点:**", ""]
+        for index, (endpoint, weight) in enumerate(generator.endpoints, 1):
+            role = "主端点" if index == 1 else "备用"
+            lines.append(
+                f"{index}. [{role}] `{endpoint.api_url}` 模型 `{endpoint.model}` 权重 {weight:g}"
+            )
+            lines.append(f"    {endpoint.health.describe()}")
+            lines.append(f"    {endpoint.breaker.describe()}")
+            if len(endpoint.keys) > 1:
+                lines.extend(f"    {line}" for line in endpoint.keys.describe())
+        await message.edit("\n".join(lines))
+        return
+
+    action = params[1].lower()
+    if action == "add" and len(params) >= 4:
+        api_url = params[2]
+        api_key = params[3]
+        model = params[4] if len(params) > 4 else None
+        try:
+            weight = float(params[5]) if len(params) > 5 else 1.0
+        except ValueError:
+            await message.edit(usage)
+            return
+        msg = config_manager.add_endpoint(api_url, api_key, model, weight)
+        generation_pool.clear()
+        await message.edit(f"✅ {msg}")
+    elif action == "delete" and len(params) >= 3:
+        try:
+            index = int(params[2])
+        except ValueError:
+            await message.edit(usage)
+            return
+        success, msg = config_manager.delete_endpoint(index)
+        if success:
+            generation_pool.clear()
+        await message.edit(f"{'✅' if success else '❌'} {msg}")
+    elif action == "weight" and len(params) >= 4:
+        try:
+            index = int(params[2])
+            weight = float(params[3])
+        except ValueError:
+            await message.edit(usage)
+            return
+        success, msg = config_manager.set_endpoint_weight(index, weight)
+        await message.edit(f"{'✅' if success else '❌'} {msg}")
+    else:
+        await message.edit(usage)
+
+
 async def set_model(message: Message):
     """单独设置模型"""
     if not check_permission(message):
@@ -680,9 +3135,193 @@ async def set_model(message: Message):
 
     model = params[1]
     msg = config_manager.set_model(model)
+    generation_pool.clear()
+    await message.edit(f"✅ {msg}")
+
+
+async def set_token_budget(message: Message):
+    """查看 token 用量 / 开关自适应 token 预算"""
+    if not check_permission(message):
+        await message.edit("❌ 权限不足！只有主人可以执行此操作")
+        return
+
+    params = message.arguments.split()
+    if len(params) == 1:
+        generator = config_manager.get_generator()
+        if not generator:
+            await message.edit("❌ 请先配置 API\n使用 `,jpmai api <URL> <密钥> [模型]`")
+            return
+        status = "✅ 已开启" if config_manager.token_budget else "❌ 已关闭"
+        lines = [f"**自适应 token 预算:** {status}", ""]
+        for index, endpoint in enumerate(generator.generators, 1):
+            lines.append(f"{index}. `{endpoint.api_url}` 模型 `{endpoint.model}`")
+            lines.append(f"    {endpoint.token_budget.describe()}")
+        await message.edit("\n".join(lines))
+        return
+
+    if params[1].lower() not in ("on", "off"):
+        await message.edit("❌ 参数错误！\n使用 `,jpmai budget [on|off]`")
+        return
+
+    msg = config_manager.set_token_budget(params[1].lower() == "on")
+    await message.edit(f"✅ {msg}")
+
+
+async def set_hedge(message: Message):
+    """查看/设置对冲请求"""
+    if not check_permission(message):
+        await message.edit("❌ 权限不足！只有主人可以执行此操作")
+        return
+
+    params = message.arguments.split()
+    if len(params) == 1:
+        generator = config_manager.get_generator()
+        if not generator:
+            await message.edit("❌ 请先配置 API\n使用 `,jpmai api <URL> <密钥> [模型]`")
+            return
+        p50 = generator.latency_percentile(50)
+        p99 = generator.latency_percentile(99)
+        latency_info = (
+            f"p50 {p50:.1f} 秒，p99 {p99:.1f} 秒"
+            if p50 is not None
+            else f"样本不足（至少 {HEDGE_MIN_SAMPLES} 次成功生成）"
+        )
+        await message.edit(
+            f"**对冲请求:** {generator.describe_hedge()}\n最近生成耗时: {latency_info}"
+        )
+        return
+
+    if params[1].lower() == "off":
+        percentile = 0
+    else:
+        try:
+            percentile = int(params[1])
+        except ValueError:
+            await message.edit(
+                "❌ 参数错误！\n使用 `,jpmai hedge <百分位|off>`\n\n示例：\n`,jpmai hedge 90`"
+            )
+            return
+
+    msg = config_manager.set_hedge(percentile)
+    await message.edit(f"✅ {msg}")
+
+
+async def manage_queue(message: Message):
+    """查看/设置生成调度"""
+    if not check_permission(message):
+        await message.edit("❌ 权限不足！只有主人可以执行此操作")
+        return
+
+    params = message.arguments.split()
+    if len(params) == 1:
+        await message.edit(
+            f"**生成调度:**\n\n{generation_scheduler.describe()}\n"
+            f"排队超时: {generation_scheduler.timeout} 秒\n"
+            f"已放行: {generation_scheduler.stats['granted']} 次\n"
+            f"请求合并: {generation_flights.describe()}"
+        )
+        return
+
+    try:
+        concurrency = int(params[1])
+        queue_timeout = (
+            int(params[2]) if len(params) > 2 else config_manager.queue_timeout
+        )
+    except ValueError:
+        await message.edit(
+            "❌ 参数错误！\n使用 `,jpmai queue [并发上限] [排队超时秒]`\n\n示例：\n`,jpmai queue 4 60`"
+        )
+        return
+
+    msg = config_manager.set_scheduler(concurrency, queue_timeout)
+    generation_scheduler.configure(
+        config_manager.max_concurrency, config_manager.queue_timeout
+    )
+    await message.edit(f"✅ {msg}")
+
+
+async def manage_pool(message: Message):
+    """查看/设置预生成池"""
+    if not check_permission(message):
+        await message.edit("❌ 权限不足！只有主人可以执行此操作")
+        return
+
+    params = message.arguments.split()
+    if len(params) == 1:
+        lines = [
+            "**预生成池:**",
+            "",
+            f"深度: {config_manager.pool_depth} 条/关键词/模式"
+            + ("（已关闭）" if config_manager.pool_depth <= 0 else ""),
+            f"并发: {config_manager.pool_concurrency}",
+            f"有效期: {config_manager.pool_ttl} 秒",
+            f"批量: 每次请求 {config_manager.pool_batch} 个候选"
+            + ("（已关闭）" if config_manager.pool_batch <= 1 else ""),
+            f"命中: {generation_pool.hits} 次，未命中: {generation_pool.misses} 次",
+        ]
+        for keyword in config_manager.keywords:
+            lines.append(
+                f"`{keyword}`: 单人 {generation_pool.count(keyword, 'single')} 条，"
+                f"双人 {generation_pool.count(keyword, 'dual')} 条"
+            )
+        await message.edit("\n".join(lines))
+        return
+
+    if params[1].lower() == "clear":
+        generation_pool.clear()
+        await message.edit("✅ 预生成池已清空")
+        return
+
+    if params[1].lower() == "batch":
+        try:
+            batch = int(params[2])
+        except (IndexError, ValueError):
+            await message.edit(
+                f"❌ 参数错误！\n使用 `,jpmai pool batch <候选数 1-{POOL_BATCH_MAX}>`\n\n示例：\n`,jpmai pool batch 4`"
+            )
+            return
+        msg = config_manager.set_pool_batch(batch)
+        await message.edit(f"✅ {msg}")
+        return
+
+    try:
+        depth = int(params[1])
+        concurrency = (
+            int(params[2]) if len(params) > 2 else config_manager.pool_concurrency
+        )
+        ttl = int(params[3]) if len(params) > 3 else config_manager.pool_ttl
+    except ValueError:
+        await message.edit(
+            "❌ 参数错误！\n使用 `,jpmai pool [深度] [并发] [有效期秒]`\n\n示例：\n`,jpmai pool 3 1 3600`"
+        )
+        return
+
+    msg = config_manager.set_pool(depth, concurrency, ttl)
+    generation_pool.schedule()
     await message.edit(f"✅ {msg}")
 
 
+async def set_stream(message: Message):
+    """开启/关闭流式输出"""
+    if not check_permission(message):
+        await message.edit("❌ 权限不足！只有主人可以执行此操作")
+        return
+
+    params = message.arguments.split()
+    if len(params) < 2 or params[1].lower() not in ("on", "off"):
+        await message.edit("❌ 参数错误！\n使用 `,jpmai stream <on|off>`")
+        return
+
+    config_manager.stream = params[1].lower() == "on"
+    config_manager.save()
+    if config_manager.stream:
+        await message.edit(
+            f"✅ 流式输出已开启\n生成出第一句话即回复，之后每 {STREAM_EDIT_INTERVAL:g} 秒最多编辑一次"
+        )
+    else:
+        await message.edit("✅ 流式输出已关闭")
+
+
 async def set_keyword(message: Message):
     """设置关键词配置"""
     if not check_permission(message):
@@ -703,6 +3342,7 @@ async def set_keyword(message: Message):
         rate_limit = int(params[4]) if len(params) > 4 else DEFAULT_RATE_LIMIT
 
         msg = config_manager.add_keyword(keyword, user_id, chat_id, rate_limit)
+        generation_pool.schedule()
         await message.edit(
             f"✅ {msg}\n用户ID: `{user_id}`\n群组ID: `{chat_id}`\n频率限制: {rate_limit}秒"
         )
@@ -761,15 +3401,54 @@ async def show_status(message: Message):
     api_status = "✅ 已配置" if config_manager.is_api_configured() else "❌ 未配置"
     api_url = f"`{config_manager.api_url}`" if config_manager.api_url else "未设置"
     model = f"`{config_manager.model}`"
+    generator = config_manager.get_generator()
+    breaker_status = (
+        "\n".join(
+            f"  {index}. `{endpoint.api_url}` {endpoint.breaker.describe()}"
+            for index, endpoint in enumerate(generator.generators, 1)
+        )
+        if generator
+        else "  未配置"
+    )
+    stream_status = "✅ 已开启" if config_manager.stream else "❌ 已关闭"
+    hedge_status = generator.describe_hedge() if generator else "未配置"
+    scheduler_status = (
+        f"{generation_scheduler.describe()}，"
+        f"合并相同请求 {generation_flights.coalesced} 次"
+    )
+    pool_status = (
+        f"深度 {config_manager.pool_depth}，命中 {generation_pool.hits} 次，"
+        f"未命中 {generation_pool.misses} 次"
+        if config_manager.pool_depth > 0 or config_manager.pool_batch > 1
+        else "❌ 已关闭"
+    )
+    if config_manager.pool_batch > 1:
+        pool_status += f"，批量 {config_manager.pool_batch} 个候选"
     keywords_list = config_manager.list_keywords()
+    recent_triggers = trigger_log.recent_count()
+    inflight_info = (
+        "、".join(
+            f"`{keyword}` × {count}"
+            for keyword, count in trigger_log.inflight_counts().items()
+        )
+        or "无"
+    )
 
     status_text = f"""**JPMAI 插件状态:**
 
 功能状态: {status}
 主人ID: {owner_info}
+最近24小时触发: {recent_triggers} 次
+进行中触发: {inflight_info}
 API状态: {api_status}
 API地址: {api_url}
 模型: {model}
+端点熔断器:
+{breaker_status}
+流式输出: {stream_status}
+对冲请求: {hedge_status}
+生成调度: {scheduler_status}
+预生成池: {pool_status}
 
 {keywords_list}
 
@@ -826,6 +3505,149 @@ async def manage_anchor(message: Message):
         await message.edit("❌ 未知操作！使用 `set` 或 `clear`")
 
 
+async def show_stats(message: Message):
+    """查看/清空调用统计"""
+    if not check_permission(message):
+        await message.edit("❌ 权限不足！只有主人可以执行此操作")
+        return
+
+    params = message.arguments.split()
+    if len(params) > 1 and params[1].lower() == "reset":
+        telemetry.reset()
+        await message.edit("✅ 调用统计已清空")
+        return
+
+    await message.edit(f"**JPMAI 调用统计:**\n\n{telemetry.describe()}")
+
+
+async def run_benchmark(message: Message):
+    """压测：按指定并发发起多次单人模式生成"""
+    if not check_permission(message):
+        await message.edit("❌ 权限不足！只有主人可以执行此操作")
+        return
+
+    if not config_manager.is_api_configured():
+        await message.edit("❌ 请先配置 API\n使用 `,jpmai api <URL> <密钥> [模型]`")
+        return
+
+    params = message.arguments.split()
+    usage = (
+        f"❌ 参数错误！\n使用 `,jpmai test bench <次数> <并发>`\n"
+        f"次数不超过 {BENCH_MAX_REQUESTS}，并发不超过 {BENCH_MAX_CONCURRENCY}\n\n"
+        f"示例：\n`,jpmai test bench 20 5`"
+    )
+    try:
+        total = int(params[2])
+        concurrency = int(params[3]) if len(params) > 3 else 1
+    except (IndexError, ValueError):
+        await message.edit(usage)
+        return
+    if not (
+        0 < total <= BENCH_MAX_REQUESTS and 0 < concurrency <= BENCH_MAX_CONCURRENCY
+    ):
+        await message.edit(usage)
+        return
+    concurrency = min(concurrency, total)
+
+    # 压测使用独立的生成器，不经过生成调度和预生成池，调用指标只收集不计入调用统计，
+    # 避免影响正式生成的熔断器、端点健康度、对冲延迟窗口与 token 预算
+    generator = config_manager.build_generator()
+    calls: List[Dict] = []
+    collector_token = call_collector.set(calls)
+    latencies: List[float] = []
+    failures: Dict[str, int] = {}
+    remaining = iter(range(total))
+
+    async def worker() -> None:
+        for index in remaining:
+            start = time.perf_counter()
+            result = await generator.generate_single(f"测试用户{index}")
+            if is_generation_error(result):
+                failures[result] = failures.get(result, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    await message.edit(f"⏳ 正在压测: {total} 次生成，并发 {concurrency}...")
+    start = time.perf_counter()
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        while True:
+            done, _ = await asyncio.wait(workers, timeout=BENCH_PROGRESS_INTERVAL)
+            if len(done) == len(workers):
+                break
+            finished = len(latencies) + sum(failures.values())
+            with contextlib.suppress(Exception):
+                await message.edit(
+                    f"⏳ 正在压测: {finished}/{total}，并发 {concurrency}，"
+                    f"已用时 {time.perf_counter() - start:.0f} 秒..."
+                )
+    finally:
+        for task in workers:
+            task.cancel()
+        call_collector.reset(collector_token)
+        await asyncio.gather(*workers, return_exceptions=True)
+        await generator.aclose()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def pct(value: float) -> str:
+        if not latencies:
+            return "-"
+        return f"{latencies[min(len(latencies) - 1, int(value / 100 * len(latencies)))]:.1f}s"
+
+    completion_tokens = sum(call["completion_tokens"] for call in calls)
+    ok_calls = [call for call in calls if call["outcome"] == "ok"]
+    per_request_speed = (
+        sum(call["completion_tokens"] for call in ok_calls)
+        / sum(call["wall"] for call in ok_calls)
+        if ok_calls
+        else 0.0
+    )
+    outcomes: Dict[str, int] = {}
+    for call in calls:
+        outcomes[call["outcome"]] = outcomes.get(call["outcome"], 0) + 1
+    upstream = "、".join(
+        f"{outcome} {count}"
+        for outcome, count in sorted(outcomes.items(), key=lambda item: -item[1])
+    )
+    failure_lines = "".join(
+        f"\n  {count} × {text[:60]}"
+        for text, count in sorted(failures.items(), key=lambda item: -item[1])
+    )
+    retries = sum(max(0, call["attempts"] - 1) for call in calls)
+    attempt_errors: Dict[str, int] = {}
+    for call in calls:
+        for reason, count in call["errors"].items():
+            attempt_errors[reason] = attempt_errors.get(reason, 0) + count
+    attempt_error_info = "、".join(
+        f"{reason} {count}"
+        for reason, count in sorted(attempt_errors.items(), key=lambda item: -item[1])
+    )
+
+    await message.edit(
+        f"""**📊 压测结果**
+
+请求: {total} 次，并发 {concurrency}，总耗时 {elapsed:.1f} 秒
+吞吐量: {len(latencies) / elapsed * 60:.1f} 次成功生成/分钟
+成功: {len(latencies)} 次，失败: {total - len(latencies)} 次{failure_lines}
+
+**延迟（成功生成）:**
+p50 {pct(50)} / p90 {pct(90)} / p99 {pct(99)} / 最大 {pct(100)}
+
+**上游调用:** {len(calls)} 次，重试 {retries} 次
+结果: {upstream or "无"}
+失败尝试: {attempt_error_info or "无"}
+
+**token:**
+输出共 {completion_tokens} tokens，整体 {completion_tokens / elapsed:.1f} tokens/秒
+单请求平均 {per_request_speed:.1f} tokens/秒
+
+模型: `{config_manager.model}`
+端点数: {len(generator.endpoints)}"""
+    )
+
+
 async def test_connectivity(message: Message):
     """测试 AI 生成的连通性"""
     # 检查 API 是否配置
@@ -839,12 +3661,31 @@ async def test_connectivity(message: Message):
         return
 
     # 开始测试
+    await message.edit("⏳ 正在测试 AI 生成的连通性...\n\n正在测试连接延迟...")
+
+    # 测试每个端点的连接延迟：第一次可能需要建立连接，第二次复用连接池中的连接
+    latency_lines = []
+    for endpoint in generator.generators:
+        try:
+            first_ping = await endpoint.ping()
+            warm_ping = await endpoint.ping()
+            latency_lines.append(
+                f"`{endpoint.api_url}`: 首次请求 {first_ping * 1000:.0f} ms，"
+                f"复用连接 {warm_ping * 1000:.0f} ms"
+            )
+        except Exception as e:
+            logs.warning(f"[JPMAI] 端点 {endpoint.api_url} 连接延迟测试失败: {e}")
+            latency_lines.append(f"`{endpoint.api_url}`: 测试失败: {e}")
+    latency_info = "\n".join(latency_lines)
+
     await message.edit("⏳ 正在测试 AI 生成的连通性...\n\n正在测试单人模式...")
     logs.info("[JPMAI] 开始测试单人模式")
 
     # 测试单人模式
     try:
+        start = time.perf_counter()
         single_result = await generator.generate_single("测试用户")
+        single_elapsed = time.perf_counter() - start
         logs.info(f"[JPMAI] 单人模式测试成功")
 
         # 测试双人模式
@@ -853,22 +3694,27 @@ async def test_connectivity(message: Message):
         )
         logs.info("[JPMAI] 开始测试双人模式")
 
+        start = time.perf_counter()
         dual_result = await generator.generate_dual("测试用户A", "测试用户B")
+        dual_elapsed = time.perf_counter() - start
         logs.info(f"[JPMAI] 双人模式测试成功")
 
         # 显示测试结果
         test_result = f"""**✅ AI 生成连通性测试成功！**
 
-**单人模式结果：**
+**单人模式结果（{single_elapsed:.1f} 秒）：**
 {single_result[:100]}{"..." if len(single_result) > 100 else ""}
 
-**双人模式结果：**
+**双人模式结果（{dual_elapsed:.1f} 秒）：**
 {dual_result[:100]}{"..." if len(dual_result) > 100 else ""}
 
 ---
 
 模型: `{config_manager.model}`
-API地址: `{config_manager.api_url}`"""
+API地址: `{config_manager.api_url}`
+连接延迟:
+{latency_info}
+HTTP/2: {"✅ 已启用" if API_ENABLE_HTTP2 and HAS_HTTP2 else "❌ 未启用"}"""
         await message.edit(test_result)
 
     except Exception as e:
@@ -890,6 +3736,104 @@ async def get_target_user_last_message(
         return None
 
 
+async def get_cached_message(client: Client, chat_id: int, message_id: int):
+    """获取消息，优先使用消息缓存，拉取成功后放入缓存"""
+    msg = message_cache.get(chat_id, message_id)
+    if msg:
+        return msg
+    msg = await client.get_messages(chat_id, message_id)
+    if msg and not getattr(msg, "empty", False) and msg.from_user:
+        message_cache.put(msg)
+    return msg
+
+
+async def get_recent_target_message(client: Client, chat_id: int, user_id: int):
+    """
+    获取目标用户的最近一条消息
+    优先使用最近消息缓冲区，缓冲区为空（冷启动）时才扫描聊天历史
+    """
+    for message_id in recent_messages.recent(chat_id, user_id):
+        try:
+            msg = await get_cached_message(client, chat_id, message_id)
+        except Exception as e:
+            logs.warning(f"[JPMAI] 获取缓存消息 {message_id} 失败: {e}")
+            msg = None
+        if msg and not getattr(msg, "empty", False) and msg.from_user:
+            return msg
+        recent_messages.discard(chat_id, user_id, message_id)
+
+    msg = await get_target_user_last_message(client, chat_id, user_id)
+    if msg:
+        recent_messages.push(chat_id, user_id, msg.id)
+        message_cache.put(msg)
+    return msg
+
+
+async def refresh_reply_target(
+    client: Client, target_message: Message, user_id: int
+) -> Optional[Message]:
+    """丢弃回复失败的目标消息的缓存，重新获取目标用户的最近发言，找不到其他消息时返回 None"""
+    chat_id = target_message.chat.id
+    message_cache.discard(chat_id, target_message.id)
+    recent_messages.discard(chat_id, user_id, target_message.id)
+    msg = await get_recent_target_message(client, chat_id, user_id)
+    if not msg or msg.id == target_message.id:
+        return None
+    return msg
+
+
+async def reply_to_target(
+    client: Client,
+    target_message: Message,
+    user_id: int,
+    text: str,
+    streaming: Optional[StreamingReply] = None,
+) -> None:
+    """
+    回复目标消息（流式输出时完成流式回复）
+    回复失败（如目标消息已被删除）时丢弃其缓存，对重新获取的最近发言重试一次，复用已生成的文案
+    """
+    try:
+        if streaming:
+            await streaming.finish(text)
+        else:
+            await target_message.reply(text)
+        return
+    except Exception as e:
+        retry_target = await refresh_reply_target(client, target_message, user_id)
+        if not retry_target:
+            raise
+        logs.warning(
+            f"[JPMAI] 回复消息 {target_message.id} 失败: {e}，改为回复最近发言 {retry_target.id}"
+        )
+    await retry_target.reply(text)
+
+
+async def generate_reply(
+    generator: EndpointRouter,
+    keyword: str,
+    second_name: Optional[str],
+    on_update: Optional[StreamCallback],
+    ticket: Dict,
+) -> Optional[str]:
+    """
+    排队获取生成名额后实时生成文案，排队超时返回 None
+    ticket 为 SingleFlight 的排队信息，合并的请求可借此提高排队优先级
+    """
+    if not await generation_scheduler.acquire(ticket["priority"], ticket=ticket):
+        return None
+    try:
+        if second_name:
+            logs.info(f"[JPMAI] `/{keyword}` 触发双人模式: {keyword} + {second_name}")
+        else:
+            logs.info(f"[JPMAI] `/{keyword}` 触发单人模式: {keyword}")
+        return await generation_pool.generate(
+            generator, keyword, second_name, on_update
+        )
+    finally:
+        generation_scheduler.release()
+
+
 @listener(is_plugin=True, incoming=True, outgoing=False, ignore_edited=True)
 async def track_anchor_messages(message: Message, bot: Client):
     """自动记录目标用户的发言作为锚点消息"""
@@ -905,16 +3849,25 @@ async def track_anchor_messages(message: Message, bot: Client):
     chat_id = message.chat.id
     message_id = message.id
 
-    # 检查是否有任何关键词配置了这个用户作为目标
-    for keyword, config in config_manager.keywords.items():
-        if (
-            config["target_user_id"] == sender_id
-            and config["target_chat_id"] == chat_id
-        ):
+    # 通过索引查找以该用户为目标的关键词，非目标消息只需一次字典查询
+    keywords = config_manager.get_keywords_for_target(sender_id, chat_id)
+    if not keywords:
+        return
+
+    # 记录到最近消息缓冲区，并缓存消息对象供触发时直接回复
+    recent_messages.push(chat_id, sender_id, message_id)
+    message_cache.put(message)
+
+    # 更新所有监听该用户的关键词的锚点消息ID，合并为一次保存
+    updated = False
+    for keyword in keywords:
+        config = config_manager.keywords[keyword]
+        if config.get("anchor_message_id") != message_id:
             config["anchor_message_id"] = message_id
-            config_manager.save()
-            logs.debug(f"[JPMAI] 更新关键词 `{keyword}` 的锚点消息: {message_id}")
-            break
+            updated = True
+        logs.debug(f"[JPMAI] 更新关键词 `{keyword}` 的锚点消息: {message_id}")
+    if updated:
+        config_manager.save()
 
 
 @listener(is_plugin=True, incoming=True, outgoing=True, ignore_edited=True)
@@ -972,9 +3925,9 @@ async def trigger_jpmai(message: Message, bot: Client):
         else False
     )
 
-    # 检查频率限制
-    can_trigger, wait_time = trigger_log.can_trigger(keyword, is_owner)
-    if not can_trigger:
+    # 检查频率限制并同步占用名额，避免并发触发在等待期间同时通过检查
+    reservation, wait_time = trigger_log.reserve(keyword, is_owner)
+    if not reservation:
         logs.info(
             f"[JPMAI] 用户 {trigger_user_id} 触发 `/{keyword}` 过于频繁，需等待 {wait_time} 秒"
         )
@@ -985,66 +3938,120 @@ async def trigger_jpmai(message: Message, bot: Client):
     has_param = param is not None
     use_dual = is_reply_to_someone or has_param
 
-    # 生成回复内容
-    with contextlib.suppress(Exception):
-        target_message = None
-        anchor_message_id = keyword_config.get("anchor_message_id")
+    # 生成回复内容（未成功回复时释放预约）
+    try:
+        with contextlib.suppress(Exception):
+            target_message = None
+            anchor_message_id = keyword_config.get("anchor_message_id")
+
+            # 优先使用锚点消息
+            if anchor_message_id:
+                try:
+                    target_message = await get_cached_message(
+                        bot, message.chat.id, anchor_message_id
+                    )
+                    logs.debug(f"[JPMAI] 使用锚点消息: {anchor_message_id}")
+                except Exception as e:
+                    logs.warning(
+                        f"[JPMAI] 获取锚点消息 {anchor_message_id} 失败: {e}，尝试查找最近发言"
+                    )
+                if not target_message or getattr(target_message, "empty", False):
+                    # 锚点消息已失效，避免再次从缓存或缓冲区获取
+                    target_message = None
+                    message_cache.discard(message.chat.id, anchor_message_id)
+                    recent_messages.discard(
+                        message.chat.id,
+                        keyword_config["target_user_id"],
+                        anchor_message_id,
+                    )
 
-        # 优先使用锚点消息
-        if anchor_message_id:
-            try:
-                target_message = await bot.get_messages(
-                    message.chat.id, anchor_message_id
-                )
-                logs.debug(f"[JPMAI] 使用锚点消息: {anchor_message_id}")
-            except Exception as e:
-                logs.warning(
-                    f"[JPMAI] 获取锚点消息 {anchor_message_id} 失败: {e}，尝试查找最近发言"
+            # 如果没有锚点消息，则查找最近发言
+            if not target_message:
+                target_message = await get_recent_target_message(
+                    bot, message.chat.id, keyword_config["target_user_id"]
                 )
 
-        # 如果没有锚点消息，则查找最近发言
-        if not target_message:
-            target_message = await get_target_user_last_message(
-                bot, message.chat.id, keyword_config["target_user_id"]
-            )
+            if target_message and target_message.from_user:
+                second_name = None
+                if use_dual:
+                    # 双人模式：确定第二个名字
+                    if has_param:
+                        second_name = param
+                    elif is_reply_to_someone and message.reply_to_message.from_user:
+                        replied_user = message.reply_to_message.from_user
+                        second_name = (
+                            replied_user.username
+                            or replied_user.first_name
+                            or str(replied_user.id)
+                        )
+
+                # 流式输出时边生成边回复，否则生成完毕后一次性回复
+                streaming = (
+                    StreamingReply(target_message) if config_manager.stream else None
+                )
+                on_update = streaming.update if streaming else None
 
-        if target_message and target_message.from_user:
-            if use_dual:
-                # 双人模式：确定第二个名字
-                if has_param:
-                    second_name = param
-                elif is_reply_to_someone and message.reply_to_message.from_user:
-                    replied_user = message.reply_to_message.from_user
-                    second_name = (
-                        replied_user.username
-                        or replied_user.first_name
-                        or str(replied_user.id)
+                # 优先使用预生成池中的文案
+                reply_text = generation_pool.take(
+                    keyword, "dual" if second_name else "single"
+                )
+                if reply_text and second_name:
+                    reply_text = reply_text.replace(
+                        POOL_TARGET_PLACEHOLDER, second_name
                     )
-                else:
-                    second_name = None
 
-                if second_name:
-                    logs.info(
-                        f"[JPMAI] `/{keyword}` 触发双人模式: {keyword} + {second_name}"
-                    )
-                    reply_text = await generator.generate_dual(keyword, second_name)
+                if reply_text:
+                    logs.info(f"[JPMAI] `/{keyword}` 使用预生成文案")
                 else:
-                    logs.info(f"[JPMAI] `/{keyword}` 触发单人模式: {keyword}")
-                    reply_text = await generator.generate_single(keyword)
-            else:
-                # 单人模式
-                logs.info(f"[JPMAI] `/{keyword}` 触发单人模式: {keyword}")
-                reply_text = await generator.generate_single(keyword)
+                    # 相同的生成进行中时等待同一结果（流式预览只显示在发起者的回复中）
+                    reply_text = await generation_flights.run(
+                        (
+                            config_manager.model,
+                            "dual" if second_name else "single",
+                            keyword,
+                            second_name,
+                        ),
+                        GenerationScheduler.PRIORITY_OWNER
+                        if is_owner
+                        else GenerationScheduler.PRIORITY_USER,
+                        lambda ticket: generate_reply(
+                            generator, keyword, second_name, on_update, ticket
+                        ),
+                    )
+                    if reply_text is None:
+                        logs.warning(
+                            f"[JPMAI] `/{keyword}` 排队超过 {generation_scheduler.timeout} 秒，已放弃"
+                        )
+                        return
+
+                # 生成失败时不回复目标，由 finally 释放预约（流式预览已发出时一并删除）
+                if is_generation_error(reply_text):
+                    logs.warning(f"[JPMAI] `/{keyword}` {reply_text}")
+                    if streaming and streaming.sent:
+                        with contextlib.suppress(Exception):
+                            await streaming.sent.delete()
+                    return
+
+                await reply_to_target(
+                    bot,
+                    target_message,
+                    keyword_config["target_user_id"],
+                    reply_text,
+                    streaming,
+                )
 
-            await target_message.reply(reply_text)
+                # 记录触发时间
+                trigger_log.commit(reservation, trigger_user_id, message.chat.id)
+                reservation = None
 
-            # 记录触发时间
-            trigger_log.record_trigger(keyword)
+                # 删除触发的命令消息
+                with contextlib.suppress(Exception):
+                    await message.delete()
+            else:
+                logs.warning(
+                    f"[JPMAI] 未找到目标用户 {keyword_config['target_user_id']} 的回复目标"
+                )
+    finally:
+        if reservation:
+            trigger_log.rollback(reservation)
 
-            # 删除触发的命令消息
-            with contextlib.suppress(Exception):
-                await message.delete()
-        else:
-            logs.warning(
-                f"[JPMAI] 未找到目标用户 {keyword_config['target_user_id']} 的回复目标"
-            )
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 客户端离线基准测试
+在进程内启动本地 OpenAI 兼容模拟服务，分别用 jpmai（httpx，普通与流式）
+和 ais（aiohttp）的调用路径并发请求，统计成功率、延迟分位数与服务端请求分布
+
+用法: python scripts/bench_api.py [--requests 200] [--concurrency 20] [--keys 1] [模拟服务参数]
+例如: python scripts/bench_api.py --latency lognormal:0.3,0.6 --rate-429 0.1 --retry-after 0.5
+      python scripts/bench_api.py --rpm 30 --keys 4  # 每个密钥每分钟 30 次，对比密钥数量的影响
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from bench_utils import load_plugin, percentile
+from mock_openai_server import MockOptions, MockServer, add_mock_arguments
+
+
+async def run_load(
+    call: Callable[[int], Awaitable[Optional[str]]],
+    is_error: Callable[[Optional[str]], bool],
+    requests: int,
+    concurrency: int,
+) -> Dict:
+    """以固定并发发出 requests 个请求"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    cursor = iter(range(requests))
+
+    async def worker() -> None:
+        for index in cursor:
+            start = time.perf_counter()
+            text = await call(index)
+            latencies.append(time.perf_counter() - start)
+            if is_error(text):
+                reason = (text or "空响应")[:30]
+                errors[reason] = errors.get(reason, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "seconds": elapsed,
+        "ok": requests - sum(errors.values()),
+        "errors": errors,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def report(name: str, requests: int, result: Dict, server: MockServer) -> None:
+    print(
+        f"\n{name}\n"
+        f"  成功 {result['ok']}/{requests}，耗时 {result['seconds']:.2f} 秒，"
+        f"{requests / result['seconds']:.1f} 次/秒\n"
+        f"  延迟 p50 {result['p50'] * 1000:.0f} 毫秒 · "
+        f"p95 {result['p95'] * 1000:.0f} 毫秒 · p99 {result['p99'] * 1000:.0f} 毫秒"
+    )
+    for reason, count in sorted(result["errors"].items(), key=lambda x: -x[1]):
+        print(f"  失败 {count} 次: {reason}")
+    print(f"  服务端: {dict(sorted(server.stats.items()))}")
+    server.stats.clear()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="API 客户端离线基准测试")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--keys", type=int, default=1, help="使用的密钥数量")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = await MockServer(MockOptions.from_args(args)).start()
+    jpmai = load_plugin("jpmai")
+    ais = load_plugin("ais")
+    print(
+        f"模拟服务 {server.url}，{args.requests} 个请求，并发 {args.concurrency}，"
+        f"密钥 {args.keys} 个"
+    )
+
+    def api_key(name: str) -> str:
+        # 每组测试使用不同的密钥，避免模拟服务的每分钟请求数限制相互影响
+        return ",".join(f"sk-{name}-{i}" for i in range(1, args.keys + 1))
+
+    try:
+        for stream in (False, True):
+            generator = jpmai.AIGenerator(
+                server.url, api_key(f"jpmai{int(stream)}"), "mock-model"
+            )
+            call_api = generator._call_api
+            if stream:
+
+                async def on_update(text: str) -> None:
+                    return None
+
+                call = lambda i: call_api(f"请求 {i}", on_update)  # noqa: E731
+            else:
+                call = lambda i: call_api(f"请求 {i}")  # noqa: E731
+            result = await run_load(
+                call, jpmai.is_generation_error, args.requests, args.concurrency
+            )
+            await generator.aclose()
+            report(
+                f"jpmai {'流式' if stream else '普通'}",
+                args.requests,
+                result,
+                server,
+            )
+
+        url = f"{server.url}/v1/chat/completions"
+        ais_key = api_key("ais")
+        result = await run_load(
+            lambda i: ais.call_ai_api(url, ais_key, "mock-model", f"请求 {i}"),
+            lambda text: not text or text.startswith(("API调用失败", "请求超时", "调用异常")),
+            args.requests,
+            args.concurrency,
+        )
+        report("ais", args.requests, result, server)
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JPMAI 文案提取基准测试
+对比旧实现（逐段用 any() 匹配全部过滤词）与新实现（预编译正则一次匹配全部过滤词，
+按长度从长到短惰性判断，先去掉思考过程）的提取器，
+并校验两者结果一致；对带 <think> 思考过程的输出，以旧实现处理去掉思考过程后的文本为准，
+未闭合的思考过程（输出被截断）必须提取不到内容，不能把思考过程当作文案
+
+用法: python scripts/bench_extract.py [迭代次数] [思考过程字数]
+"""
+
+import random
+import sys
+from typing import List, Optional
+
+from bench_utils import load_plugin, measure
+
+LEGACY_FILTER_KEYWORDS = [
+    "拆解",
+    "构思",
+    "初稿",
+    "步骤",
+    "内心活动",
+    "场景构建",
+    "起草",
+    "润色",
+    "构思",
+    "最终",
+    "修改",
+    "提炼",
+    "首先",
+    "其次",
+    "然后",
+    "最后",
+    "总之",
+    "第一",
+    "第二",
+    "第三",
+    "段落",
+    "标题",
+]
+
+BODY_SENTENCES = [
+    "烛影摇红，罗帐低垂，",
+    "她倚在窗前，月色如水，",
+    "一缕暗香自衣襟间溢出，",
+    "指尖轻颤，呼吸渐促，",
+    "春夜寂寂，更漏声声，",
+    "鬓发微乱，粉面含羞，",
+]
+THINK_SENTENCES = [
+    "用户要求写一段文案，我需要先拆解需求。",
+    "首先确定场景，然后安排人物动作。",
+    "这里的语气要半文半白，再润色一下。",
+    "字数控制在三百字左右，最后检查一遍。",
+    "想一想如何营造氛围，烛光和月色都可以用。",
+]
+
+
+def legacy_extract(raw_content: str) -> Optional[str]:
+    """旧版 AIGenerator._extract_content"""
+    paragraphs = [p.strip() for p in raw_content.split("\n") if p.strip()]
+    if not paragraphs:
+        return None
+    if len(paragraphs) == 1:
+        return paragraphs[0]
+    filtered_paragraphs = []
+    for para in paragraphs:
+        if any(keyword in para for keyword in LEGACY_FILTER_KEYWORDS):
+            continue
+        if len(para) < 30 and (
+            "：" in para or ":" in para or para.endswith("：") or para.endswith(":")
+        ):
+            continue
+        filtered_paragraphs.append(para)
+    if not filtered_paragraphs:
+        filtered_paragraphs = paragraphs
+    longest_para = max(filtered_paragraphs, key=len)
+    if len(longest_para) > 400:
+        longest_para = longest_para[:350] + "..."
+    return longest_para
+
+
+def body(rng: random.Random, length: int) -> str:
+    text = ""
+    while len(text) < length:
+        text += rng.choice(BODY_SENTENCES)
+    return text[:length] + "。"
+
+
+def think(rng: random.Random, length: int) -> str:
+    lines = []
+    size = 0
+    while size < length:
+        line = "".join(rng.choice(THINK_SENTENCES) for _ in range(rng.randint(1, 4)))
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+def build_corpora(think_chars: int, seed: int = 42) -> dict:
+    """生成几类典型输出"""
+    rng = random.Random(seed)
+    plain = [body(rng, rng.randint(260, 380)) for _ in range(50)]
+    drafts = [
+        "\n\n".join(
+            [
+                "**构思：**",
+                think(rng, 300),
+                "初稿：",
+                body(rng, rng.randint(200, 300)),
+                "最终文案：",
+                body(rng, rng.randint(280, 450)),
+                "标题：春夜",
+            ]
+        )
+        for _ in range(50)
+    ]
+    reasoning = [
+        f"<think>\n{think(rng, think_chars)}\n</think>\n\n{body(rng, rng.randint(280, 360))}"
+        for _ in range(20)
+    ]
+    # 开始标签在对话模板中，只输出结束标签
+    reasoning_close_only = [
+        f"{think(rng, think_chars)}\n</think>\n{body(rng, rng.randint(280, 360))}"
+        for _ in range(20)
+    ]
+    # 思考过程未结束就被 max_tokens 截断
+    reasoning_unclosed = [f"<think>\n{think(rng, think_chars)}" for _ in range(20)]
+    return {
+        "单段正文": plain,
+        "思考+多版本": drafts,
+        "<think> 推理输出": reasoning,
+        "仅 </think> 推理输出": reasoning_close_only,
+        "未闭合 <think> 截断输出": reasoning_unclosed,
+    }
+
+
+def check(jpmai, generator, name: str, samples: List[str]) -> str:
+    """校验结果一致性"""
+    same_raw = sum(generator._extract_content(s) == legacy_extract(s) for s in samples)
+    same_stripped = sum(
+        generator._extract_content(s)
+        == legacy_extract(jpmai.AIGenerator._strip_reasoning(s))
+        for s in samples
+    )
+    if same_stripped != len(samples):
+        raise SystemExit(f"{name}: 提取结果与旧实现不一致")
+    leaked = sum(
+        generator._extract_content(s) is not None
+        for s in samples
+        if not jpmai.AIGenerator._strip_reasoning(s).strip()
+    )
+    if leaked:
+        raise SystemExit(f"{name}: {leaked} 条只有思考过程的输出提取出了内容")
+    return f"与旧实现一致 {same_raw}/{len(samples)}，去掉思考过程后一致 {same_stripped}/{len(samples)}"
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    think_chars = int(sys.argv[2]) if len(sys.argv) > 2 else 30000
+    jpmai = load_plugin("jpmai")
+    generator = jpmai.AIGenerator("http://127.0.0.1:1", "sk-bench")
+
+    print(f"思考过程约 {think_chars} 字，每类迭代 {iterations} 次")
+    for name, samples in build_corpora(think_chars).items():
+        size = sum(map(len, samples)) / len(samples)
+        print(
+            f"\n{name}（平均 {size:,.0f} 字）: {check(jpmai, generator, name, samples)}"
+        )
+        cursor = iter(range(10**12))
+
+        def run(func):
+            return lambda: func(samples[next(cursor) % len(samples)])
+
+        legacy = measure(run(legacy_extract), iterations)
+        current = measure(run(generator._extract_content), iterations)
+        print(
+            f"  旧实现   {legacy['us_per_op']:>10.2f} 微秒/次\n"
+            f"  新实现   {current['us_per_op']:>10.2f} 微秒/次  "
+            f"（{legacy['us_per_op'] / current['us_per_op']:.1f}x）"
+        )
+
+
+if __name__ == "__main__":
+    main()
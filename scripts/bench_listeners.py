@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全局消息监听器基准测试
+使用桩模块和模拟的 Message / Client，在无 Telegram 账号的环境下
+测量 cai / jpm / jpmai / ais 中处理每条消息的监听器开销
+
+流量构成: 大部分为无关消息，少量为目标用户发言，少量为 /关键词 触发
+输出: 吞吐量（条/秒）、p50/p99 处理延迟、内存分配峰值与残留
+
+用法: python scripts/bench_listeners.py [--messages N] [--mix 无关,目标,触发]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from bench_utils import FakeClient, FakeMessage, load_plugin, percentile
+
+TARGET_CHAT = -1001000000001
+TARGET_USER = 10001
+OWNER_ID = 1
+KEYWORD = "bench"
+EXTRA_TARGETS = 9  # 其他无关的关键词 / 目标配置数量
+CHATS = [TARGET_CHAT] + [-1001000000000 - i for i in range(2, 50)]
+
+Handler = Callable[[FakeMessage, FakeClient], Awaitable[None]]
+
+
+def build_traffic(
+    count: int, mix: Tuple[float, float, float], seed: int
+) -> List[Tuple[str, FakeMessage]]:
+    """生成 (类别, 消息) 列表"""
+    rng = random.Random(seed)
+    other_ratio, target_ratio, _ = mix
+    traffic = []
+    for i in range(count):
+        message_id = 1000 + i
+        roll = rng.random()
+        if roll < other_ratio:
+            text = rng.choice(["早上好", "哈哈哈", "/start", "1", "今天吃什么"])
+            msg = FakeMessage(
+                message_id, rng.choice(CHATS), rng.randint(20000, 90000), text
+            )
+            traffic.append(("无关", msg))
+        elif roll < other_ratio + target_ratio:
+            msg = FakeMessage(message_id, TARGET_CHAT, TARGET_USER, "目标用户发言")
+            traffic.append(("目标", msg))
+        else:
+            text = f"/{KEYWORD} 某人" if rng.random() < 0.3 else f"/{KEYWORD}"
+            user_id = OWNER_ID if rng.random() < 0.2 else rng.randint(20000, 90000)
+            msg = FakeMessage(message_id, TARGET_CHAT, user_id, text)
+            traffic.append(("触发", msg))
+    return traffic
+
+
+def setup_cai(rate_limit: int) -> Dict[str, Handler]:
+    cai = load_plugin("cai")
+    cai.config.enabled = True
+    for i in range(EXTRA_TARGETS):
+        cai.config.add_target(TARGET_USER + 1 + i, CHATS[1 + i], rate_limit)
+    cai.config.add_target(TARGET_USER, TARGET_CHAT, rate_limit)
+    return {"cai.auto_react_handler": cai.auto_react_handler}
+
+
+def setup_jpm(rate_limit: int) -> Dict[str, Handler]:
+    jpm = load_plugin("jpm")
+    jpm.config_manager.enabled = True
+    jpm.config_manager.owner_id = OWNER_ID
+    for i in range(EXTRA_TARGETS):
+        jpm.config_manager.add_keyword(
+            f"kw{i}", TARGET_USER + 1 + i, CHATS[1 + i], rate_limit
+        )
+    jpm.config_manager.add_keyword(KEYWORD, TARGET_USER, TARGET_CHAT, rate_limit)
+    return {
+        "jpm.track_anchor_messages": jpm.track_anchor_messages,
+        "jpm.trigger_jpm": jpm.trigger_jpm,
+    }
+
+
+def setup_jpmai(rate_limit: int) -> Dict[str, Handler]:
+    jpmai = load_plugin("jpmai")
+
+    async def fake_call_api(self, user_prompt: str, on_update=None, extras=None) -> str:
+        return "模拟生成的文案"
+
+    # 不访问网络，只测量插件自身开销
+    jpmai.AIGenerator._call_api = fake_call_api
+    jpmai.config_manager.set_api("http://127.0.0.1:1", "sk-bench")
+    jpmai.config_manager.enabled = True
+    jpmai.config_manager.owner_id = OWNER_ID
+    for i in range(EXTRA_TARGETS):
+        jpmai.config_manager.add_keyword(
+            f"kw{i}", TARGET_USER + 1 + i, CHATS[1 + i], rate_limit
+        )
+    jpmai.config_manager.add_keyword(KEYWORD, TARGET_USER, TARGET_CHAT, rate_limit)
+    return {
+        "jpmai.track_anchor_messages": jpmai.track_anchor_messages,
+        "jpmai.trigger_jpmai": jpmai.trigger_jpmai,
+    }
+
+
+def setup_ais(rate_limit: int) -> Dict[str, Handler]:
+    ais = load_plugin("ais")
+
+    async def handler(message: FakeMessage, bot: FakeClient) -> None:
+        await ais.model_selection_handler(message)
+
+    return {"ais.model_selection_handler": handler}
+
+
+async def run_handler(
+    handler: Handler, traffic: List[Tuple[str, FakeMessage]]
+) -> Dict[str, object]:
+    """依次处理全部消息，记录每条消息的处理延迟"""
+    bot = FakeClient()
+    latencies: Dict[str, List[float]] = {}
+    start = time.perf_counter()
+    for category, msg in traffic:
+        t0 = time.perf_counter_ns()
+        await handler(msg, bot)
+        latencies.setdefault(category, []).append(
+            (time.perf_counter_ns() - t0) / 1000
+        )
+    elapsed = time.perf_counter() - start
+    return {"elapsed": elapsed, "latencies": latencies, "calls": bot.calls}
+
+
+async def run_allocations(
+    handler: Handler, traffic: List[Tuple[str, FakeMessage]]
+) -> Tuple[float, float]:
+    """测量处理全部消息的内存分配峰值与残留（KB）"""
+    bot = FakeClient()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for _, msg in traffic:
+        await handler(msg, bot)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (peak - baseline) / 1024, (current - baseline) / 1024
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="全局消息监听器基准测试")
+    parser.add_argument("--messages", type=int, default=20000, help="消息数量")
+    parser.add_argument(
+        "--mix", default="0.9,0.07,0.03", help="无关,目标发言,触发 的比例"
+    )
+    parser.add_argument(
+        "--rate-limit", type=int, default=0, help="关键词/点踩频率限制（秒）"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    mix = tuple(float(x) for x in args.mix.split(","))
+
+    # ais 的配置目录相对于当前目录，切换到临时目录避免污染仓库
+    os.chdir(tempfile.mkdtemp(prefix="bench_listeners_"))
+
+    handlers: Dict[str, Handler] = {}
+    for setup in (setup_cai, setup_jpm, setup_jpmai, setup_ais):
+        handlers.update(setup(args.rate_limit))
+
+    print(
+        f"消息数 {args.messages}，流量构成 无关/目标/触发 = {args.mix}，"
+        f"频率限制 {args.rate_limit} 秒\n"
+    )
+    for name, handler in handlers.items():
+        result = await run_handler(
+            handler, build_traffic(args.messages, mix, args.seed)
+        )
+        peak_kb, retained_kb = await run_allocations(
+            handler, build_traffic(args.messages, mix, args.seed)
+        )
+        all_latencies = sorted(
+            value for values in result["latencies"].values() for value in values
+        )
+        print(f"{name}")
+        print(
+            f"  吞吐量 {args.messages / result['elapsed']:,.0f} 条/秒  "
+            f"p50 {percentile(all_latencies, 50):.2f} 微秒  "
+            f"p99 {percentile(all_latencies, 99):.2f} 微秒"
+        )
+        for category, values in result["latencies"].items():
+            values.sort()
+            print(
+                f"  {category}: {len(values):>6} 条  "
+                f"p50 {percentile(values, 50):.2f} 微秒  "
+                f"p99 {percentile(values, 99):.2f} 微秒"
+            )
+        print(f"  内存分配峰值 {peak_kb:.1f} KB，残留 {retained_kb:.1f} KB")
+        if result["calls"]:
+            print(f"  Client 调用: {result['calls']}")
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JPM 模板生成基准测试
+对比旧实现（random.choice + 链式 str.replace）与预编译模板（仅单人）+ 洗牌抽样的性能，
+并分别给出渲染与抽样两部分的开销，以及大规模外部语料库的索引与读取耗时
+
+用法: python scripts/bench_templates.py [迭代次数] [语料库条数]
+"""
+
+import asyncio
+import json
+import random
+import sys
+import time
+
+from bench_utils import load_plugin, measure
+
+
+def bench_render(jpm, iterations: int) -> None:
+    """模板渲染与抽样"""
+    generator = jpm.TemplateGenerator()
+    asyncio.run(generator.load_templates())
+    templates = jpm.TEMPLATES_DATA["templates"]
+    single = [t["content"] for t in templates if t["mode"] == "single"]
+    dual = [t["content"] for t in templates if t["mode"] == "dual"]
+
+    def legacy_single():
+        template = random.choice(single)
+        return template.replace("{name}", "关键词").replace("{target_user}", "关键词")
+
+    def legacy_dual():
+        template = random.choice(dual)
+        return template.replace("{name}", "关键词").replace("{target}", "目标用户")
+
+    single_text = max(single, key=len)
+    single_parts = generator._compile("single", single.index(single_text))
+    dual_text = max(dual, key=len)
+
+    cases = [
+        (
+            "渲染 单人 str.replace",
+            lambda: single_text.replace("{name}", "关键词").replace(
+                "{target_user}", "关键词"
+            ),
+        ),
+        ("渲染 单人 预编译", lambda: "关键词".join(single_parts)),
+        (
+            "渲染 双人 str.replace",
+            lambda: dual_text.replace("{name}", "关键词").replace(
+                "{target}", "目标用户"
+            ),
+        ),
+        ("抽样 random.choice", lambda: random.choice(single)),
+        ("抽样 洗牌不重复", lambda: generator._draw("single", len(single), -100)),
+        ("单人 旧实现", legacy_single),
+        ("单人 语料库", lambda: generator.generate_single("关键词", -100)),
+        ("双人 旧实现", legacy_dual),
+        ("双人 语料库", lambda: generator.generate_dual("关键词", "目标用户", -100)),
+    ]
+
+    print(f"模板数量: 单人 {len(single)}，双人 {len(dual)}，迭代 {iterations} 次")
+    for name, func in cases:
+        result = measure(func, iterations)
+        print(
+            f"{name:<22}{result['ops_per_sec']:>12,.0f} 次/秒  "
+            f"{result['us_per_op']:.3f} 微秒/次"
+        )
+
+
+def bench_corpus(jpm, entries: int, iterations: int) -> None:
+    """大规模外部语料库：建立索引、加载索引、按需读取"""
+    with open(jpm.template_corpus_file, "w", encoding="utf-8") as f:
+        for i in range(entries):
+            template = {
+                "id": i,
+                "mode": "single" if i % 2 else "dual",
+                "content": f"第 {i} 条模板：{{name}} 与 {{target}}" * 8,
+            }
+            f.write(json.dumps(template, ensure_ascii=False) + "\n")
+    jpm.template_index_file.unlink(missing_ok=True)
+
+    start = time.perf_counter()
+    asyncio.run(jpm.TemplateGenerator().load_templates())
+    build = time.perf_counter() - start
+
+    generator = jpm.TemplateGenerator()
+    start = time.perf_counter()
+    asyncio.run(generator.load_templates())
+    load = time.perf_counter() - start
+
+    result = measure(
+        lambda: generator.generate_dual("关键词", "目标用户", -100), iterations
+    )
+    print(f"\n语料库 {entries} 条:")
+    print(f"首次建立索引 {build * 1000:.2f} 毫秒，之后加载索引 {load * 1000:.2f} 毫秒")
+    print(f"按需读取生成 {result['us_per_op']:.3f} 微秒/次")
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    entries = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    jpm = load_plugin("jpm")
+    bench_render(jpm, iterations)
+    bench_corpus(jpm, entries, min(iterations, 20000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试公共工具
+在没有 PagerMaid-Pyro 运行环境的机器上加载插件，用于离线性能测试
+"""
+
+import importlib.util
+import logging
+import shutil
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+PLUGIN_DIR = Path(__file__).parent.parent
+
+
+def install_stubs() -> None:
+    """注入最小化的 pagermaid / pyrogram 桩模块（已安装真实模块时不覆盖）"""
+    if "pyrogram" not in sys.modules:
+
+        class ReactionTypeEmoji:
+            def __init__(self, emoji: str):
+                self.emoji = emoji
+
+        class ReactionTypeCustomEmoji:
+            def __init__(self, custom_emoji_id: str):
+                self.custom_emoji_id = custom_emoji_id
+
+        pyrogram = types.ModuleType("pyrogram")
+        pyrogram_types = types.ModuleType("pyrogram.types")
+        pyrogram_types.ReactionTypeEmoji = ReactionTypeEmoji
+        pyrogram_types.ReactionTypeCustomEmoji = ReactionTypeCustomEmoji
+        pyrogram.types = pyrogram_types
+        sys.modules["pyrogram"] = pyrogram
+        sys.modules["pyrogram.types"] = pyrogram_types
+
+    if "pagermaid" in sys.modules:
+        return
+
+    def listener(*args, **kwargs):
+        return lambda func: func
+
+    class Hook:
+        @staticmethod
+        def on_startup():
+            return lambda func: func
+
+        @staticmethod
+        def on_shutdown():
+            return lambda func: func
+
+    class Message:
+        pass
+
+    class Client:
+        pass
+
+    logger = logging.getLogger("pagermaid.bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    modules = {
+        "pagermaid": {},
+        "pagermaid.listener": {"listener": listener},
+        "pagermaid.hook": {"Hook": Hook},
+        "pagermaid.enums": {"Message": Message, "Client": Client},
+        "pagermaid.utils": {"logs": logger},
+    }
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+
+def load_plugin(name: str) -> types.ModuleType:
+    """
+    将插件复制到临时目录后加载
+    插件会把配置文件写在 main.py 同级目录，复制后可避免污染仓库
+    """
+    install_stubs()
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench_{name}_"))
+    shutil.copy(PLUGIN_DIR / name / "main.py", workdir / "main.py")
+    spec = importlib.util.spec_from_file_location(
+        f"bench_{name}", workdir / "main.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeUser:
+    """模拟 pyrogram User"""
+
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.username = f"user{user_id}"
+        self.first_name = f"用户{user_id}"
+        self.is_premium = False
+
+
+class FakeChat:
+    """模拟 pyrogram Chat"""
+
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeMessage:
+    """模拟 pagermaid Message，回复/编辑/删除/点踩均为空操作"""
+
+    def __init__(
+        self,
+        message_id: int,
+        chat_id: int,
+        user_id: Optional[int],
+        text: str = "",
+        reply_to: Optional["FakeMessage"] = None,
+    ):
+        self.id = message_id
+        self.chat = FakeChat(chat_id)
+        self.from_user = FakeUser(user_id) if user_id is not None else None
+        self.text = text
+        self.arguments = ""
+        self.reply_to_message = reply_to
+        self.empty = False
+
+    async def reply(self, text: str, *args, **kwargs) -> "FakeMessage":
+        return FakeMessage(self.id + 1, self.chat.id, 0, text)
+
+    async def edit(self, text: str, *args, **kwargs) -> "FakeMessage":
+        self.text = text
+        return self
+
+    async def delete(self, *args, **kwargs) -> None:
+        return None
+
+    async def react(self, *args, **kwargs) -> None:
+        return None
+
+
+class FakeClient:
+    """模拟 pyrogram Client，记录网络调用次数"""
+
+    def __init__(self, history: Optional[List[FakeMessage]] = None):
+        self.history = history or []
+        self.calls: Dict[str, int] = {}
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def get_me(self) -> FakeUser:
+        self._count("get_me")
+        return FakeUser(0)
+
+    async def get_messages(self, chat_id: int, message_id: int) -> FakeMessage:
+        self._count("get_messages")
+        for msg in self.history:
+            if msg.chat.id == chat_id and msg.id == message_id:
+                return msg
+        return FakeMessage(message_id, chat_id, None)
+
+    async def get_chat_history(self, chat_id: int, limit: int = 100):
+        self._count("get_chat_history")
+        for msg in reversed(self.history[-limit:]):
+            if msg.chat.id == chat_id:
+                yield msg
+
+    async def send_reaction(self, *args, **kwargs) -> None:
+        self._count("send_reaction")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """计算百分位数（values 需已排序）"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def measure(func: Callable[[], object], iterations: int) -> Dict[str, float]:
+    """重复调用 func 并统计吞吐量"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    return {
+        "iterations": iterations,
+        "seconds": elapsed,
+        "ops_per_sec": iterations / elapsed if elapsed else float("inf"),
+        "us_per_op": elapsed / iterations * 1e6,
+    }
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地 OpenAI 兼容模拟服务
+只依赖标准库，提供 /v1/chat/completions（普通与 SSE 流式）和 /v1/models，
+用于在无网络环境下测试 jpmai（httpx）与 ais（aiohttp）的重试、缓存、流式与吞吐量
+
+可模拟: 首字节延迟分布、逐 token 生成耗时、5xx 错误、429 + Retry-After、
+按密钥的每分钟请求数限制、无响应（超时）、推理模型的思考过程输出、n > 1 多候选
+
+用法:
+    python scripts/mock_openai_server.py --port 8317 --latency lognormal:1.5,0.6 \\
+        --error-rate 0.05 --rate-429 0.05 --retry-after 2 --reasoning think
+    然后在 Telegram 中:
+    ,jpmai api http://127.0.0.1:8317 sk-test
+    ,ais set http://127.0.0.1:8317/v1/chat/completions sk-test
+
+模拟服务中 1 个字计为 1 个 token
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+BODY_SENTENCES = [
+    "烛影摇红，罗帐低垂，",
+    "她倚在窗前，月色如水，",
+    "一缕暗香自衣襟间溢出，",
+    "指尖轻颤，呼吸渐促，",
+    "春夜寂寂，更漏声声，",
+    "鬓发微乱，粉面含羞，",
+    "檀郎低语，软玉温香，",
+]
+THINK_SENTENCES = [
+    "用户要求写一段文案，我需要先拆解需求。",
+    "首先确定场景，然后安排人物动作。",
+    "这里的语气要半文半白，再润色一下。",
+    "字数控制在三百字左右，最后检查一遍。",
+]
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class LatencyDistribution:
+    """延迟分布: fixed:秒 / uniform:最小,最大 / lognormal:中位数,sigma"""
+
+    def __init__(self, spec: str):
+        kind, _, args = spec.partition(":")
+        values = [float(x) for x in args.split(",") if x]
+        if kind == "fixed" and len(values) == 1:
+            self._sample = lambda: values[0]
+        elif kind == "uniform" and len(values) == 2:
+            self._sample = lambda: random.uniform(values[0], values[1])
+        elif kind == "lognormal" and len(values) == 2:
+            mu = math.log(values[0]) if values[0] > 0 else 0.0
+            self._sample = lambda: random.lognormvariate(mu, values[1])
+        else:
+            raise ValueError(f"无效的延迟分布: {spec}")
+        self.spec = spec
+
+    def sample(self) -> float:
+        return max(0.0, self._sample())
+
+
+class MockOptions:
+    """模拟服务的行为参数"""
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        token_interval: float = 0.0,
+        length: int = 320,
+        error_rate: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: float = 1.0,
+        rpm: int = 0,
+        hang_rate: float = 0.0,
+        reasoning: str = "none",
+        reasoning_chars: int = 2000,
+        seed: Optional[int] = None,
+    ):
+        self.latency = LatencyDistribution(latency)
+        self.token_interval = token_interval  # 每个 token 的生成耗时（秒）
+        self.length = length  # 正文字数
+        self.error_rate = error_rate  # 返回 500/503 的概率
+        self.rate_429 = rate_429  # 随机返回 429 的概率
+        self.retry_after = retry_after  # 429 的 Retry-After（秒）
+        self.rpm = rpm  # 每个密钥每分钟请求数上限（0 为不限）
+        self.hang_rate = hang_rate  # 不响应的概率（模拟超时）
+        self.reasoning = reasoning  # none / think（<think> 标签）/ field（reasoning_content）
+        self.reasoning_chars = reasoning_chars
+        if seed is not None:
+            random.seed(seed)
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "MockOptions":
+        return cls(
+            latency=args.latency,
+            token_interval=args.token_interval,
+            length=args.length,
+            error_rate=args.error_rate,
+            rate_429=args.rate_429,
+            retry_after=args.retry_after,
+            rpm=args.rpm,
+            hang_rate=args.hang_rate,
+            reasoning=args.reasoning,
+            reasoning_chars=args.reasoning_chars,
+            seed=args.seed,
+        )
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    """添加模拟服务的命令行参数（供其他基准测试脚本复用）"""
+    group = parser.add_argument_group("模拟服务")
+    group.add_argument(
+        "--latency",
+        default="fixed:0",
+        help="首字节延迟分布 fixed:秒 / uniform:最小,最大 / lognormal:中位数,sigma",
+    )
+    group.add_argument(
+        "--token-interval", type=float, default=0.0, help="每个 token 的生成耗时（秒）"
+    )
+    group.add_argument("--length", type=int, default=320, help="正文字数")
+    group.add_argument(
+        "--error-rate", type=float, default=0.0, help="返回 500/503 的概率"
+    )
+    group.add_argument("--rate-429", type=float, default=0.0, help="随机返回 429 的概率")
+    group.add_argument(
+        "--retry-after", type=float, default=1.0, help="429 的 Retry-After（秒）"
+    )
+    group.add_argument(
+        "--rpm", type=int, default=0, help="每个密钥每分钟请求数上限，超出返回 429"
+    )
+    group.add_argument("--hang-rate", type=float, default=0.0, help="不响应的概率")
+    group.add_argument(
+        "--reasoning",
+        choices=["none", "think", "field"],
+        default="none",
+        help="思考过程输出方式: think 为 <think> 标签，field 为 reasoning_content",
+    )
+    group.add_argument(
+        "--reasoning-chars", type=int, default=2000, help="思考过程字数"
+    )
+    group.add_argument("--seed", type=int, default=None)
+
+
+class MockServer:
+    """OpenAI 兼容模拟服务（HTTP/1.1，支持长连接与分块传输）"""
+
+    def __init__(self, options: MockOptions, host: str = "127.0.0.1", port: int = 0):
+        self.options = options
+        self.host = host
+        self.port = port
+        self.stats: Dict[str, int] = {}  # 结果 -> 次数
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: set = set()
+        self._key_usage: Dict[str, Deque[float]] = {}  # 密钥 -> 最近一分钟的请求时间
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "MockServer":
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._handlers):
+                task.cancel()
+            await self._server.wait_closed()
+
+    def _count(self, name: str) -> None:
+        self.stats[name] = self.stats.get(name, 0) + 1
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._dispatch(writer, method, path, headers, body)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._handlers.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _read_request(
+        reader: asyncio.StreamReader,
+    ) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    async def _dispatch(
+        self,
+        writer: asyncio.StreamWriter,
+        method: str,
+        path: str,
+        headers: Dict[str, str],
+        body: bytes,
+    ) -> None:
+        if method == "GET" and path == "/v1/models":
+            self._count("models")
+            await self._send_json(
+                writer,
+                200,
+                {"object": "list", "data": [{"id": "mock-model", "object": "model"}]},
+            )
+            return
+        if method != "POST" or path != "/v1/chat/completions":
+            self._count("404")
+            await self._send_json(writer, 404, {"error": {"message": "not found"}})
+            return
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            self._count("400")
+            await self._send_json(writer, 400, {"error": {"message": "invalid json"}})
+            return
+        await self._completions(writer, headers, payload)
+
+    async def _completions(
+        self, writer: asyncio.StreamWriter, headers: Dict[str, str], payload: Dict
+    ) -> None:
+        options = self.options
+        key = headers.get("authorization", "")
+
+        if options.rpm and not self._take_rate_slot(key):
+            self._count("429_rpm")
+            await self._send_rate_limited(writer)
+            return
+        roll = random.random()
+        if roll < options.hang_rate:
+            self._count("hang")
+            await asyncio.sleep(3600)
+            return
+        roll -= options.hang_rate
+        if roll < options.rate_429:
+            self._count("429")
+            await self._send_rate_limited(writer)
+            return
+        roll -= options.rate_429
+
+        await asyncio.sleep(options.latency.sample())
+        if roll < options.error_rate:
+            status = random.choice([500, 503])
+            self._count(str(status))
+            await self._send_json(
+                writer, status, {"error": {"message": "mock upstream error"}}
+            )
+            return
+
+        n = max(1, int(payload.get("n") or 1))
+        max_tokens = int(payload.get("max_tokens") or 1 << 30)
+        prompt_tokens = sum(
+            len(str(message.get("content", "")))
+            for message in payload.get("messages", [])
+        )
+        # 正文以提示词中引号内的名字开头，便于检查双人文案是否包含目标名
+        messages = payload.get("messages") or [{}]
+        names = re.findall(r'"([^"]+)"', str(messages[-1].get("content", "")))
+        choices = [self._choice_text(max_tokens, names) for _ in range(n)]
+        if payload.get("stream"):
+            self._count("200_stream")
+            await self._stream(writer, choices, prompt_tokens, payload)
+        else:
+            self._count("200")
+            await self._complete(writer, choices, prompt_tokens, payload)
+
+    def _take_rate_slot(self, key: str) -> bool:
+        """按密钥的滑动窗口每分钟请求数限制"""
+        now = time.monotonic()
+        window = self._key_usage.setdefault(key, deque())
+        while window and window[0] <= now - 60:
+            window.popleft()
+        if len(window) >= self.options.rpm:
+            return False
+        window.append(now)
+        return True
+
+    def _choice_text(
+        self, max_tokens: int, names: List[str]
+    ) -> Tuple[str, str, str]:
+        """生成一个候选: (思考过程, 正文, 结束原因)，按 max_tokens 截断（思考过程也计入）"""
+        options = self.options
+        reasoning = ""
+        if options.reasoning != "none":
+            lines = []
+            size = 0
+            while size < options.reasoning_chars:
+                line = random.choice(THINK_SENTENCES)
+                lines.append(line)
+                size += len(line) + 1
+            reasoning = "\n".join(lines)
+        text = "".join(f"{name}，" for name in dict.fromkeys(names))
+        while len(text) < options.length:
+            text += random.choice(BODY_SENTENCES)
+        text = text[: options.length - 1] + "。"
+        if options.reasoning == "think":
+            text = f"<think>\n{reasoning}\n</think>\n\n{text}"
+            reasoning = ""
+        if len(reasoning) >= max_tokens:
+            return reasoning[:max_tokens], "", "length"
+        budget = max_tokens - len(reasoning)
+        if len(text) > budget:
+            return reasoning, text[:budget], "length"
+        return reasoning, text, "stop"
+
+    async def _complete(
+        self,
+        writer: asyncio.StreamWriter,
+        choices: List[Tuple[str, str, str]],
+        prompt_tokens: int,
+        payload: Dict,
+    ) -> None:
+        completion_tokens = sum(len(r) + len(t) for r, t, _ in choices)
+        await asyncio.sleep(
+            self.options.token_interval * max(len(r) + len(t) for r, t, _ in choices)
+        )
+        result = []
+        for index, (reasoning, text, finish) in enumerate(choices):
+            message = {"role": "assistant", "content": text}
+            if reasoning:
+                message["reasoning_content"] = reasoning
+            result.append({"index": index, "message": message, "finish_reason": finish})
+        await self._send_json(
+            writer,
+            200,
+            {
+                "id": f"chatcmpl-mock-{random.getrandbits(32):08x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock-model"),
+                "choices": result,
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+    async def _stream(
+        self,
+        writer: asyncio.StreamWriter,
+        choices: List[Tuple[str, str, str]],
+        prompt_tokens: int,
+        payload: Dict,
+    ) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+        base = {
+            "id": f"chatcmpl-mock-{random.getrandbits(32):08x}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock-model"),
+        }
+
+        async def send(data: str) -> None:
+            event = f"data: {data}\n\n".encode("utf-8")
+            writer.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            await writer.drain()
+
+        # 每次发送 2 个 token，各候选交替输出
+        step = 2
+        streams = []
+        for index, (reasoning, text, finish) in enumerate(choices):
+            parts = [
+                ("reasoning_content", reasoning[i : i + step])
+                for i in range(0, len(reasoning), step)
+            ]
+            parts += [("content", text[i : i + step]) for i in range(0, len(text), step)]
+            streams.append((index, parts, finish))
+
+        position = 0
+        while any(position < len(parts) for _, parts, _ in streams):
+            for index, parts, _ in streams:
+                if position < len(parts):
+                    field, value = parts[position]
+                    chunk = {
+                        **base,
+                        "choices": [
+                            {"index": index, "delta": {field: value}, "finish_reason": None}
+                        ],
+                    }
+                    await send(json.dumps(chunk, ensure_ascii=False))
+            position += 1
+            if self.options.token_interval:
+                await asyncio.sleep(self.options.token_interval * step)
+
+        completion_tokens = sum(len(r) + len(t) for r, t, _ in choices)
+        for index, _, finish in streams:
+            chunk = {
+                **base,
+                "choices": [{"index": index, "delta": {}, "finish_reason": finish}],
+            }
+            await send(json.dumps(chunk))
+        usage = {
+            **base,
+            "choices": [],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        await send(json.dumps(usage))
+        await send("[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _send_rate_limited(self, writer: asyncio.StreamWriter) -> None:
+        await self._send_json(
+            writer,
+            429,
+            {"error": {"message": "rate limit exceeded", "type": "rate_limit"}},
+            {"Retry-After": f"{self.options.retry_after:g}"},
+        )
+
+    @staticmethod
+    async def _send_json(
+        writer: asyncio.StreamWriter,
+        status: int,
+        data: Dict,
+        extra_headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        head = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Unknown')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+        ]
+        for name, value in (extra_headers or {}).items():
+            head.append(f"{name}: {value}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8317)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = await MockServer(MockOptions.from_args(args), args.host, args.port).start()
+    print(f"模拟服务已启动: {server.url}")
+    print(f"jpmai: ,jpmai api {server.url} sk-test")
+    print(f"ais:   ,ais set {server.url}/v1/chat/completions sk-test")
+    try:
+        while True:
+            await asyncio.sleep(30)
+            if server.stats:
+                print("请求统计:", server.stats)
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass